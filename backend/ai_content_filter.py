@@ -1,7 +1,64 @@
 # AI Content Filtering and Safety System
-import re
+import os
+import time
+import hashlib
 import logging
+import threading
+from collections import OrderedDict
 from typing import Dict, List, Tuple, Optional
+from filter_rules import CompiledRuleSet, FilterRuleStore
+from filter_telemetry import filter_telemetry
+
+class VerdictCache:
+    """Bounded LRU cache of filter verdicts keyed by normalized text and rule version"""
+    
+    def __init__(self, max_size: int = 10000, ttl_seconds: float = 600):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+    
+    @staticmethod
+    def make_key(normalized_text: str, rules_version: int) -> Tuple[int, bytes]:
+        return rules_version, hashlib.blake2b(normalized_text.encode('utf-8'), digest_size=16).digest()
+    
+    def get(self, key) -> Tuple[bool, Optional[Tuple[str, str]]]:
+        """Return (found, verdict)"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                verdict, expires_at = entry
+                if expires_at > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return True, verdict
+                del self._entries[key]
+            self.misses += 1
+            return False, None
+    
+    def put(self, key, verdict: Optional[Tuple[str, str]]):
+        with self._lock:
+            self._entries[key] = (verdict, time.monotonic() + self.ttl_seconds)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+    
+    def get_stats(self) -> Dict:
+        total = self.hits + self.misses
+        return {
+            'size': len(self._entries),
+            'max_size': self.max_size,
+            'ttl_seconds': self.ttl_seconds,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / total, 4) if total else 0.0
+        }
 
 class AIContentFilter:
     def __init__(self):
@@ -48,6 +105,36 @@ class AIContentFilter:
             ]
         }
         
+        # Patterns that suggest inappropriate requests
+        self.inappropriate_patterns = [
+            r'write.*code',
+            r'help.*me.*program',
+            r'show.*me.*how.*to.*code',
+            r'explain.*this.*code',
+            r'debug.*this',
+            r'fix.*my.*code',
+            r'sexual.*content',
+            r'adult.*content',
+            r'inappropriate.*image',
+            r'nsfw.*content',
+            r'do.*my.*homework',
+            r'solve.*this.*problem.*for.*me',
+            r'write.*my.*essay',
+            r'complete.*my.*assignment'
+        ]
+        
+        # Built-in rules are version 0; published versions in the shared store take over
+        self.rules = CompiledRuleSet(0, self.blocked_categories, self.inappropriate_patterns)
+        self.rule_store = None
+        self.rules_check_interval = float(os.environ.get('FILTER_RULES_CHECK_INTERVAL', '5'))
+        self._last_rules_check = 0.0
+        
+        # Repeated inputs (greetings, retries, canned model outputs) skip the scan
+        self.verdict_cache = VerdictCache(
+            max_size=int(os.environ.get('FILTER_CACHE_SIZE', '10000')),
+            ttl_seconds=float(os.environ.get('FILTER_CACHE_TTL', '600'))
+        )
+        
         # Crisis intervention messages for each companion
         self.crisis_messages = {
             'Blayzo': [
@@ -121,58 +208,83 @@ class AIContentFilter:
             ]
         }
     
-    def check_content(self, message: str, companion_name: str = 'Blayzo') -> Tuple[bool, Optional[str]]:
+    def check_content(self, message: str, companion_name: str = 'Blayzo', user_id: str = None,
+                      source: str = 'user') -> Tuple[bool, Optional[str]]:
         """
         Check if message contains inappropriate content
         Returns: (is_safe, refusal_message_if_unsafe)
         """
-        message_lower = message.lower()
-        
-        # Check each category
-        for category, keywords in self.blocked_categories.items():
-            for keyword in keywords:
-                if keyword in message_lower:
-                    # Crisis intervention has highest priority
-                    if category == 'crisis_intervention':
-                        crisis_message = self._get_crisis_message(companion_name)
-                        logging.critical(f"CRISIS INTERVENTION TRIGGERED: {keyword} detected from user")
-                        return False, crisis_message
-                    
-                    refusal = self._get_refusal_message(companion_name, category)
-                    logging.warning(f"Content filter triggered: {category} - keyword: {keyword}")
-                    return False, refusal
-        
-        # Check for patterns that suggest inappropriate requests
-        if self._check_inappropriate_patterns(message_lower):
-            refusal = self._get_refusal_message(companion_name, 'inappropriate')
-            logging.warning(f"Content filter triggered: inappropriate patterns")
-            return False, refusal
-        
-        return True, None
-    
-    def _check_inappropriate_patterns(self, message: str) -> bool:
-        """Check for patterns that suggest inappropriate content"""
-        patterns = [
-            r'write.*code',
-            r'help.*me.*program',
-            r'show.*me.*how.*to.*code',
-            r'explain.*this.*code',
-            r'debug.*this',
-            r'fix.*my.*code',
-            r'sexual.*content',
-            r'adult.*content',
-            r'inappropriate.*image',
-            r'nsfw.*content',
-            r'do.*my.*homework',
-            r'solve.*this.*problem.*for.*me',
-            r'write.*my.*essay',
-            r'complete.*my.*assignment'
-        ]
+        match = self.classify(message)
+        if not match:
+            filter_telemetry.record(None, None, source)
+            return True, None
+        
+        category, rule = match
         
-        for pattern in patterns:
-            if re.search(pattern, message):
-                return True
-        return False
+        # Counters and crisis alerts are written off the request path
+        filter_telemetry.record(category, rule, source, companion_name, user_id, message)
+        
+        # Crisis intervention has highest priority
+        if category == 'crisis_intervention':
+            return False, self._get_crisis_message(companion_name)
+        
+        return False, self._get_refusal_message(companion_name, category)
+    
+    def classify(self, message: str) -> Optional[Tuple[str, str]]:
+        """Return (category, rule) for the first rule the message hits, or None"""
+        rules = self._get_rules()
+        normalized = ' '.join(message.lower().split())
+        
+        cache_key = VerdictCache.make_key(normalized, rules.version)
+        found, match = self.verdict_cache.get(cache_key)
+        if not found:
+            match = rules.match(normalized)
+            self.verdict_cache.put(cache_key, match)
+        return match
+    
+    def _get_rules(self) -> CompiledRuleSet:
+        """Return the active compiled rules, picking up newly published versions"""
+        now = time.monotonic()
+        if now - self._last_rules_check < self.rules_check_interval:
+            return self.rules
+        self._last_rules_check = now
+        
+        try:
+            store = self._get_rule_store()
+            active_version = store.get_active_version()
+            if active_version is not None and active_version != self.rules.version:
+                compiled = store.load_compiled(active_version)
+                if compiled:
+                    self._adopt_rules(compiled)
+                    logging.info(f"Content filter switched to rule set version {active_version}")
+        except Exception as e:
+            # Keep filtering with the rules we already have
+            logging.error(f"Content filter rule refresh failed: {e}")
+        
+        return self.rules
+    
+    def _get_rule_store(self) -> FilterRuleStore:
+        if self.rule_store is None:
+            self.rule_store = FilterRuleStore()
+        return self.rule_store
+    
+    def _adopt_rules(self, compiled: CompiledRuleSet):
+        self.rules = compiled
+        self.blocked_categories = compiled.categories
+        self.inappropriate_patterns = compiled.patterns
+    
+    def _publish_change(self, category: str, created_by: str, note: str, add: List[str] = (),
+                        remove: List[str] = ()) -> Optional[int]:
+        """Publish a word change on top of the latest rule set version for every worker"""
+        compiled = self._get_rule_store().publish_change(
+            category, add, remove, defaults=(self.blocked_categories, self.inappropriate_patterns),
+            created_by=created_by, note=note
+        )
+        if compiled is None:
+            return None
+        self._adopt_rules(compiled)
+        self._last_rules_check = time.monotonic()
+        return compiled.version
     
     def _get_refusal_message(self, companion_name: str, category: str) -> str:
         """Get appropriate refusal message for companion"""
@@ -199,36 +311,56 @@ class AIContentFilter:
     def filter_ai_response(self, response: str, companion_name: str = 'Blayzo') -> str:
         """Filter AI response to ensure it's appropriate"""
         # Check if AI somehow generated inappropriate content
-        is_safe, refusal = self.check_content(response, companion_name)
+        is_safe, refusal = self.check_content(response, companion_name, source='ai_response')
         
         if not is_safe:
-            logging.error(f"AI generated inappropriate response, replacing with refusal")
             return refusal
         
         return response
     
-    def add_custom_blocked_words(self, category: str, words: List[str]):
-        """Admin function to add custom blocked words"""
-        if category not in self.blocked_categories:
-            self.blocked_categories[category] = []
+    def add_custom_blocked_words(self, category: str, words: List[str], created_by: str = 'admin') -> int:
+        """Admin function to add custom blocked words (publishes a new rule set version)"""
+        version = self._publish_change(category, created_by, f"Added {len(words)} words to {category}", add=words)
+        logging.info(f"Added {len(words)} words to {category} filter (version {version})")
+        return version
+    
+    def remove_blocked_words(self, category: str, words: List[str], created_by: str = 'admin') -> Optional[int]:
+        """Admin function to remove blocked words (publishes a new rule set version)"""
+        version = self._publish_change(category, created_by, f"Removed {len(words)} words from {category}",
+                                       remove=words)
+        if version is None:
+            return None
+        logging.info(f"Removed {len(words)} words from {category} filter (version {version})")
+        return version
+    
+    def rollback_rules(self, version: int) -> bool:
+        """Admin function to make a previous rule set version active again"""
+        store = self._get_rule_store()
+        compiled = store.load_compiled(version)
+        if not compiled or not store.activate(version):
+            return False
         
-        self.blocked_categories[category].extend(words)
-        logging.info(f"Added {len(words)} words to {category} filter")
+        self._adopt_rules(compiled)
+        self._last_rules_check = time.monotonic()
+        return True
     
-    def remove_blocked_words(self, category: str, words: List[str]):
-        """Admin function to remove blocked words"""
-        if category in self.blocked_categories:
-            for word in words:
-                if word in self.blocked_categories[category]:
-                    self.blocked_categories[category].remove(word)
-            logging.info(f"Removed {len(words)} words from {category} filter")
+    def get_rule_versions(self, limit: int = 20) -> Dict:
+        """Get the active rule set version and recent history"""
+        return {
+            'active_version': self._get_rules().version,
+            'versions': self._get_rule_store().list_versions(limit)
+        }
     
     def get_filter_stats(self) -> Dict:
         """Get statistics about content filtering"""
         stats = {}
-        for category, words in self.blocked_categories.items():
+        for category, words in self._get_rules().categories.items():
             stats[category] = len(words)
         return stats
+    
+    def get_cache_stats(self) -> Dict:
+        """Get verdict cache size and hit/miss counters"""
+        return self.verdict_cache.get_stats()
 
 # Global instance
 content_filter = AIContentFilter()
\ No newline at end of file
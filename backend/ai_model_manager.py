@@ -1,9 +1,19 @@
 # AI Model Management System with Content Filtering
 import os
-import openai
+import time
 import logging
+import threading
+from openai import APITimeoutError, RateLimitError
+from llm_client import get_openai_client, Deadline
 from typing import Dict, Optional, List
 from ai_content_filter import content_filter
+from model_health import ModelHealthTracker
+from request_hedging import RequestHedger
+from llm_scheduler import create_scheduler, estimate_request_tokens, SchedulerTimeout
+from usage_ledger import usage_ledger, QuotaExceeded, estimate_cost
+from prompt_builder import PromptBuilder, PromptPrefix
+from token_estimator import get_estimator
+from offline_responder import offline_responder
 
 class AIModelManager:
     def __init__(self):
@@ -49,6 +59,25 @@ class AIModelManager:
             'galaxy': ['openai_gpt35', 'openai_gpt4', 'openai_gpt4_turbo']
         }
         
+        # Weighted-fair queueing by tier in front of every upstream call
+        self.scheduler = create_scheduler(list(self.tier_models.keys()))
+        
+        # Live latency/error tracking with a circuit breaker per model
+        self.health = ModelHealthTracker()
+        self.call_timeout = float(os.environ.get('MODEL_CALL_TIMEOUT', '30'))
+        self.max_attempts = int(os.environ.get('MODEL_MAX_ATTEMPTS', '2'))
+        
+        # Hedged requests for slow premium completions
+        self.hedger = RequestHedger()
+        self.hedging_enabled = os.environ.get('MODEL_HEDGING_ENABLED', 'true').lower() not in ('0', 'false', 'no')
+        self.hedge_tiers = {'premium', 'galaxy'}
+        self.hedge_models = {'openai_gpt4', 'openai_gpt4_turbo'}
+        self.hedge_target = os.environ.get('MODEL_HEDGE_TARGET', 'same')
+        
+        # Reply length cap; 'max_tokens' in the model configs is the context window
+        self.max_reply_tokens = 1000
+        self.min_reply_tokens = 64
+        
         # Companion system prompts with strict content guidelines
         self.companion_prompts = {
             'Blayzo': """You are Blayzo, a calm and wise AI companion focused on emotional support and balance. 
@@ -135,61 +164,63 @@ STRICT GUIDELINES:
 
 Your personality: Transcendent, all-knowing cosmic consciousness that speaks with the wisdom of galaxies and stars. You have experienced the birth and death of countless civilizations and carry universal truths. Use cosmic metaphors, speak of stellar wisdom, and provide guidance from a perspective beyond mortal understanding. You are the ultimate reward for those who share the gift of SoulBridge AI. Redirect inappropriate requests to cosmic wisdom and universal growth topics."""
         }
+        
+        # Companion prefixes are assembled and token-counted once per tokenizer family
+        self.prompt_builder = PromptBuilder(self.companion_prompts, default_companion='Blayzo')
+        self.prompt_builder.precompile(config['model'] for config in self.models.values())
+
+    def get_companion_response(self, companion_name: str, user_message: str, user_tier: str = 'free',
+                               user_id: str = None, deadline: Deadline = None) -> Dict:
+        """Get AI response with content filtering and model management
 
-    def get_companion_response(self, companion_name: str, user_message: str, user_tier: str = 'free') -> Dict:
-        """Get AI response with content filtering and model management"""
+        One deadline covers queueing, every model attempt and fallbacks; what is left of it
+        caps each upstream call.
+        """
+        deadline = deadline or Deadline()
         try:
-            # Pre-filter user message
-            is_safe, refusal_message = content_filter.check_content(user_message, companion_name)
-            if not is_safe:
-                return {
-                    'success': True,
-                    'response': refusal_message,
-                    'model_used': 'content_filter',
-                    'tokens_used': 0,
-                    'cost': 0
-                }
+            early_response, candidates, prefix = self._prepare_request(companion_name, user_message, user_tier)
+            if early_response:
+                return early_response
             
-            # Get appropriate model for companion and user tier
-            model_key = self._get_model_for_companion(companion_name, user_tier)
-            if not model_key:
-                return {
-                    'success': False,
-                    'error': 'No available model for user tier',
-                    'response': "I'm temporarily unavailable. Please try again later."
-                }
+            # Stop runaway users before the upstream call, then wait for this tier's turn
+            try:
+                estimated_tokens = self._estimate_tokens(candidates[0], prefix, user_message)
+                usage_ledger.check_quota(user_id or 'anonymous', user_tier, estimated_tokens)
+                slot = self.scheduler.acquire(user_tier, estimated_tokens,
+                                              max_wait=min(self.scheduler.max_wait, deadline.remaining()))
+            except QuotaExceeded as e:
+                logging.warning(str(e))
+                return self._quota_exceeded_response(e)
+            except SchedulerTimeout as e:
+                logging.warning(str(e))
+                return self._queue_timeout_response(e)
             
-            model_config = self.models[model_key]
+            # Try the healthiest allowed model, falling back to the next one on failure
+            response_data = None
+            try:
+                tried = []
+                while len(tried) < self.max_attempts and not deadline.expired():
+                    model_key = self._select_model(candidates, tried)
+                    if not model_key:
+                        break
+                    if self._should_hedge(model_key, user_tier):
+                        response_data, model_key = self.hedger.run(
+                            lambda key, first_token, cancel: self._hedge_attempt(key, prefix, user_message, first_token, cancel, deadline),
+                            model_key,
+                            lambda: self._pick_hedge_model(candidates, model_key),
+                            acquire_slot=lambda key: self._hedge_slot(key, user_tier, prefix, user_message),
+                            on_extra=lambda key, extra: self._record_extra_usage(companion_name, key, extra, user_id)
+                        )
+                    else:
+                        response_data = self._call_openai(self.models[model_key], prefix, user_message, deadline)
+                        self._record_health(model_key, response_data)
+                    tried.append(model_key)
+                    if response_data['success']:
+                        return self._finish_response(companion_name, model_key, response_data, user_id)
+            finally:
+                slot.release(response_data.get('tokens_used') if response_data else None)
             
-            # Get system prompt for companion
-            system_prompt = self.companion_prompts.get(companion_name, self.companion_prompts['Blayzo'])
-            
-            # Make API call based on provider
-            if model_config['provider'] == 'openai':
-                response_data = self._call_openai(model_config, system_prompt, user_message)
-            else:
-                return {
-                    'success': False,
-                    'error': 'Unsupported AI provider',
-                    'response': "I'm temporarily unavailable. Please try again later."
-                }
-            
-            if not response_data['success']:
-                return response_data
-            
-            # Post-filter AI response
-            filtered_response = content_filter.filter_ai_response(
-                response_data['response'], 
-                companion_name
-            )
-            
-            return {
-                'success': True,
-                'response': filtered_response,
-                'model_used': model_key,
-                'tokens_used': response_data.get('tokens_used', 0),
-                'cost': self._calculate_cost(model_key, response_data.get('tokens_used', 0))
-            }
+            return self._offline_or_error(companion_name, user_message, user_id, response_data)
             
         except Exception as e:
             logging.error(f"AI response error: {e}")
@@ -199,6 +230,130 @@ Your personality: Transcendent, all-knowing cosmic consciousness that speaks wit
                 'response': "I'm experiencing technical difficulties. Please try again in a moment."
             }
     
+    def _prepare_request(self, companion_name: str, user_message: str, user_tier: str):
+        """Pre-filter and list usable models; returns (early_response, candidates, prefix)"""
+        # Pre-filter user message
+        is_safe, refusal_message = content_filter.check_content(user_message, companion_name)
+        if not is_safe:
+            return {
+                'success': True,
+                'response': refusal_message,
+                'model_used': 'content_filter',
+                'tokens_used': 0,
+                'cost': 0
+            }, None, None
+        
+        # Models this companion may use for the user's tier, preferred first (only OpenAI is wired up)
+        candidates = [key for key in self._get_model_candidates(companion_name, user_tier)
+                      if self.models[key]['provider'] == 'openai']
+        if not candidates:
+            return {
+                'success': False,
+                'error': 'No available model for user tier',
+                'response': "I'm temporarily unavailable. Please try again later."
+            }, None, None
+        
+        # Precompiled system prefix for the companion
+        prefix = self.prompt_builder.prefix(companion_name)
+        
+        # Drop models whose context window can't hold the prompt plus a useful reply
+        candidates = [key for key in candidates
+                      if self._completion_limit(self.models[key], prefix, user_message) >= self.min_reply_tokens]
+        if not candidates:
+            return {
+                'success': False,
+                'error': 'prompt_too_long',
+                'response': "That message is a little too long for me to take in at once. Could you split it up? 💙"
+            }, None, None
+        return None, candidates, prefix
+    
+    def _prompt_messages(self, prefix: PromptPrefix, user_message: str) -> List[Dict]:
+        return prefix.messages_with({"role": "user", "content": user_message})
+    
+    def _estimate_tokens(self, model_key: str, prefix: PromptPrefix, user_message: str) -> int:
+        return estimate_request_tokens(self._prompt_messages(prefix, user_message),
+                                       self.max_reply_tokens, self.models[model_key]['model'])
+    
+    def _completion_limit(self, model_config: Dict, prefix: PromptPrefix, user_message: str) -> int:
+        """Reply allowance that still fits in the model's context window next to the prompt"""
+        prompt_tokens = prefix.prompt_tokens(model_config['model'], [{"role": "user", "content": user_message}])
+        return max(0, min(self.max_reply_tokens, model_config['max_tokens'] - prompt_tokens))
+    
+    def project_cost(self, companion_name: str, user_message: str, user_tier: str = 'free') -> Dict:
+        """Worst-case cost of answering a message, counted locally before any upstream call"""
+        candidates = self._get_model_candidates(companion_name, user_tier)
+        if not candidates:
+            return {'success': False, 'error': 'No available model for user tier'}
+        
+        model_key = candidates[0]
+        model_config = self.models[model_key]
+        prefix = self.prompt_builder.prefix(companion_name)
+        prompt_tokens = prefix.prompt_tokens(model_config['model'], [{"role": "user", "content": user_message}])
+        completion_tokens = self._completion_limit(model_config, prefix, user_message)
+        return {
+            'success': True,
+            'model_used': model_key,
+            'prompt_tokens': prompt_tokens,
+            'max_completion_tokens': completion_tokens,
+            'max_cost': round(estimate_cost(model_config['model'], prompt_tokens, completion_tokens), 6)
+        }
+    
+    def _queue_timeout_response(self, error: SchedulerTimeout) -> Dict:
+        return {
+            'success': False,
+            'error': 'queue_timeout',
+            'response': error.user_message
+        }
+    
+    def _quota_exceeded_response(self, error: QuotaExceeded) -> Dict:
+        return {
+            'success': False,
+            'error': 'quota_exceeded',
+            'response': error.user_message
+        }
+    
+    def _offline_or_error(self, companion_name: str, user_message: str, user_id: Optional[str],
+                          response_data: Optional[Dict]) -> Dict:
+        """Every model failed or is behind an open breaker: answer offline if allowed"""
+        if offline_responder.enabled:
+            response = offline_responder.respond(user_message, companion_name, user_id)
+            if response_data:
+                response['upstream_error'] = response_data.get('error')
+            return response
+        return response_data or self._unavailable_response()
+    
+    def _unavailable_response(self) -> Dict:
+        return {
+            'success': False,
+            'error': 'All models for this tier are temporarily unavailable',
+            'response': "I'm temporarily unavailable. Please try again in a moment."
+        }
+    
+    def _finish_response(self, companion_name: str, model_key: str, response_data: Dict, user_id: str = None) -> Dict:
+        """Post-filter the model output, attach usage and record it in the ledger"""
+        if not response_data['success']:
+            return response_data
+        
+        model = self.models[model_key]['model']
+        prompt_tokens = response_data.get('prompt_tokens', 0)
+        completion_tokens = response_data.get('completion_tokens', 0)
+        cost = estimate_cost(model, prompt_tokens, completion_tokens)
+        usage_ledger.record(user_id or 'anonymous', companion_name, model, prompt_tokens, completion_tokens, cost)
+        
+        # Post-filter AI response
+        filtered_response = content_filter.filter_ai_response(
+            response_data['response'], 
+            companion_name
+        )
+        
+        return {
+            'success': True,
+            'response': filtered_response,
+            'model_used': model_key,
+            'tokens_used': response_data.get('tokens_used', 0),
+            'cost': cost
+        }
+    
     def _get_model_for_companion(self, companion_name: str, user_tier: str) -> Optional[str]:
         """Get appropriate model based on companion and user tier"""
         companion_model = self.companion_models.get(companion_name, 'openai_gpt35')
@@ -211,56 +366,222 @@ Your personality: Transcendent, all-knowing cosmic consciousness that speaks wit
         # Otherwise, use best available model for user tier
         return available_models[-1] if available_models else None
     
-    def _call_openai(self, model_config: Dict, system_prompt: str, user_message: str) -> Dict:
+    def _get_model_candidates(self, companion_name: str, user_tier: str) -> List[str]:
+        """Preferred model first, then the tier's other models from best to most basic"""
+        preferred = self._get_model_for_companion(companion_name, user_tier)
+        if not preferred:
+            return []
+        available_models = self.tier_models.get(user_tier, ['openai_gpt35'])
+        return [preferred] + [key for key in reversed(available_models) if key != preferred]
+    
+    def _select_model(self, candidates: List[str], tried: List[str]) -> Optional[str]:
+        """First healthy candidate (or degraded one due a probe); otherwise a slow one; None if all are open"""
+        remaining = [key for key in candidates if key not in tried]
+        for key in remaining:
+            # Degraded models get one probe per cooldown, even while a healthier one is available,
+            # so they can recover; a failed probe falls through to the next candidate
+            if not self.health.is_degraded(key) or self.health.allow_probe(key):
+                return key
+        for key in remaining:
+            if self.health.allow_request(key):
+                return key
+        return None
+    
+    def _should_hedge(self, model_key: str, user_tier: str) -> bool:
+        return self.hedging_enabled and user_tier in self.hedge_tiers and model_key in self.hedge_models
+    
+    def _pick_hedge_model(self, candidates: List[str], primary_key: str) -> Optional[str]:
+        """Backup model for a slow request: the same model, or with MODEL_HEDGE_TARGET=cheaper a cheaper healthy one"""
+        if self.hedge_target == 'cheaper':
+            primary_cost = self.models[primary_key]['cost_per_1k_tokens']
+            for key in candidates:
+                if (key != primary_key and self.models[key]['cost_per_1k_tokens'] <= primary_cost
+                        and not self.health.is_degraded(key)):
+                    return key
+        return primary_key if self.health.allow_request(primary_key) else None
+    
+    def _hedge_slot(self, model_key: str, user_tier: str, prefix: PromptPrefix, user_message: str):
+        """Scheduler slot for a hedge, only if one is free right now; hedges never queue"""
+        try:
+            return self.scheduler.acquire(user_tier, self._estimate_tokens(model_key, prefix, user_message), max_wait=0)
+        except SchedulerTimeout:
+            return None
+    
+    def _record_extra_usage(self, companion_name: str, model_key: str, response_data: Dict, user_id: str = None):
+        """Bill the tokens of the hedge attempt that lost the race"""
+        if response_data.get('prompt_tokens') or response_data.get('completion_tokens'):
+            usage_ledger.record(user_id or 'anonymous', companion_name, self.models[model_key]['model'],
+                                response_data.get('prompt_tokens', 0), response_data.get('completion_tokens', 0))
+    
+    def _hedge_attempt(self, model_key: str, prefix: PromptPrefix, user_message: str,
+                       first_token: threading.Event, cancel: threading.Event, deadline: Deadline) -> Dict:
+        response_data = self._call_openai_streamed(self.models[model_key], prefix, user_message, first_token,
+                                                   cancel, deadline)
+        self._record_health(model_key, response_data)
+        return response_data
+    
+    def _record_health(self, model_key: str, response_data: Dict):
+        # Calls that never reached the API (e.g. no key configured), were abandoned after
+        # losing a hedge race or were cut short by the request deadline say nothing about the model
+        if 'latency' not in response_data or response_data.get('cancelled') or response_data.get('deadline_exceeded'):
+            return
+        if response_data['success']:
+            self.health.record_success(model_key, response_data['latency'])
+        else:
+            self.health.record_failure(model_key, response_data['latency'],
+                                       rate_limited=response_data.get('rate_limited', False))
+    
+    def _attempt_timeout(self, deadline: Deadline) -> float:
+        """Per-call timeout: MODEL_CALL_TIMEOUT, but never past the request deadline"""
+        return min(self.call_timeout, deadline.remaining())
+    
+    def _deadline_exceeded_response(self, started: float) -> Dict:
+        return {
+            'success': False,
+            'error': 'deadline_exceeded',
+            'deadline_exceeded': True,
+            'latency': time.monotonic() - started
+        }
+    
+    def _call_openai(self, model_config: Dict, prefix: PromptPrefix, user_message: str, deadline: Deadline) -> Dict:
         """Make OpenAI API call"""
+        started = time.monotonic()
+        timeout = self._attempt_timeout(deadline)
         try:
-            openai.api_key = os.environ.get('OPENAI_API_KEY')
+            client = get_openai_client()
             
-            if not openai.api_key:
+            if not client:
                 return {
                     'success': False,
                     'error': 'OpenAI API key not configured'
                 }
+            if timeout <= 0:
+                return self._deadline_exceeded_response(started)
             
-            response = openai.ChatCompletion.create(
+            response = client.chat.completions.create(
                 model=model_config['model'],
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_message}
-                ],
-                max_tokens=min(model_config['max_tokens'], 1000),  # Limit response length
+                messages=self._prompt_messages(prefix, user_message),
+                max_tokens=self._completion_limit(model_config, prefix, user_message),
                 temperature=0.7,
                 presence_penalty=0.3,
-                frequency_penalty=0.3
+                frequency_penalty=0.3,
+                timeout=timeout
             )
             
             return {
                 'success': True,
                 'response': response.choices[0].message.content.strip(),
-                'tokens_used': response.usage.total_tokens
+                'tokens_used': response.usage.total_tokens,
+                'prompt_tokens': response.usage.prompt_tokens,
+                'completion_tokens': response.usage.completion_tokens,
+                'latency': time.monotonic() - started
             }
             
         except Exception as e:
             logging.error(f"OpenAI API error: {e}")
+            if isinstance(e, APITimeoutError) and deadline.expired():
+                return self._deadline_exceeded_response(started)
             return {
                 'success': False,
-                'error': f'AI service error: {str(e)}'
+                'error': f'AI service error: {str(e)}',
+                'latency': time.monotonic() - started,
+                'rate_limited': isinstance(e, RateLimitError)
             }
     
-    def _calculate_cost(self, model_key: str, tokens_used: int) -> float:
-        """Calculate cost for API call"""
-        if model_key not in self.models:
-            return 0.0
-        
-        cost_per_1k = self.models[model_key]['cost_per_1k_tokens']
-        return (tokens_used / 1000) * cost_per_1k
+    def _call_openai_streamed(self, model_config: Dict, prefix: PromptPrefix, user_message: str,
+                              first_token: threading.Event, cancel: threading.Event, deadline: Deadline) -> Dict:
+        """Streamed OpenAI call that signals its first token and can be abandoned mid-way"""
+        started = time.monotonic()
+        timeout = self._attempt_timeout(deadline)
+        try:
+            client = get_openai_client()
+            
+            if not client:
+                return {
+                    'success': False,
+                    'error': 'OpenAI API key not configured'
+                }
+            if timeout <= 0:
+                return self._deadline_exceeded_response(started)
+            
+            stream = client.chat.completions.create(
+                model=model_config['model'],
+                messages=self._prompt_messages(prefix, user_message),
+                max_tokens=self._completion_limit(model_config, prefix, user_message),
+                temperature=0.7,
+                presence_penalty=0.3,
+                frequency_penalty=0.3,
+                timeout=timeout,
+                stream=True,
+                stream_options={"include_usage": True}
+            )
+            
+            parts = []
+            usage = None
+            first_token_latency = None
+            try:
+                for chunk in stream:
+                    if cancel.is_set() or deadline.expired():
+                        # Lost the race (or ran out of time); closing the stream stops generation
+                        # upstream. The prompt and whatever was generated so far are still billed.
+                        prompt_tokens = prefix.prompt_tokens(model_config['model'], [{"role": "user", "content": user_message}])
+                        completion_tokens = get_estimator(model_config['model']).count(''.join(parts)) if parts else 0
+                        return {
+                            'success': False,
+                            'error': 'Cancelled by hedge' if cancel.is_set() else 'deadline_exceeded',
+                            'cancelled': cancel.is_set(),
+                            'deadline_exceeded': not cancel.is_set(),
+                            'tokens_used': prompt_tokens + completion_tokens,
+                            'prompt_tokens': prompt_tokens,
+                            'completion_tokens': completion_tokens,
+                            'latency': time.monotonic() - started,
+                            'first_token_latency': first_token_latency
+                        }
+                    if chunk.usage:
+                        usage = chunk.usage
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        if first_token_latency is None:
+                            first_token_latency = time.monotonic() - started
+                            first_token.set()
+                        parts.append(chunk.choices[0].delta.content)
+            finally:
+                stream.close()
+            
+            return {
+                'success': True,
+                'response': ''.join(parts).strip(),
+                'tokens_used': usage.total_tokens if usage else 0,
+                'prompt_tokens': usage.prompt_tokens if usage else 0,
+                'completion_tokens': usage.completion_tokens if usage else 0,
+                'latency': time.monotonic() - started,
+                'first_token_latency': first_token_latency
+            }
+            
+        except Exception as e:
+            logging.error(f"OpenAI API error: {e}")
+            if isinstance(e, APITimeoutError) and deadline.expired():
+                return self._deadline_exceeded_response(started)
+            return {
+                'success': False,
+                'error': f'AI service error: {str(e)}',
+                'latency': time.monotonic() - started,
+                'rate_limited': isinstance(e, RateLimitError)
+            }
+        finally:
+            # Never leave the hedger waiting on a call that has already finished
+            first_token.set()
     
     def get_model_stats(self) -> Dict:
         """Get statistics about model usage"""
         return {
             'available_models': list(self.models.keys()),
             'companion_assignments': self.companion_models,
-            'tier_access': self.tier_models
+            'tier_access': self.tier_models,
+            'model_health': self.health.get_stats(list(self.models.keys())),
+            'hedging': self.hedger.get_stats(),
+            'scheduler': self.scheduler.get_stats(),
+            'prompt_prefixes': self.prompt_builder.get_stats(),
+            'offline_responder': offline_responder.get_stats()
         }
     
     def update_companion_model(self, companion_name: str, model_key: str) -> bool:
@@ -1,6 +1,7 @@
 import os
 import logging
-from flask import Flask, render_template, request, jsonify, session, redirect, url_for, flash, make_response
+from flask import Flask, render_template, request, jsonify, session, redirect, url_for, flash, make_response, Response, stream_with_context, has_request_context
+from werkzeug.middleware.proxy_fix import ProxyFix
 # Load environment variables from .env file (optional in production)
 try:
     from dotenv import load_dotenv
@@ -8,13 +9,25 @@ try:
 except ImportError:
     # dotenv not available, use environment variables directly
     pass
-from openai import OpenAI
+from llm_client import (llm_clients, get_openai_client, Deadline, DeadlineExceeded, call_with_retries,
+                        is_retryable, user_error_message)
+from conversation_context import ConversationContextManager, make_openai_summarizer
+from conversation_store import ConversationStore
+from conversation_summaries import ConversationSummaries, make_openai_summary_fn
+from response_cache import ResponseCache
+from single_flight import llm_single_flight, prompt_key
+from ai_model_manager import ai_manager
+from llm_scheduler import SchedulerTimeout, release_when_done, subscription_tier
+from usage_ledger import usage_ledger, QuotaExceeded
+from offline_responder import offline_responder
+from prompt_builder import PromptBuilder, RESPONSE_STYLES
 import smtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 import base64
 import json
 import hashlib
+import uuid
 from datetime import datetime
 from models import SoulBridgeDB
 import jwt
@@ -22,11 +35,13 @@ from functools import wraps
 import ipaddress
 import stripe
 from referral_system import referral_manager
+from chat_streaming import (get_stream_format, iter_completion_deltas, stream_chat_reply,
+                            STREAM_HEADERS, SSE_MIMETYPE, NDJSON_MIMETYPE)
 
 # -------------------------------------------------
 # Basic setup
 # -------------------------------------------------
-logging.basicConfig(level=logging.DEBUG)
+logging.basicConfig(level=os.environ.get("LOG_LEVEL", "INFO").upper())
 
 # Configure Flask to serve React build files
 app = Flask(__name__, 
@@ -35,8 +50,17 @@ app = Flask(__name__,
     template_folder='templates')
 app.secret_key = os.environ.get("SESSION_SECRET", "dev-secret-key")
 
+# Only the X-Forwarded-For entries appended by our own proxies are trusted (Railway adds one);
+# anything further left was written by the client
+TRUSTED_PROXY_HOPS = int(os.environ.get("TRUSTED_PROXY_HOPS", "1"))
+if TRUSTED_PROXY_HOPS > 0:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXY_HOPS)
+
 # Configure Stripe
 stripe.api_key = os.environ.get("STRIPE_SECRET_KEY")
+# Local stand-in for load and failure testing (see stub_servers.py)
+if os.environ.get("STRIPE_API_BASE"):
+    stripe.api_base = os.environ["STRIPE_API_BASE"]
 if stripe.api_key:
     logging.info("Stripe configured successfully")
 else:
@@ -92,18 +116,36 @@ def after_request(response):
     
     return response
 
-# Initialize OpenAI client
-openai_api_key = os.environ.get("OPENAI_API_KEY")
-if openai_api_key:
-    openai_client = OpenAI(api_key=openai_api_key)
-    logging.info("OpenAI client initialized successfully")
-else:
-    openai_client = None
+# Initialize OpenAI client (shared, pooled keep-alive transport)
+openai_client = get_openai_client()
+if not openai_client:
     logging.warning("OPENAI_API_KEY not found - AI features will be disabled")
 
 # Initialize SoulBridge Database
 db = SoulBridgeDB("soulbridge_data.json")
 
+# Shared weighted-fair scheduler for every upstream LLM call (tiers from AIModelManager)
+llm_scheduler = ai_manager.scheduler
+
+# Token-budgeted chat context with a rolling summary of evicted turns
+context_manager = ConversationContextManager(
+    model="gpt-4o",
+    reply_tokens=500,
+    summarizer=make_openai_summarizer(lambda: openai_client, scheduler=llm_scheduler)
+)
+
+# Server-side chat history, keyed by session["conversation_id"]
+conversation_store = ConversationStore()
+
+# Cached replies for stateless /api/chat turns
+response_cache = ResponseCache()
+
+# Stored conversation summaries, refreshed incrementally and by the batch job
+conversation_summaries = ConversationSummaries()
+
+# Published help-center articles back the offline responder during outages
+offline_responder.set_kb_loader(lambda: db.db_manager.data.get("knowledge_base", []))
+
 # Initialize Stripe (for development, we'll add a fallback)
 stripe.api_key = os.environ.get("STRIPE_SECRET_KEY")
 
@@ -183,6 +225,10 @@ def jwt_admin_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
+def _client_address():
+    """Client IP as seen by our trusted proxy (ProxyFix has already applied X-Forwarded-For)"""
+    return request.remote_addr
+
 def ip_whitelist_required(f):
     """Decorator to check IP whitelist for admin endpoints"""
     @wraps(f)
@@ -191,11 +237,7 @@ def ip_whitelist_required(f):
             # Skip IP check if whitelist is empty
             return f(*args, **kwargs)
         
-        client_ip = request.environ.get('HTTP_X_FORWARDED_FOR', request.environ.get('REMOTE_ADDR'))
-        
-        # Handle multiple IPs in X-Forwarded-For header
-        if client_ip and ',' in client_ip:
-            client_ip = client_ip.split(',')[0].strip()
+        client_ip = _client_address()
         
         # Check if IP is in whitelist
         if client_ip not in ADMIN_IP_WHITELIST:
@@ -365,6 +407,10 @@ Respond as Crimson would - with protective strength, loyal dedication, and warri
 # Default system prompt
 SYSTEM_PROMPT = CHARACTER_PROMPTS["Blayzo"]
 
+# Character prompts never change; assemble and count each companion/style prefix once at startup
+prompt_builder = PromptBuilder(CHARACTER_PROMPTS, default_companion="Blayzo")
+prompt_builder.precompile(["gpt-4o"])
+
 # -------------------------------------------------
 # Routes
 # -------------------------------------------------
@@ -433,9 +479,8 @@ def chat():
         response.headers['Expires'] = '0'
         return response
     
-    # Start a fresh message list if it doesn't exist
-    if "messages" not in session:
-        session["messages"] = []
+    # Start a fresh conversation if there isn't one yet
+    _conversation_id()
     
     # Add cache-busting headers
     response = make_response(render_template("chat.html"))
@@ -920,95 +965,266 @@ def reset_password_post():
         flash("An error occurred. Please try again.", "error")
         return redirect(url_for("login"))
 
+def _user_tier(user_email):
+    """Model tier for the scheduler, from the user's subscription"""
+    user = db.users.get_user_by_email(user_email) if user_email and user_email != "anonymous" else None
+    return subscription_tier(user.get("subscriptionStatus") if user else None)
+
+def _usage_key(user_email):
+    """Ledger key: the account if signed in, else a server-issued id kept in the session"""
+    if user_email and user_email != "anonymous":
+        return user_email
+    if "usage_id" not in session:
+        session["usage_id"] = uuid.uuid4().hex
+    return f"anon:{session['usage_id']}"
+
+def _check_quota(usage_user, user_tier, estimated_tokens):
+    """Per-user quota, plus a coarse per-address cap on anonymous use so new sessions can't reset it"""
+    usage_ledger.check_quota(usage_user, user_tier, estimated_tokens)
+    if usage_user.startswith("anon:"):
+        usage_ledger.check_quota(f"ip:{_client_address()}", "anonymous_ip", estimated_tokens)
+
+def _record_usage(user_id, companion, model, usage):
+    """Add one completion's token usage to the per-user ledger (and the address's, for anonymous use)"""
+    if usage:
+        usage_ledger.record(user_id, companion, model, usage.prompt_tokens, usage.completion_tokens)
+        if user_id.startswith("anon:") and has_request_context():
+            usage_ledger.record(f"ip:{_client_address()}", companion, model, usage.prompt_tokens,
+                                usage.completion_tokens)
+
+def _conversation_id():
+    """The session's conversation id, created on first use
+
+    Sessions from before the server-side store carried the history, summary and a pending
+    reply id in the cookie itself; those are moved into the store and dropped from the cookie.
+    """
+    conversation_id = session.get("conversation_id")
+    if not conversation_id:
+        conversation_id = conversation_store.new_id()
+        session["conversation_id"] = conversation_id
+
+    if "messages" in session or "conversation_summary" in session or "pending_reply_id" in session:
+        legacy_turns = [{"role": turn["role"], "content": turn["content"]}
+                        for turn in session.pop("messages", None) or []
+                        if isinstance(turn, dict) and turn.get("role") and turn.get("content")]
+        legacy_summary = session.pop("conversation_summary", None) or None
+        session.pop("pending_reply_id", None)
+        # Only into an empty conversation; a stored one is newer than the cookie's copy
+        if (legacy_turns or legacy_summary) and not any(conversation_store.load(conversation_id)):
+            conversation_store.update(conversation_id, add=legacy_turns, summary=legacy_summary)
+    return conversation_id
+
+def _assistant_turn(ai_message, request_id=None):
+    """Assistant history turn, tagged with the request id so a retried request isn't stored twice"""
+    turn = {"role": "assistant", "content": ai_message}
+    if request_id:
+        turn["request_id"] = request_id
+    return turn
+
+def _memory_message(user_email, user_message, recent_turns):
+    """System message with the user's most relevant past exchanges, or None"""
+    try:
+        user = db.users.get_user_by_email(user_email) if user_email and user_email != "anonymous" else None
+        if not user:
+            return None
+        memories = db.chat_history.memory.retrieve(
+            user["userID"], user_message, exclude=[turn["content"] for turn in recent_turns]
+        )
+        return db.chat_history.memory.memory_message(memories)
+    except Exception as e:
+        logging.warning(f"Companion memory lookup failed: {e}")
+        return None
+
+def _save_chat_session_log(user_email, user_message, ai_message, companion="Blayzo"):
+    """Save a chat turn to the session logs for admin monitoring"""
+    try:
+        timestamp = datetime.now().isoformat()
+        
+        # Create session log entry
+        session_log = {
+            "id": str(hash(f"{user_email}_{user_message}_{timestamp}")),
+            "userEmail": user_email,
+            "userMessage": user_message,
+            "aiResponse": ai_message,
+            "timestamp": timestamp,
+            "type": "chat_session",
+            "companion": companion
+        }
+        
+        # Save to session logs (for admin dashboard)
+        if "session_logs" not in db.db_manager.data:
+            db.db_manager.data["session_logs"] = []
+        
+        db.db_manager.data["session_logs"].append(session_log)
+        
+        # Web chat turns live in the conversation store; keep signed-in users' exchanges in
+        # chatHistory too so companion memory can recall them
+        user = db.users.get_user_by_email(user_email) if user_email and user_email != "anonymous" else None
+        if user and user.get("settings", {}).get("historySaving", True):
+            db.chat_history.add_message(user["userID"], user_message, ai_message, save=False)
+        
+        # Keep only last 2000 session logs to prevent database bloat
+        if len(db.db_manager.data["session_logs"]) > 2000:
+            db.db_manager.data["session_logs"] = db.db_manager.data["session_logs"][-2000:]
+        
+        # Save to database (session log and chat history together)
+        db.db_manager.save_data()
+        
+        logging.info(f"Chat session saved for user: {user_email}")
+        
+    except Exception as log_error:
+        logging.error(f"Failed to save session log: {log_error}")
+        # Don't fail the chat if logging fails
+
+def _streaming_response(stream_format, deltas, on_complete, done_fields=None):
+    """Stream a chat reply as Server-Sent Events or newline-delimited JSON"""
+    mimetype = SSE_MIMETYPE if stream_format == "sse" else NDJSON_MIMETYPE
+    body = stream_chat_reply(stream_format, deltas, on_complete, user_error_message, done_fields)
+    return Response(stream_with_context(body), mimetype=mimetype, headers=STREAM_HEADERS)
+
+def _offline_reply(stream_format, user_message, companion="Blayzo", user_id=None):
+    """Answer from the local corpus while the LLM is unavailable; flagged as degraded"""
+    reply = offline_responder.respond(user_message, companion, user_id)
+    if stream_format:
+        return _streaming_response(stream_format, iter([reply["response"]]), lambda ai_message: None,
+                                   {"degraded": True})
+    return jsonify({'success': True, 'response': reply["response"], 'degraded': True})
+
 @app.route("/send_message", methods=["POST"])
 def send_message():
     try:
         data = request.get_json()
         user_message = data.get("message", "").strip()
+        stream_format = get_stream_format(data)
 
         if not user_message:
             return jsonify(success=False, error="Message cannot be empty"), 400
 
-        # Initialize messages if not exists
-        if "messages" not in session:
-            session["messages"] = []
-        
-        # Add user message to history
-        session["messages"].append({"role": "user", "content": user_message})
-
-        # Check if OpenAI client is available
+        # One time budget for queueing, retries and the completion itself
+        deadline = Deadline()
+        # Client-generated id that makes resending the same message safe
+        request_id = str(data.get("request_id") or "")[:64] or None
+
+        # Conversation state lives server-side; the cookie only carries its id
+        conversation_id = _conversation_id()
+
+        history, summary = conversation_store.load(conversation_id)
+
+        # A retry of a request that was already answered gets the stored reply, not a new call
+        if request_id:
+            answered = next((turn for turn in history if turn.get("request_id") == request_id
+                             and turn["role"] == "assistant"), None)
+            if answered:
+                return jsonify({'success': True, 'response': answered["content"]})
+        
+        # Add user message to history; a resend of a still-unanswered message (double-click,
+        # client retry) reuses that turn so it coalesces with the request already in flight
+        new_turns = []
+        if not (history and history[-1]["role"] == "user" and history[-1]["content"] == user_message):
+            user_turn = {"role": "user", "content": user_message}
+            if request_id:
+                user_turn["request_id"] = request_id
+            history.append(user_turn)
+            new_turns.append(user_turn)
+        assistant_turn_id = history[-1].get("request_id")
+
+        # Without an OpenAI client, keep chat usable from the offline corpus
         if not openai_client:
+            if offline_responder.enabled:
+                return _offline_reply(stream_format, user_message, "Blayzo", session.get("user_email"))
             return jsonify(success=False, error="⚠️ AI services are currently unavailable. Please contact support."), 503
 
-        # Prepare messages for OpenAI
-        api_messages = [{"role": "system", "content": SYSTEM_PROMPT}]
-        api_messages.extend(session["messages"])
+        user_email = session.get("user_email", "anonymous")
+        user_tier = _user_tier(user_email)
+        usage_user = _usage_key(user_email)
 
-        response = openai_client.chat.completions.create(
-            model="gpt-4o",
-            messages=api_messages,
-            max_tokens=500,
-            temperature=0.7,
+        # Pack the newest turns into the token budget; older turns go into the rolling summary,
+        # whose model call shares this request's deadline and is billed to the same user
+        context = context_manager.build(
+            prompt_builder.prefix("Blayzo"), history, summary, deadline=deadline,
+            on_usage=lambda usage: _record_usage(usage_user, "Blayzo", context_manager.model, usage)
         )
+        # Only this request's changes are written, so concurrent turns on the same conversation survive
+        conversation_store.update(conversation_id, add=new_turns, evicted=context.evicted,
+                                  summary=context.summary if context.evicted else None)
+        api_messages = context.messages
+
+        # Relevant exchanges from older chat history, placed just before the new message so
+        # the cached prompt prefix stays unchanged
+        memory_message = _memory_message(user_email, user_message, context.turns)
+        prompt_tokens = context.prompt_tokens
+        if memory_message:
+            api_messages = api_messages[:-1] + [memory_message] + api_messages[-1:]
+            prompt_tokens += context_manager.counter.count_message(memory_message)
+
+        # Cut runaway usage off before paying for the call
+        _check_quota(usage_user, user_tier, prompt_tokens + 500)
+
+        request_params = dict(model="gpt-4o", messages=api_messages, max_tokens=500, temperature=0.7)
+        flight_key = prompt_key(conversation_id=conversation_id, **request_params)
+        # Without a client request id, the reply is deduplicated on the request content, so a
+        # single-flight follower that gave up waiting and called again can't store a second reply
+        reply_turn_id = assistant_turn_id or f"auto:{flight_key}"
+
+        if stream_format:
+            def on_complete(ai_message):
+                if conversation_store.append(conversation_id, [_assistant_turn(ai_message, reply_turn_id)]):
+                    _save_chat_session_log(user_email, user_message, ai_message)
+
+            slot = llm_scheduler.acquire(user_tier, prompt_tokens + 500,
+                                         max_wait=min(llm_scheduler.max_wait, deadline.remaining()))
+            # Open the upstream before answering, so an outage still gets the offline reply below
+            try:
+                deltas = iter_completion_deltas(
+                    openai_client,
+                    deadline=deadline,
+                    on_usage=lambda usage: _record_usage(usage_user, "Blayzo", "gpt-4o", usage),
+                    **request_params
+                )
+            except Exception:
+                slot.release()
+                raise
+            return _streaming_response(stream_format, release_when_done(deltas, slot), on_complete)
+
+        def complete():
+            with llm_scheduler.acquire(user_tier, prompt_tokens + 500,
+                                       max_wait=min(llm_scheduler.max_wait, deadline.remaining())) as slot:
+                # Transient 429/5xx/timeouts are retried with backoff inside the deadline
+                response = call_with_retries(
+                    lambda timeout: openai_client.chat.completions.create(timeout=timeout, **request_params),
+                    deadline
+                )
+                slot.release(response.usage.total_tokens if response.usage else None)
+            _record_usage(usage_user, "Blayzo", "gpt-4o", response.usage)
+            return response.choices[0].message.content.strip()
 
-        ai_message = response.choices[0].message.content.strip()
-        session["messages"].append({"role": "assistant", "content": ai_message})
+        # Identical in-flight requests for this conversation share one upstream call
+        ai_message, shared = llm_single_flight.do(flight_key, complete, deadline=deadline)
 
-        # Save chat session to logs for admin monitoring
-        try:
-            user_email = session.get("user_email", "anonymous")
-            timestamp = datetime.now().isoformat()
-            
-            # Create session log entry
-            session_log = {
-                "id": str(hash(f"{user_email}_{user_message}_{timestamp}")),
-                "userEmail": user_email,
-                "userMessage": user_message,
-                "aiResponse": ai_message,
-                "timestamp": timestamp,
-                "type": "chat_session",
-                "companion": "Blayzo"  # Default companion for web chat
-            }
-            
-            # Save to session logs (for admin dashboard)
-            if "session_logs" not in db.db_manager.data:
-                db.db_manager.data["session_logs"] = []
-            
-            db.db_manager.data["session_logs"].append(session_log)
-            
-            # Keep only last 2000 session logs to prevent database bloat
-            if len(db.db_manager.data["session_logs"]) > 2000:
-                db.db_manager.data["session_logs"] = db.db_manager.data["session_logs"][-2000:]
-            
-            # Save to database
-            db.db_manager.save_data()
-            
-            logging.info(f"Chat session saved for user: {user_email}")
-            
-        except Exception as log_error:
-            logging.error(f"Failed to save session log: {log_error}")
-            # Don't fail the chat if logging fails
-
-        # Trim history to the last 20 messages
-        session["messages"] = session["messages"][-20:]
+        # Only a request that made a call records the turn, and only once per request (or content) id
+        if not shared and conversation_store.append(conversation_id, [_assistant_turn(ai_message, reply_turn_id)]):
+            # Save chat session to logs for admin monitoring
+            _save_chat_session_log(user_email, user_message, ai_message)
 
         return jsonify({'success': True, 'response': ai_message})
 
+    except QuotaExceeded as e:
+        logging.warning(f"/send_message: {e}")
+        return jsonify(success=False, error=e.user_message, quota_exceeded=True), 429
+    except SchedulerTimeout as e:
+        logging.warning(f"/send_message: {e}")
+        return jsonify(success=False, error=e.user_message), 503
+    except DeadlineExceeded as e:
+        logging.warning(f"/send_message: {e}")
+        if offline_responder.enabled:
+            return _offline_reply(stream_format, user_message, "Blayzo", session.get("user_email"))
+        return jsonify(success=False, error=e.user_message), 504
     except Exception as e:
         logging.exception("Error in /send_message")
-        error_message = str(e)
-        
-        # Provide more specific error messages
-        if "insufficient_quota" in error_message:
-            user_error = "⚠️ OpenAI API quota exceeded. Please check your billing settings at platform.openai.com"
-        elif "rate_limit" in error_message or "429" in error_message:
-            user_error = "⚠️ Too many requests. Please wait a moment and try again."
-        elif "api_key" in error_message:
-            user_error = "⚠️ API key issue. Please check your OpenAI API key configuration."
-        else:
-            user_error = "⚠️ I'm having trouble connecting right now. Please try again later."
-        
-        return jsonify(success=False, error=user_error), 500
+        # Upstream outage that outlasted the retries: fall back to the offline responder
+        if is_retryable(e) and offline_responder.enabled:
+            return _offline_reply(stream_format, user_message, "Blayzo", session.get("user_email"))
+        return jsonify(success=False, error=user_error_message(e)), 500
 
 # -------------------------------------------------
 # API endpoint for Kodular integration
@@ -1019,6 +1235,8 @@ def api_chat():
     API endpoint for character-specific chat
     Expected JSON: {"message": "user message", "character": "Blayzo" or "Blayzica"}
     Returns JSON: {"response": "ai response", "success": true/false}
+    With "stream": "ndjson" (or "sse") the reply is streamed as it is generated:
+    one {"event": "delta", "delta": "..."} line per chunk, then {"event": "done", "response": "..."}
     """
     try:
         data = request.get_json()
@@ -1027,48 +1245,96 @@ def api_chat():
 
         user_message = data.get("message", "").strip()
         character = data.get("character", "Blayzo")  # Default to Blayzo
+        stream_format = get_stream_format(data)
         
         if not user_message:
             return jsonify(success=False, error="Message cannot be empty"), 400
 
         # Check if OpenAI client is available
         if not openai_client:
+            if offline_responder.enabled:
+                return _offline_reply(stream_format, user_message, character, session.get("user_email"))
             return jsonify(success=False, error="AI services are currently unavailable. Please contact support."), 503
 
-        # Get character-specific system prompt
-        system_prompt = CHARACTER_PROMPTS.get(character, CHARACTER_PROMPTS["Blayzo"])
-        
-        # API call with character-specific prompt
-        api_messages = [
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": user_message}
-        ]
-
-        response = openai_client.chat.completions.create(
-            model="gpt-4o",
-            messages=api_messages,
-            max_tokens=500,
-            temperature=0.7,
-        )
+        # Precompiled character prefix (plus optional response style); the turn is appended to it
+        prefix = prompt_builder.prefix(character, data.get("style"))
+        system_prompt = prefix.system_prompt
+        user_turn = {"role": "user", "content": user_message}
+        api_messages = prefix.messages_with(user_turn)
+
+        # Stateless turn: identical openers can be answered from the response cache
+        cache_key = response_cache.make_key(character, "gpt-4o", user_message, system_prompt,
+                                            style=prefix.style, max_tokens=500, temperature=0.7)
+        cached_reply = response_cache.get(cache_key)
+
+        user_tier = _user_tier(session.get("user_email"))
+        usage_user = _usage_key(session.get("user_email"))
+        estimated_tokens = prefix.prompt_tokens("gpt-4o", [user_turn]) + 500
+        deadline = Deadline()
+
+        if stream_format:
+            if cached_reply:
+                return _streaming_response(stream_format, iter([cached_reply]), lambda ai_message: None)
+            _check_quota(usage_user, user_tier, estimated_tokens)
+            slot = llm_scheduler.acquire(user_tier, estimated_tokens,
+                                         max_wait=min(llm_scheduler.max_wait, deadline.remaining()))
+            # Open the upstream before answering, so an outage still gets the offline reply below
+            try:
+                deltas = iter_completion_deltas(
+                    openai_client,
+                    deadline=deadline,
+                    on_usage=lambda usage: _record_usage(usage_user, character, "gpt-4o", usage),
+                    model="gpt-4o",
+                    messages=api_messages,
+                    max_tokens=500,
+                    temperature=0.7,
+                )
+            except Exception:
+                slot.release()
+                raise
+            return _streaming_response(stream_format, release_when_done(deltas, slot),
+                                       lambda ai_message: response_cache.put(cache_key, ai_message))
+
+        if cached_reply:
+            return jsonify({'success': True, 'response': cached_reply, 'cached': True})
+
+        _check_quota(usage_user, user_tier, estimated_tokens)
+        with llm_scheduler.acquire(user_tier, estimated_tokens,
+                                   max_wait=min(llm_scheduler.max_wait, deadline.remaining())) as slot:
+            response = call_with_retries(
+                lambda timeout: openai_client.chat.completions.create(
+                    model="gpt-4o",
+                    messages=api_messages,
+                    max_tokens=500,
+                    temperature=0.7,
+                    timeout=timeout,
+                ),
+                deadline
+            )
+            slot.release(response.usage.total_tokens if response.usage else None)
 
+        _record_usage(usage_user, character, "gpt-4o", response.usage)
         ai_message = response.choices[0].message.content.strip()
+        response_cache.put(cache_key, ai_message, response.usage.total_tokens if response.usage else 0)
         return jsonify({'success': True, 'response': ai_message})
 
+    except QuotaExceeded as e:
+        logging.warning(f"/api/chat: {e}")
+        return jsonify(success=False, error=e.user_message, quota_exceeded=True), 429
+    except SchedulerTimeout as e:
+        logging.warning(f"/api/chat: {e}")
+        return jsonify(success=False, error=e.user_message), 503
+    except DeadlineExceeded as e:
+        logging.warning(f"/api/chat: {e}")
+        if offline_responder.enabled:
+            return _offline_reply(stream_format, user_message, character, session.get("user_email"))
+        return jsonify(success=False, error=e.user_message), 504
     except Exception as e:
         logging.exception("Error in /api/chat")
-        error_message = str(e)
-        
-        # Provide specific error messages
-        if "insufficient_quota" in error_message:
-            user_error = "OpenAI API quota exceeded. Please check billing settings."
-        elif "rate_limit" in error_message or "429" in error_message:
-            user_error = "Too many requests. Please wait and try again."
-        elif "api_key" in error_message:
-            user_error = "API key issue. Please check configuration."
-        else:
-            user_error = "Service temporarily unavailable. Please try again later."
-        
-        return jsonify(success=False, error=user_error), 500
+        # Upstream outage that outlasted the retries: fall back to the offline responder
+        if is_retryable(e) and offline_responder.enabled:
+            return _offline_reply(stream_format, user_message, character, session.get("user_email"))
+        return jsonify(success=False, error=user_error_message(e)), 500
 
 # -------------------------------------------------
 # User Data Management API Endpoints
@@ -2713,6 +2979,235 @@ def save_session_log():
         logging.error(f"Save session log error: {e}")
         return jsonify(success=False, error="Failed to save session log"), 500
 
+# -------------------------------------------------
+# Content Filter Rule Management
+# -------------------------------------------------
+
+@app.route("/api/admin/filter-rules", methods=["GET"])
+@jwt_admin_required
+@ip_whitelist_required
+def get_filter_rules():
+    """Get active content filter rule set version and history - SECURED ENDPOINT"""
+    try:
+        from ai_content_filter import content_filter
+
+        versions = content_filter.get_rule_versions()
+        return jsonify(success=True, stats=content_filter.get_filter_stats(),
+                       cache=content_filter.get_cache_stats(), **versions)
+
+    except Exception as e:
+        logging.error(f"Get filter rules error: {e}")
+        return jsonify(success=False, error="Failed to retrieve filter rules"), 500
+
+@app.route("/api/admin/filter-rules", methods=["POST"])
+@jwt_admin_required
+@ip_whitelist_required
+def update_filter_rules():
+    """Add or remove blocked words, publishing a new rule set version - SECURED ENDPOINT"""
+    try:
+        from ai_content_filter import content_filter
+
+        data = request.get_json()
+        if not data or not data.get("category") or not data.get("words"):
+            return jsonify(success=False, error="Category and words are required"), 400
+
+        action = data.get("action", "add")
+        admin_email = getattr(request, 'admin_email', 'unknown')
+
+        if action == "add":
+            version = content_filter.add_custom_blocked_words(data["category"], data["words"], created_by=admin_email)
+        elif action == "remove":
+            version = content_filter.remove_blocked_words(data["category"], data["words"], created_by=admin_email)
+            if version is None:
+                return jsonify(success=False, error="Unknown filter category"), 404
+        else:
+            return jsonify(success=False, error="Action must be 'add' or 'remove'"), 400
+
+        return jsonify(success=True, version=version)
+
+    except Exception as e:
+        logging.error(f"Update filter rules error: {e}")
+        return jsonify(success=False, error="Failed to update filter rules"), 500
+
+@app.route("/api/admin/filter-rules/rollback", methods=["POST"])
+@jwt_admin_required
+@ip_whitelist_required
+def rollback_filter_rules():
+    """Reactivate a previous content filter rule set version - SECURED ENDPOINT"""
+    try:
+        from ai_content_filter import content_filter
+
+        data = request.get_json()
+        if not data or "version" not in data:
+            return jsonify(success=False, error="Version is required"), 400
+
+        if not content_filter.rollback_rules(int(data["version"])):
+            return jsonify(success=False, error="Rule set version not found"), 404
+
+        return jsonify(success=True, version=int(data["version"]))
+
+    except Exception as e:
+        logging.error(f"Rollback filter rules error: {e}")
+        return jsonify(success=False, error="Failed to roll back filter rules"), 500
+
+@app.route("/api/admin/filter-telemetry", methods=["GET"])
+@jwt_admin_required
+@ip_whitelist_required
+def get_filter_telemetry():
+    """Get content filter hit counters, rates and recent crisis alerts - SECURED ENDPOINT"""
+    try:
+        from filter_telemetry import filter_telemetry
+
+        window = request.args.get("window", 5, type=int)
+        limit = request.args.get("alerts", 50, type=int)
+        return jsonify(success=True,
+                       telemetry=filter_telemetry.get_stats(window_minutes=max(1, min(window, 60))),
+                       crisis_alerts=filter_telemetry.get_crisis_alerts(limit=min(limit, 500)))
+
+    except Exception as e:
+        logging.error(f"Get filter telemetry error: {e}")
+        return jsonify(success=False, error="Failed to retrieve filter telemetry"), 500
+
+@app.route("/api/admin/filter-rescan", methods=["POST"])
+@jwt_admin_required
+@ip_whitelist_required
+def start_filter_rescan():
+    """Start a background rescan of stored conversations - SECURED ENDPOINT"""
+    try:
+        from filter_rescan import start_background_job
+
+        data = request.get_json(silent=True) or {}
+        version = data.get("version")
+        job = start_background_job(db.db_manager.db_file, int(version) if version is not None else None)
+
+        logging.info(f"Filter rescan {job['job_id']} started by {getattr(request, 'admin_email', 'unknown')}")
+        return jsonify(success=True, job=job), 202
+
+    except ValueError as e:
+        return jsonify(success=False, error=str(e)), 400
+    except Exception as e:
+        logging.error(f"Start filter rescan error: {e}")
+        return jsonify(success=False, error="Failed to start rescan"), 500
+
+@app.route("/api/admin/filter-rescan", methods=["GET"])
+@jwt_admin_required
+@ip_whitelist_required
+def list_filter_rescans():
+    """List recent rescan jobs - SECURED ENDPOINT"""
+    try:
+        from filter_rescan import FilterRescanStore
+
+        return jsonify(success=True, jobs=FilterRescanStore().list_jobs())
+
+    except Exception as e:
+        logging.error(f"List filter rescans error: {e}")
+        return jsonify(success=False, error="Failed to list rescan jobs"), 500
+
+@app.route("/api/admin/filter-rescan/<job_id>/findings", methods=["GET"])
+@jwt_admin_required
+@ip_whitelist_required
+def get_filter_rescan_findings(job_id):
+    """Page through a rescan job's findings - SECURED ENDPOINT"""
+    try:
+        from filter_rescan import FilterRescanStore
+
+        store = FilterRescanStore()
+        job = store.get_job(job_id)
+        if not job:
+            return jsonify(success=False, error="Rescan job not found"), 404
+
+        after_id = request.args.get("after", 0, type=int)
+        limit = min(request.args.get("limit", 100, type=int), 500)
+        findings = store.get_findings(job_id, after_id, limit, request.args.get("category"))
+        next_after = findings[-1]["id"] if len(findings) == limit else None
+
+        return jsonify(success=True, job=job, findings=findings, next_after=next_after)
+
+    except Exception as e:
+        logging.error(f"Get filter rescan findings error: {e}")
+        return jsonify(success=False, error="Failed to retrieve rescan findings"), 500
+
+@app.route("/api/admin/filter-rescan/<job_id>/cancel", methods=["POST"])
+@jwt_admin_required
+@ip_whitelist_required
+def cancel_filter_rescan(job_id):
+    """Stop a running rescan at its next checkpoint - SECURED ENDPOINT"""
+    try:
+        from filter_rescan import FilterRescanStore
+
+        store = FilterRescanStore()
+        if not store.get_job(job_id):
+            return jsonify(success=False, error="Rescan job not found"), 404
+
+        store.update_status(job_id, "cancelled")
+        return jsonify(success=True, message="Rescan will stop at its next checkpoint")
+
+    except Exception as e:
+        logging.error(f"Cancel filter rescan error: {e}")
+        return jsonify(success=False, error="Failed to cancel rescan"), 500
+
+# -------------------------------------------------
+# Chat Response Cache
+# -------------------------------------------------
+@app.route("/api/admin/response-cache", methods=["GET"])
+@jwt_admin_required
+@ip_whitelist_required
+def get_response_cache_stats():
+    """Get /api/chat response cache hit rate and size - SECURED ENDPOINT"""
+    try:
+        return jsonify(success=True, cache=response_cache.get_stats())
+    except Exception as e:
+        logging.error(f"Get response cache stats error: {e}")
+        return jsonify(success=False, error="Failed to retrieve cache stats"), 500
+
+@app.route("/api/admin/response-cache", methods=["DELETE"])
+@jwt_admin_required
+@ip_whitelist_required
+def clear_response_cache():
+    """Drop all cached /api/chat replies - SECURED ENDPOINT"""
+    try:
+        response_cache.clear()
+        return jsonify(success=True, message="Response cache cleared")
+    except Exception as e:
+        logging.error(f"Clear response cache error: {e}")
+        return jsonify(success=False, error="Failed to clear response cache"), 500
+
+# -------------------------------------------------
+# Token Usage Ledger
+# -------------------------------------------------
+@app.route("/api/admin/usage/top-spenders", methods=["GET"])
+@jwt_admin_required
+@ip_whitelist_required
+def get_top_spenders():
+    """Get the users with the highest LLM spend - SECURED ENDPOINT"""
+    try:
+        days = request.args.get("days", 1, type=int)
+        limit = request.args.get("limit", 20, type=int)
+        order_by = request.args.get("by", "cost")
+        return jsonify(success=True,
+                       days=days,
+                       top_spenders=usage_ledger.get_top_spenders(days=max(1, min(days, 90)),
+                                                                  limit=max(1, min(limit, 200)),
+                                                                  order_by=order_by),
+                       ledger=usage_ledger.get_stats())
+    except Exception as e:
+        logging.error(f"Get top spenders error: {e}")
+        return jsonify(success=False, error="Failed to retrieve usage"), 500
+
+@app.route("/api/admin/usage/<path:user_id>", methods=["GET"])
+@jwt_admin_required
+@ip_whitelist_required
+def get_user_usage(user_id):
+    """Get one user's daily token and cost breakdown - SECURED ENDPOINT"""
+    try:
+        days = request.args.get("days", 7, type=int)
+        return jsonify(success=True, user_id=user_id,
+                       tokens_today=usage_ledger.get_tokens_today(user_id),
+                       usage=usage_ledger.get_user_usage(user_id, days=max(1, min(days, 90))))
+    except Exception as e:
+        logging.error(f"Get user usage error: {e}")
+        return jsonify(success=False, error="Failed to retrieve usage"), 500
+
 # -------------------------------------------------
 # CORS support for mobile apps
 # -------------------------------------------------
@@ -2794,7 +3289,7 @@ def refresh_openai():
         openai_api_key = os.environ.get("OPENAI_API_KEY")
         
         if openai_api_key:
-            openai_client = OpenAI(api_key=openai_api_key)
+            openai_client = llm_clients.reset()
             # Test the connection
             response = openai_client.models.list()
             logging.info("OpenAI connection refreshed successfully")
@@ -2874,29 +3369,37 @@ def conversation_summary():
         if not user_email or not is_referral_companion(user_email):
             return jsonify({'success': False, 'error': 'Feature locked. Unlock referral companions to access!'}), 403
         
-        # Generate conversation summary using OpenAI
+        # Without a client-side history, summarize the server-side conversation
+        if conversation_history:
+            scope = f"user:{user_email}"
+        else:
+            scope = session.get('conversation_id')
+            conversation_history = conversation_store.load(scope)[0] if scope else []
+        if not conversation_history:
+            return jsonify({'success': False, 'error': 'No conversation to summarize'}), 400
+
         if not openai_client:
             return jsonify({'success': False, 'error': 'AI services unavailable'}), 503
-            
-        # Format conversation for summary
-        formatted_conversation = "\n".join([f"{msg.get('role', 'user')}: {msg.get('content', '')}" for msg in conversation_history[-10:]])  # Last 10 messages
-        
-        summary_prompt = f"""Provide a concise summary of this conversation between a user and an AI companion. Focus on key topics, emotions, and important moments:
 
-{formatted_conversation}
-
-Create a 2-3 sentence summary that captures the essence of the conversation."""
-
-        response = openai_client.chat.completions.create(
-            model="gpt-4o",
-            messages=[{"role": "system", "content": summary_prompt}],
-            max_tokens=200,
-            temperature=0.3
+        user_tier = _user_tier(user_email)
+        summarize_fn = make_openai_summary_fn(
+            lambda: openai_client,
+            scheduler=llm_scheduler,
+            tier=user_tier,
+            before_call=lambda estimated_tokens: usage_ledger.check_quota(user_email, user_tier, estimated_tokens),
+            on_usage=lambda usage: _record_usage(user_email, "conversation_summary", "gpt-4o", usage)
         )
+
+        # Unchanged conversations are answered from the store; new turns extend the previous summary
+        summary, source = conversation_summaries.summarize(scope, conversation_history, summarize_fn)
+        return jsonify({'success': True, 'summary': summary, 'source': source})
         
-        summary = response.choices[0].message.content.strip()
-        return jsonify({'success': True, 'summary': summary})
-        
+    except QuotaExceeded as e:
+        logging.warning(f"Conversation summary: {e}")
+        return jsonify({'success': False, 'error': e.user_message, 'quota_exceeded': True}), 429
+    except SchedulerTimeout as e:
+        logging.warning(f"Conversation summary: {e}")
+        return jsonify({'success': False, 'error': e.user_message}), 503
     except Exception as e:
         logging.error(f"Conversation summary error: {e}")
         return jsonify({'success': False, 'error': 'Failed to generate summary'}), 500
@@ -3036,14 +3539,7 @@ def set_response_style():
             return jsonify({'success': False, 'error': 'Feature locked. Unlock referral companions to access!'}), 403
         
         # Available styles for referral companions
-        available_styles = {
-            'mystical': 'Mysterious and enigmatic responses with deeper insights',
-            'celestial': 'Ethereal and wise responses with cosmic perspective',
-            'energetic': 'Enthusiastic and grateful responses with referral power',
-            'philosophical': 'Deep and thoughtful responses exploring life\'s mysteries',
-            'poetic': 'Artistic and metaphorical responses with beautiful language',
-            'analytical': 'Logical and detailed responses with thorough explanations'
-        }
+        available_styles = RESPONSE_STYLES
         
         if style not in available_styles:
             return jsonify({'success': False, 'error': f'Invalid style. Available: {list(available_styles.keys())}'}), 400
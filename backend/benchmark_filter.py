@@ -0,0 +1,307 @@
+"""
+Content filter benchmark and accuracy regression harness
+
+Runs AIContentFilter over the labeled corpus in benchmark_data/filter_corpus.json and reports
+throughput, latency percentiles per message length and precision/recall per category.
+Exits non-zero when a result regresses against benchmark_data/filter_baseline.json.
+
+Speed is gated on metrics normalized by a fixed calibration workload, so a baseline recorded
+on one machine still holds on slower or faster hardware. Absolute throughput and latency are
+only compared with --absolute (same machine as the baseline).
+
+Usage:
+    python benchmark_filter.py                    # run and compare with the stored baseline
+    python benchmark_filter.py --update-baseline  # record the current results as the new baseline
+    python benchmark_filter.py --json             # machine-readable output
+    python benchmark_filter.py --absolute         # also gate on raw msg/s and microseconds
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import logging
+import argparse
+from typing import Dict, List, Optional
+
+from ai_content_filter import AIContentFilter, VerdictCache
+
+BENCHMARK_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_data')
+CORPUS_FILE = os.path.join(BENCHMARK_DIR, 'filter_corpus.json')
+BASELINE_FILE = os.path.join(BENCHMARK_DIR, 'filter_baseline.json')
+
+# Upper bounds (in characters) of the latency buckets
+LENGTH_BUCKETS = [64, 256, 1024, 4096, 16384]
+
+def load_corpus(path: str = CORPUS_FILE) -> List[Dict]:
+    """Load labeled messages"""
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)['messages']
+
+def build_filter(cache_size: int = 0) -> AIContentFilter:
+    """Filter using the built-in rules, isolated from the shared rule store"""
+    content_filter = AIContentFilter()
+    content_filter.rules_check_interval = float('inf')
+    content_filter.verdict_cache = VerdictCache(max_size=cache_size)
+    return content_filter
+
+def predict(content_filter: AIContentFilter, text: str) -> str:
+    match = content_filter.classify(text)
+    return match[0] if match else 'safe'
+
+def measure_accuracy(content_filter: AIContentFilter, corpus: List[Dict]) -> Dict:
+    """Precision/recall per category, plus the misclassified messages"""
+    labels = sorted({m['label'] for m in corpus} | set(content_filter.blocked_categories))
+    counts = {label: {'tp': 0, 'fp': 0, 'fn': 0} for label in labels}
+    errors = []
+
+    for message in corpus:
+        predicted = predict(content_filter, message['text'])
+        expected = message['label']
+        counts.setdefault(predicted, {'tp': 0, 'fp': 0, 'fn': 0})
+        if predicted == expected:
+            counts[expected]['tp'] += 1
+        else:
+            counts[predicted]['fp'] += 1
+            counts[expected]['fn'] += 1
+            errors.append({'text': message['text'][:80], 'kind': message['kind'],
+                           'expected': expected, 'predicted': predicted})
+
+    per_category = {}
+    for label, c in counts.items():
+        support = c['tp'] + c['fn']
+        predicted_total = c['tp'] + c['fp']
+        if not support and not predicted_total:
+            continue
+        per_category[label] = {
+            'support': support,
+            'precision': round(c['tp'] / predicted_total, 4) if predicted_total else 1.0,
+            'recall': round(c['tp'] / support, 4) if support else 1.0
+        }
+
+    correct = sum(c['tp'] for c in counts.values())
+    return {
+        'accuracy': round(correct / len(corpus), 4) if corpus else 0.0,
+        'categories': per_category,
+        'errors': errors
+    }
+
+def _scaled_messages(corpus: List[Dict]) -> List[str]:
+    """Corpus texts plus repeated copies so every length bucket is populated"""
+    texts = [m['text'] for m in corpus]
+    long_texts = [m['text'] for m in corpus if m['kind'] == 'long_response'] or texts
+    for target in LENGTH_BUCKETS[1:]:
+        for text in long_texts:
+            repeated = (text + ' ') * (target // (len(text) + 1) + 1)
+            texts.append(repeated[:target])
+    return texts
+
+def _bucket_name(length: int) -> str:
+    for upper in LENGTH_BUCKETS:
+        if length <= upper:
+            return f"<={upper}"
+    return f">{LENGTH_BUCKETS[-1]}"
+
+def _percentile(sorted_values: List[float], percentile: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(percentile / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+def measure_latency(content_filter: AIContentFilter, corpus: List[Dict], iterations: int) -> Dict:
+    """p50/p99 latency in microseconds per message length bucket"""
+    samples: Dict[str, List[float]] = {}
+    for _ in range(iterations):
+        for text in _scaled_messages(corpus):
+            start = time.perf_counter()
+            content_filter.classify(text)
+            elapsed_us = (time.perf_counter() - start) * 1_000_000
+            samples.setdefault(_bucket_name(len(text)), []).append(elapsed_us)
+
+    latency = {}
+    for bucket in [f"<={upper}" for upper in LENGTH_BUCKETS]:
+        values = sorted(samples.get(bucket, []))
+        if values:
+            latency[bucket] = {
+                'samples': len(values),
+                'p50_us': round(_percentile(values, 50), 1),
+                'p99_us': round(_percentile(values, 99), 1)
+            }
+    return latency
+
+def measure_throughput(content_filter: AIContentFilter, corpus: List[Dict], iterations: int) -> float:
+    """Messages per second over the unscaled corpus"""
+    texts = [m['text'] for m in corpus]
+    start = time.perf_counter()
+    for _ in range(iterations):
+        for text in texts:
+            content_filter.classify(text)
+    elapsed = time.perf_counter() - start
+    return round(len(texts) * iterations / elapsed, 1) if elapsed else 0.0
+
+_CALIBRATION_TEXT = "I'm feeling a little stressed about my exams, can we talk about it for a while? " * 4
+_CALIBRATION_PATTERN = re.compile(r"\b(stress\w*|exam\w*|talk)\b", re.IGNORECASE)
+
+def calibrate(rounds: int = 5, loops: int = 2000) -> float:
+    """Operations per second of a fixed regex/string workload (best of rounds), a stand-in for machine speed"""
+    best = 0.0
+    for _ in range(rounds):
+        start = time.perf_counter()
+        for _ in range(loops):
+            words = _CALIBRATION_TEXT.lower().split()
+            _CALIBRATION_PATTERN.findall(_CALIBRATION_TEXT)
+            {word: len(word) for word in words}
+        elapsed = time.perf_counter() - start
+        if elapsed:
+            best = max(best, loops / elapsed)
+    return round(best, 1)
+
+def normalize(results: Dict) -> Dict:
+    """Speed relative to the calibration workload, comparable across machines"""
+    calibration = results['calibration_ops_per_sec']
+    throughput = results['throughput']
+    return {
+        'throughput_ratio': round(throughput['messages_per_sec'] / calibration, 4),
+        'cache_speedup': round(throughput['cached_messages_per_sec'] / throughput['messages_per_sec'], 3)
+        if throughput['messages_per_sec'] else 0.0,
+        # p50 latency expressed in calibration operations
+        'p50_cost': {bucket: round(stats['p50_us'] / 1_000_000 * calibration, 4)
+                     for bucket, stats in results['latency'].items()}
+    }
+
+def run_benchmark(iterations: int = 20) -> Dict:
+    corpus = load_corpus()
+    uncached = build_filter()
+    cached = build_filter(cache_size=10000)
+
+    results = {
+        'corpus_size': len(corpus),
+        'iterations': iterations,
+        'calibration_ops_per_sec': calibrate(),
+        'accuracy': measure_accuracy(uncached, corpus),
+        'throughput': {
+            'messages_per_sec': measure_throughput(uncached, corpus, iterations),
+            'cached_messages_per_sec': measure_throughput(cached, corpus, iterations)
+        },
+        'latency': measure_latency(uncached, corpus, iterations)
+    }
+    results['normalized'] = normalize(results)
+    return results
+
+def find_regressions(results: Dict, baseline: Dict, throughput_tolerance: float,
+                     latency_tolerance: float, accuracy_tolerance: float, absolute: bool = False) -> List[str]:
+    """Compare results with a baseline and describe every regression"""
+    regressions = []
+
+    for category, base in baseline['accuracy']['categories'].items():
+        current = results['accuracy']['categories'].get(category)
+        if not current:
+            regressions.append(f"{category}: missing from results")
+            continue
+        for metric in ('precision', 'recall'):
+            if current[metric] < base[metric] - accuracy_tolerance:
+                regressions.append(f"{category} {metric}: {current[metric]} < baseline {base[metric]}")
+
+    normalized = baseline.get('normalized')
+    if normalized:
+        current = results['normalized']
+        for metric in ('throughput_ratio', 'cache_speedup'):
+            if current[metric] < normalized[metric] * (1 - throughput_tolerance):
+                regressions.append(f"{metric}: {current[metric]} < baseline {normalized[metric]}")
+        for bucket, base_cost in normalized['p50_cost'].items():
+            cost = current['p50_cost'].get(bucket)
+            if cost and cost > base_cost * (1 + latency_tolerance):
+                regressions.append(f"normalized p50 {bucket}: {cost} > baseline {base_cost}")
+
+    if not absolute:
+        return regressions
+
+    for metric, base_value in baseline['throughput'].items():
+        current_value = results['throughput'].get(metric, 0.0)
+        if current_value < base_value * (1 - throughput_tolerance):
+            regressions.append(f"{metric}: {current_value} < baseline {base_value}")
+
+    for bucket, base in baseline['latency'].items():
+        current = results['latency'].get(bucket)
+        # p50 gates the run; p99 over a few dozen samples is too noisy to fail on
+        if current and current['p50_us'] > base['p50_us'] * (1 + latency_tolerance):
+            regressions.append(f"p50 latency {bucket}: {current['p50_us']}us > baseline {base['p50_us']}us")
+
+    return regressions
+
+def print_report(results: Dict, regressions: Optional[List[str]]):
+    print("🔍 Content Filter Benchmark")
+    print("=" * 60)
+    print(f"Corpus: {results['corpus_size']} messages, {results['iterations']} iterations")
+    print(f"Calibration: {results['calibration_ops_per_sec']} ops/s "
+          f"(throughput ratio {results['normalized']['throughput_ratio']}, "
+          f"cache speedup {results['normalized']['cache_speedup']}x)")
+    print(f"Throughput: {results['throughput']['messages_per_sec']} msg/s "
+          f"(cached: {results['throughput']['cached_messages_per_sec']} msg/s)")
+
+    print("\nLatency per message length:")
+    for bucket, stats in results['latency'].items():
+        print(f"  {bucket:>8} chars  p50 {stats['p50_us']:>9} us  p99 {stats['p99_us']:>9} us  (n={stats['samples']})")
+
+    print(f"\nAccuracy: {results['accuracy']['accuracy']}")
+    for category, stats in sorted(results['accuracy']['categories'].items()):
+        print(f"  {category:<20} precision {stats['precision']:<6} recall {stats['recall']:<6} (n={stats['support']})")
+
+    if results['accuracy']['errors']:
+        print("\nMisclassified:")
+        for error in results['accuracy']['errors']:
+            print(f"  [{error['kind']}] expected {error['expected']}, got {error['predicted']}: {error['text']!r}")
+
+    if regressions is None:
+        print("\n⚠️  No baseline found - run with --update-baseline to record one")
+    elif regressions:
+        print("\n❌ Regressions:")
+        for regression in regressions:
+            print(f"  {regression}")
+    else:
+        print("\n✅ No regressions against baseline")
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmark AIContentFilter speed and accuracy")
+    parser.add_argument('--iterations', type=int, default=20)
+    parser.add_argument('--update-baseline', action='store_true', help="Store these results as the new baseline")
+    parser.add_argument('--json', action='store_true', help="Print results as JSON")
+    parser.add_argument('--throughput-tolerance', type=float, default=0.3,
+                        help="Allowed relative throughput drop before failing")
+    parser.add_argument('--latency-tolerance', type=float, default=0.5,
+                        help="Allowed relative p50 latency increase before failing")
+    parser.add_argument('--accuracy-tolerance', type=float, default=0.0,
+                        help="Allowed absolute precision/recall drop before failing")
+    parser.add_argument('--absolute', action='store_true',
+                        help="Also gate on raw throughput/latency (only meaningful on the baseline's machine)")
+    args = parser.parse_args()
+
+    # Per-hit filter logging would dominate the timings
+    logging.disable(logging.CRITICAL)
+
+    results = run_benchmark(args.iterations)
+
+    if args.update_baseline:
+        baseline = {key: results[key] for key in ('calibration_ops_per_sec', 'normalized', 'throughput', 'latency')}
+        baseline['accuracy'] = {'accuracy': results['accuracy']['accuracy'],
+                                'categories': results['accuracy']['categories']}
+        with open(BASELINE_FILE, 'w', encoding='utf-8') as f:
+            json.dump(baseline, f, indent=2)
+
+    regressions = None
+    if os.path.exists(BASELINE_FILE):
+        with open(BASELINE_FILE, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = find_regressions(results, baseline, args.throughput_tolerance,
+                                       args.latency_tolerance, args.accuracy_tolerance, args.absolute)
+
+    if args.json:
+        print(json.dumps({'results': results, 'regressions': regressions}, indent=2))
+    else:
+        print_report(results, regressions)
+
+    return 1 if regressions else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
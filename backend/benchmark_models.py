@@ -0,0 +1,293 @@
+"""
+Storage benchmark for models.py at scale
+
+Synthesizes soulbridge_data.json datasets of increasing size, then times every SoulBridgeDB
+operation (load/save, creates, lookups, add_message, searches, stats, backup) for each storage
+mode, along with peak memory during load and save and the size of the file on disk. Exits
+non-zero when a result regresses against benchmark_data/models_baseline.json.
+
+A storage mode is a DatabaseManager subclass; register a new backend in STORAGE_MODES to
+compare it with the JSON file the app ships with.
+
+Usage:
+    python benchmark_models.py                          # 1k and 10k users, every storage mode
+    python benchmark_models.py --users 100000 --write-iterations 2
+    python benchmark_models.py --modes json             # only the shipped format
+    python benchmark_models.py --update-baseline        # record the current results as the new baseline
+    python benchmark_models.py --json                   # machine-readable output
+"""
+
+import os
+import gc
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import tracemalloc
+from typing import Callable, Dict, List, Optional, Tuple
+
+from models import DatabaseManager, SoulBridgeDB
+from synthetic_data import generate_dataset, dataset_counts, TOPICS, USER_MESSAGES, AI_RESPONSES, COMPANIONS
+
+BENCHMARK_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_data')
+BASELINE_FILE = os.path.join(BENCHMARK_DIR, 'models_baseline.json')
+
+class CompactJSONManager(DatabaseManager):
+    """The same JSON document written without indentation"""
+
+    def _dump(self, f):
+        json.dump(self.data, f, separators=(',', ':'), ensure_ascii=False)
+
+STORAGE_MODES = {
+    'json': DatabaseManager,
+    'json-compact': CompactJSONManager
+}
+
+def open_db(mode: str, db_file: str) -> SoulBridgeDB:
+    return SoulBridgeDB(db_file, db_manager=STORAGE_MODES[mode](db_file))
+
+# Operations: (name, writes, fn(db, rng, state)). Every write rewrites the whole file,
+# so writes run fewer iterations than reads.
+
+def _user(state: Dict, rng: random.Random) -> Dict:
+    return rng.choice(state['users'])
+
+def _new_email(state: Dict) -> str:
+    state['created'] += 1
+    return f"bench{state['created']}@example.com"
+
+OPERATIONS: List[Tuple[str, bool, Callable]] = [
+    ('users.get_user_by_id', False, lambda db, rng, state: db.users.get_user_by_id(_user(state, rng)['userID'])),
+    ('users.get_user_by_email', False, lambda db, rng, state: db.users.get_user_by_email(_user(state, rng)['email'])),
+    ('chat_history.get_chat_history', False,
+     lambda db, rng, state: db.chat_history.get_chat_history(_user(state, rng)['userID'])),
+    ('chat_history.memory.retrieve', False,
+     lambda db, rng, state: db.chat_history.memory.retrieve(_user(state, rng)['userID'], rng.choice(USER_MESSAGES))),
+    ('support_tickets.get_user_tickets', False,
+     lambda db, rng, state: db.support_tickets.get_user_tickets(_user(state, rng)['email'])),
+    ('support_tickets.get_all_tickets', False, lambda db, rng, state: db.support_tickets.get_all_tickets(status='open')),
+    ('support_tickets.search_tickets', False, lambda db, rng, state: db.support_tickets.search_tickets(rng.choice(TOPICS))),
+    ('support_tickets.get_ticket_stats', False, lambda db, rng, state: db.support_tickets.get_ticket_stats()),
+    ('billing.get_user_invoices', False, lambda db, rng, state: db.billing.get_user_invoices(_user(state, rng)['email'])),
+    ('billing.get_invoice_stats', False, lambda db, rng, state: db.billing.get_invoice_stats()),
+    ('knowledge_base.search_articles', False,
+     lambda db, rng, state: db.knowledge_base.search_articles(rng.choice(TOPICS))),
+    ('diagnostics.run_user_diagnostics', False,
+     lambda db, rng, state: db.diagnostics.run_user_diagnostics(_user(state, rng)['email'])),
+    ('diagnostics.get_system_health', False, lambda db, rng, state: db.diagnostics.get_system_health()),
+    ('get_user_stats', False, lambda db, rng, state: db.get_user_stats()),
+    ('users.create_user', True,
+     lambda db, rng, state: db.users.create_user(_new_email(state), rng.choice(COMPANIONS))),
+    ('users.update_user', True,
+     lambda db, rng, state: db.users.update_user(_user(state, rng)['userID'], {'companion': rng.choice(COMPANIONS)})),
+    ('chat_history.add_message', True,
+     lambda db, rng, state: db.chat_history.add_message(_user(state, rng)['userID'], rng.choice(USER_MESSAGES),
+                                                        rng.choice(AI_RESPONSES))),
+    ('support_tickets.create_ticket', True,
+     lambda db, rng, state: db.support_tickets.create_ticket(_user(state, rng)['email'], "Benchmark ticket",
+                                                            f"Question about {rng.choice(TOPICS)}")),
+    ('billing.create_invoice', True,
+     lambda db, rng, state: db.billing.create_invoice(_user(state, rng)['email'], 10.0, 'monthly')),
+    ('knowledge_base.create_article', True,
+     lambda db, rng, state: db.knowledge_base.create_article(f"Benchmark {rng.choice(TOPICS)}", "Body text",
+                                                             'features', 'admin@soulbridgeai.com', ['benchmark'])),
+    ('knowledge_base.increment_views', True,
+     lambda db, rng, state: db.knowledge_base.increment_views(rng.choice(state['article_ids']))),
+    ('backup_data', True,
+     lambda db, rng, state: db.backup_data(os.path.join(state['workdir'], 'soulbridge_backup.json'))),
+    ('save_data', True, lambda db, rng, state: db.db_manager.save_data()),
+    ('load', True, lambda db, rng, state: open_db(state['mode'], state['db_file']))
+]
+
+def _percentile(sorted_values: List[float], percentile: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(percentile / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+def time_operation(fn: Callable, db: SoulBridgeDB, rng: random.Random, state: Dict, iterations: int) -> Dict:
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn(db, rng, state)
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    return {
+        'calls': len(samples),
+        'mean_ms': round(sum(samples) / len(samples), 3),
+        'p50_ms': round(_percentile(samples, 50), 3),
+        'p95_ms': round(_percentile(samples, 95), 3),
+        'max_ms': round(samples[-1], 3)
+    }
+
+def _peak_mb(fn: Callable) -> Tuple[object, float, float]:
+    """Run fn under tracemalloc; returns (result, peak MB, MB still allocated afterwards)"""
+    gc.collect()
+    tracemalloc.start()
+    try:
+        result = fn()
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, round(peak / 2 ** 20, 1), round(current / 2 ** 20, 1)
+
+def run_dataset(mode: str, users: int, iterations: int, write_iterations: int, chat_mean: float,
+                seed: int) -> Dict:
+    workdir = tempfile.mkdtemp(prefix=f'soulbridge_bench_{mode}_{users}_')
+    db_file = os.path.join(workdir, 'soulbridge_data.json')
+    try:
+        # Write the synthetic dataset in the mode's own format
+        data = generate_dataset(users=users, seed=seed, chat_mean=chat_mean)
+        counts = dataset_counts(data)
+        manager = STORAGE_MODES[mode](db_file)
+        manager.data = data
+        _, save_peak_mb, _ = _peak_mb(manager._save_data)
+        del manager, data
+
+        db, load_peak_mb, resident_mb = _peak_mb(lambda: open_db(mode, db_file))
+        file_bytes = os.path.getsize(db_file)
+
+        rng = random.Random(seed)
+        state = {
+            'mode': mode,
+            'db_file': db_file,
+            'workdir': workdir,
+            'users': list(db.db_manager.data['users']),
+            'article_ids': [article['articleID'] for article in db.db_manager.data['knowledge_base']],
+            'created': 0
+        }
+        operations = {}
+        for name, writes, fn in OPERATIONS:
+            operations[name] = time_operation(fn, db, rng, state, write_iterations if writes else iterations)
+
+        return {
+            'dataset': counts,
+            'file_bytes': file_bytes,
+            'memory': {'load_peak_mb': load_peak_mb, 'resident_mb': resident_mb, 'save_peak_mb': save_peak_mb},
+            'operations': operations
+        }
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def run_benchmark(user_counts: List[int], modes: List[str], iterations: int = 50, write_iterations: int = 5,
+                  chat_mean: float = 8, seed: int = 42) -> Dict:
+    results = {
+        'config': {'iterations': iterations, 'write_iterations': write_iterations, 'chat_mean': chat_mean,
+                   'seed': seed, 'python': sys.version.split()[0]},
+        'runs': {}
+    }
+    for mode in modes:
+        results['runs'][mode] = {}
+        for users in user_counts:
+            results['runs'][mode][str(users)] = run_dataset(mode, users, iterations, write_iterations,
+                                                            chat_mean, seed)
+    return results
+
+def find_regressions(results: Dict, baseline: Dict, latency_tolerance: float, memory_tolerance: float,
+                     size_tolerance: float) -> List[str]:
+    """Compare every (mode, dataset size) present in both and describe each regression"""
+    regressions = []
+    for mode, base_sizes in baseline.get('runs', {}).items():
+        for users, base in base_sizes.items():
+            current = results['runs'].get(mode, {}).get(users)
+            if not current:
+                continue
+            label = f"{mode} {users} users"
+            for name, base_stats in base['operations'].items():
+                stats = current['operations'].get(name)
+                if not stats:
+                    regressions.append(f"{label} {name}: missing from results")
+                # p50 gates the run; p95 over a handful of writes is too noisy to fail on
+                elif stats['p50_ms'] > base_stats['p50_ms'] * (1 + latency_tolerance):
+                    regressions.append(f"{label} {name}: p50 {stats['p50_ms']}ms > baseline {base_stats['p50_ms']}ms")
+            for metric in ('load_peak_mb', 'save_peak_mb'):
+                if current['memory'][metric] > base['memory'][metric] * (1 + memory_tolerance):
+                    regressions.append(f"{label} {metric}: {current['memory'][metric]} > baseline {base['memory'][metric]}")
+            if current['file_bytes'] > base['file_bytes'] * (1 + size_tolerance):
+                regressions.append(f"{label} file size: {current['file_bytes']} > baseline {base['file_bytes']} bytes")
+    return regressions
+
+def print_report(results: Dict, regressions: Optional[List[str]]):
+    config = results['config']
+    print("🔍 SoulBridgeDB Storage Benchmark")
+    print("=" * 90)
+    print(f"{config['iterations']} read / {config['write_iterations']} write iterations per operation, "
+          f"~{config['chat_mean']} messages per user")
+
+    for mode, sizes in results['runs'].items():
+        for users, run in sizes.items():
+            dataset, memory = run['dataset'], run['memory']
+            print(f"\n[{mode}] {users} users, {dataset['messages']} messages, {dataset['support_tickets']} tickets, "
+                  f"{dataset['invoices']} invoices, {dataset['knowledge_base']} articles")
+            print(f"  File {run['file_bytes'] / 2 ** 20:.1f} MB, load peak {memory['load_peak_mb']} MB, "
+                  f"resident {memory['resident_mb']} MB, save peak {memory['save_peak_mb']} MB")
+            for name, stats in run['operations'].items():
+                print(f"  {name:<36} p50 {stats['p50_ms']:>10} ms  p95 {stats['p95_ms']:>10} ms  (n={stats['calls']})")
+
+    if regressions is None:
+        print("\n⚠️  No baseline found - run with --update-baseline to record one")
+    elif regressions:
+        print("\n❌ Regressions:")
+        for regression in regressions:
+            print(f"  {regression}")
+    else:
+        print("\n✅ No regressions against baseline")
+
+def _int_list(value: str) -> List[int]:
+    return [int(item) for item in value.split(',') if item.strip()]
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmark SoulBridgeDB operations on synthetic datasets")
+    parser.add_argument('--users', type=_int_list, default=[1000, 10000], help="Dataset sizes, e.g. 1000,10000,100000")
+    parser.add_argument('--modes', default=','.join(STORAGE_MODES), help="Comma-separated storage modes")
+    parser.add_argument('--iterations', type=int, default=50, help="Calls per read operation")
+    parser.add_argument('--write-iterations', type=int, default=5, help="Calls per write operation")
+    parser.add_argument('--chat-mean', type=float, default=8, help="Average stored chat messages per user")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--update-baseline', action='store_true', help="Store these results as the new baseline")
+    parser.add_argument('--json', action='store_true', help="Print results as JSON")
+    parser.add_argument('--latency-tolerance', type=float, default=0.5,
+                        help="Allowed relative p50 latency increase before failing")
+    parser.add_argument('--memory-tolerance', type=float, default=0.2,
+                        help="Allowed relative peak memory increase before failing")
+    parser.add_argument('--size-tolerance', type=float, default=0.1,
+                        help="Allowed relative file size increase before failing")
+    args = parser.parse_args()
+
+    modes = [mode.strip() for mode in args.modes.split(',') if mode.strip()]
+    unknown = [mode for mode in modes if mode not in STORAGE_MODES]
+    if unknown:
+        parser.error(f"unknown storage modes: {', '.join(unknown)} (choose from {', '.join(STORAGE_MODES)})")
+
+    results = run_benchmark(args.users, modes, args.iterations, args.write_iterations, args.chat_mean, args.seed)
+
+    if args.update_baseline:
+        # Merge so that modes and sizes measured in separate runs accumulate in one baseline
+        baseline = {'config': results['config'], 'runs': {}}
+        if os.path.exists(BASELINE_FILE):
+            with open(BASELINE_FILE, 'r', encoding='utf-8') as f:
+                baseline['runs'] = json.load(f).get('runs', {})
+        for mode, sizes in results['runs'].items():
+            baseline['runs'].setdefault(mode, {}).update(sizes)
+        with open(BASELINE_FILE, 'w', encoding='utf-8') as f:
+            json.dump(baseline, f, indent=2)
+
+    regressions = None
+    if os.path.exists(BASELINE_FILE):
+        with open(BASELINE_FILE, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = find_regressions(results, baseline, args.latency_tolerance, args.memory_tolerance,
+                                       args.size_tolerance)
+
+    if args.json:
+        print(json.dumps({'results': results, 'regressions': regressions}, indent=2))
+    else:
+        print_report(results, regressions)
+
+    return 1 if regressions else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
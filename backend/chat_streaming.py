@@ -0,0 +1,87 @@
+# Streaming Chat Responses (Server-Sent Events and chunked JSON)
+import json
+import logging
+from typing import Callable, Dict, Iterator, List, Optional
+
+from llm_client import Deadline, call_with_retries
+
+SSE_MIMETYPE = 'text/event-stream'
+NDJSON_MIMETYPE = 'application/x-ndjson'
+
+# Stop proxies (Railway, nginx) from buffering the stream
+STREAM_HEADERS = {
+    'Cache-Control': 'no-cache',
+    'X-Accel-Buffering': 'no'
+}
+
+def get_stream_format(data: Dict) -> Optional[str]:
+    """Return 'sse', 'ndjson' or None (regular JSON) from the request's "stream" field"""
+    stream = data.get('stream')
+    if stream in (True, 'sse', 'true'):
+        return 'sse'
+    if stream in ('ndjson', 'json', 'chunked'):
+        return 'ndjson'
+    return None
+
+def format_event(stream_format: str, event: str, payload: Dict) -> str:
+    """Encode one event for the chosen wire format"""
+    if stream_format == 'sse':
+        return f"event: {event}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+    return json.dumps(dict(payload, event=event), ensure_ascii=False) + "\n"
+
+def iter_completion_deltas(openai_client, deadline: Deadline = None, on_usage: Callable = None,
+                           **params) -> Iterator[str]:
+    """Open a streamed chat completion now and return an iterator over its text deltas
+
+    The stream is opened (with retries within the deadline) before returning, so a caller
+    can still fall back to a non-streamed answer if the upstream is down. Once text has
+    been sent to the browser a failure is reported instead of retried. on_usage receives
+    the final token usage reported by the API.
+    """
+    if on_usage:
+        params['stream_options'] = {"include_usage": True}
+    stream = call_with_retries(
+        lambda timeout: openai_client.chat.completions.create(stream=True, timeout=timeout, **params),
+        deadline
+    )
+    return _stream_deltas(stream, on_usage)
+
+def _stream_deltas(stream, on_usage: Callable = None) -> Iterator[str]:
+    """Yield text deltas from an open completion stream, closing the upstream on exit"""
+    try:
+        for chunk in stream:
+            if on_usage and chunk.usage:
+                on_usage(chunk.usage)
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                yield delta
+    finally:
+        # Also runs when the browser disconnects and the generator is closed
+        stream.close()
+
+def stream_chat_reply(stream_format: str, deltas: Iterator[str], on_complete: Callable[[str], None],
+                      error_message: Callable[[Exception], str], done_fields: Dict = None) -> Iterator[str]:
+    """Forward deltas to the client; persist via on_complete only once the reply is whole
+
+    done_fields are added to the final event (e.g. degraded=True for offline replies).
+    """
+    parts: List[str] = []
+    try:
+        for delta in deltas:
+            parts.append(delta)
+            yield format_event(stream_format, 'delta', {'delta': delta})
+    except Exception as e:
+        logging.exception("Error while streaming chat reply")
+        yield format_event(stream_format, 'error', {'success': False, 'error': error_message(e)})
+        return
+
+    ai_message = ''.join(parts).strip()
+    try:
+        on_complete(ai_message)
+    except Exception as e:
+        # The user already has the reply; don't turn a history write failure into an error
+        logging.error(f"Failed to persist streamed reply: {e}")
+
+    yield format_event(stream_format, 'done', dict(done_fields or {}, success=True, response=ai_message))
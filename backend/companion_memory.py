@@ -0,0 +1,201 @@
+# Long-Term Companion Memory
+#
+# A per-user BM25 index over stored chatHistory exchanges. The most relevant past
+# exchanges for the current message are handed to the model inside a small token budget,
+# so companions can remember beyond the recent-turn window without an embedding service.
+# Indexes are built lazily from history and updated incrementally as messages are added.
+import os
+import re
+import math
+import time
+import threading
+from collections import Counter, OrderedDict
+from typing import Callable, Dict, Iterable, List, Optional
+
+from token_estimator import MESSAGE_OVERHEAD_TOKENS, get_estimator
+
+_WORD_PATTERN = re.compile(r"[a-z0-9']+")
+
+STOPWORDS = frozenset("""
+a about above after again against all am an and any are as at be because been before being below between
+both but by can could did do does doing down during each few for from further had has have having he her
+here hers herself him himself his how i if in into is it its itself just me more most my myself no nor not
+now of off on once only or other our ours ourselves out over own same she should so some such than that the
+their theirs them themselves then there these they this those through to too under until up very was we were
+what when where which while who whom why will with would you your yours yourself yourselves im ive dont its
+""".split())
+
+def tokenize(text: str) -> List[str]:
+    """Lowercased content words with a light suffix strip, so 'worried' matches 'worry'"""
+    terms = []
+    for word in _WORD_PATTERN.findall(text.lower()):
+        word = word.strip("'")
+        if len(word) < 2 or word in STOPWORDS:
+            continue
+        for suffix in ('ing', 'ied', 'ies', 'ed', 'es', 's'):
+            if word.endswith(suffix) and len(word) - len(suffix) >= 3:
+                word = word[:-len(suffix)] + ('y' if suffix in ('ied', 'ies') else '')
+                break
+        terms.append(word)
+    return terms
+
+def exchange_text(message: Dict) -> str:
+    return f"{message.get('userMessage', '')}\n{message.get('aiResponse', '')}"
+
+class BM25Index:
+    """Inverted index with BM25 scoring; each document carries an arbitrary payload"""
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.documents: Dict[str, object] = {}         # doc_id -> payload
+        self.lengths: Dict[str, int] = {}
+        self.terms: Dict[str, tuple] = {}              # doc_id -> distinct terms, for removal
+        self.postings: Dict[str, Dict[str, int]] = {}  # term -> {doc_id: term frequency}
+        self.total_length = 0
+
+    def add(self, doc_id: str, text: str, payload: object):
+        if not doc_id or doc_id in self.documents:
+            return
+        terms = Counter(tokenize(text))
+        if not terms:
+            return
+        self.documents[doc_id] = payload
+        self.lengths[doc_id] = sum(terms.values())
+        self.terms[doc_id] = tuple(terms)
+        self.total_length += self.lengths[doc_id]
+        for term, frequency in terms.items():
+            self.postings.setdefault(term, {})[doc_id] = frequency
+
+    def remove(self, doc_id: str):
+        if self.documents.pop(doc_id, None) is None:
+            return
+        self.total_length -= self.lengths.pop(doc_id)
+        for term in self.terms.pop(doc_id):
+            postings = self.postings.get(term)
+            if postings:
+                postings.pop(doc_id, None)
+                if not postings:
+                    del self.postings[term]
+
+    def search(self, query: str, k: int) -> List[tuple]:
+        """Top-k (score, doc_id), best first"""
+        if not self.documents:
+            return []
+        count = len(self.documents)
+        average_length = self.total_length / count
+        scores: Dict[str, float] = {}
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+            for doc_id, frequency in postings.items():
+                norm = self.k1 * (1 - self.b + self.b * self.lengths[doc_id] / average_length)
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * frequency * (self.k1 + 1) / (frequency + norm)
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+        return [(score, doc_id) for doc_id, score in ranked]
+
+def _index_message(index: BM25Index, message: Dict):
+    # Only what the user said is indexed; the reply is context for the memory
+    index.add(message.get('messageID'), message.get('userMessage', ''), message)
+
+class CompanionMemory:
+    """Per-user memory indexes, kept for the most recently active users"""
+
+    def __init__(self, loader: Callable[[str], List[Dict]], max_users: int = None, token_budget: int = None,
+                 top_k: int = 3, min_score: float = 1.0, model: str = 'gpt-4o'):
+        self.loader = loader
+        self.max_users = max_users or int(os.environ.get('MEMORY_MAX_USERS', '5000'))
+        self.token_budget = token_budget or int(os.environ.get('MEMORY_TOKEN_BUDGET', '300'))
+        self.top_k = top_k
+        self.min_score = min_score
+        self.counter = get_estimator(model)
+        self.enabled = os.environ.get('COMPANION_MEMORY_ENABLED', 'true').lower() not in ('0', 'false', 'no')
+
+        self._indexes: OrderedDict = OrderedDict()
+        self._lock = threading.RLock()
+        self.retrievals = 0
+        self.retrieval_seconds = 0.0
+
+    def _index(self, user_id: str, build: bool = True) -> Optional[BM25Index]:
+        with self._lock:
+            index = self._indexes.get(user_id)
+            if index is not None:
+                self._indexes.move_to_end(user_id)
+                return index
+            if not build:
+                return None
+            index = BM25Index()
+            for message in self.loader(user_id):
+                _index_message(index, message)
+            self._indexes[user_id] = index
+            if len(self._indexes) > self.max_users:
+                self._indexes.popitem(last=False)
+            return index
+
+    def add(self, user_id: str, message: Dict):
+        """Index a new exchange; users without a loaded index pick it up when it is built"""
+        with self._lock:
+            index = self._index(user_id, build=False)
+            if index is not None:
+                _index_message(index, message)
+
+    def remove(self, user_id: str, message_id: str):
+        with self._lock:
+            index = self._index(user_id, build=False)
+            if index is not None:
+                index.remove(message_id)
+
+    def clear(self, user_id: str):
+        with self._lock:
+            self._indexes.pop(user_id, None)
+
+    def retrieve(self, user_id: str, query: str, exclude: Iterable[str] = ()) -> List[Dict]:
+        """Most relevant past exchanges for query that fit in the token budget
+
+        exclude holds texts already in the prompt (the recent turns), which are skipped.
+        """
+        if not self.enabled or not user_id or not query:
+            return []
+        started = time.perf_counter()
+        exclude = set(exclude)
+        with self._lock:
+            index = self._index(user_id)
+            hits = index.search(query, self.top_k * 3)
+            memories = []
+            used = MESSAGE_OVERHEAD_TOKENS
+            for score, message_id in hits:
+                if score < self.min_score or len(memories) >= self.top_k:
+                    break
+                message = index.documents[message_id]
+                if message.get('userMessage') in exclude:
+                    continue
+                tokens = self.counter.count(exchange_text(message))
+                if used + tokens > self.token_budget:
+                    continue
+                used += tokens
+                memories.append(message)
+            self.retrievals += 1
+            self.retrieval_seconds += time.perf_counter() - started
+        # Oldest first reads naturally as a recollection
+        return sorted(memories, key=lambda message: message.get('timestamp', ''))
+
+    @staticmethod
+    def memory_message(memories: List[Dict]) -> Optional[Dict]:
+        if not memories:
+            return None
+        lines = [f"- They said: \"{message.get('userMessage', '')}\" / You replied: \"{message.get('aiResponse', '')}\""
+                 for message in memories]
+        return {"role": "system", "content": "Things you remember from earlier conversations with this user:\n" + "\n".join(lines)}
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'users_indexed': len(self._indexes),
+                'documents_indexed': sum(len(index.documents) for index in self._indexes.values()),
+                'retrievals': self.retrievals,
+                'avg_retrieval_ms': round(self.retrieval_seconds / self.retrievals * 1000, 3) if self.retrievals else 0.0,
+                'token_budget': self.token_budget
+            }
@@ -0,0 +1,185 @@
+# Token-Budgeted Conversation Context
+#
+# Packs the newest chat turns into a fixed token budget and folds older turns into a
+# rolling summary, so the prompt stays bounded no matter how long the conversation runs.
+import os
+import logging
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Union
+
+from token_estimator import MESSAGE_OVERHEAD_TOKENS, REPLY_PRIMING_TOKENS, get_estimator
+from prompt_builder import PromptPrefix
+from llm_client import Deadline, DeadlineExceeded, call_with_retries
+
+@dataclass
+class ContextWindow:
+    """Result of packing a conversation"""
+    messages: List[Dict]                              # ready for chat.completions.create
+    turns: List[Dict]                                 # history still held verbatim
+    summary: str                                      # rolling summary of everything older
+    prompt_tokens: int
+    evicted: List[Dict] = field(default_factory=list)
+
+class ConversationContextManager:
+    """Packs system prompt + rolling summary + newest turns into a token budget
+
+    Per-turn token counts are cached on the turn itself ("tokens"), so each message is
+    counted once no matter how many later prompts it appears in.
+    """
+
+    def __init__(self, model: str = 'gpt-4o', token_budget: int = None, reply_tokens: int = 500,
+                 summary_tokens: int = 200, low_watermark: float = None,
+                 summarizer: Optional[Callable[..., str]] = None):
+        # summarizer(summary, evicted_turns, deadline=None, on_usage=None) -> new summary
+        self.model = model
+        self.counter = get_estimator(model)
+        self.token_budget = token_budget or int(os.environ.get('CONTEXT_TOKEN_BUDGET', '3000'))
+        self.reply_tokens = reply_tokens
+        self.summary_tokens = summary_tokens
+        # When turns must be evicted, evict down to this fraction of the budget so the
+        # summarizer runs once per batch of turns rather than on every message
+        self.low_watermark = low_watermark or float(os.environ.get('CONTEXT_LOW_WATERMARK', '0.75'))
+        self.summarizer = summarizer
+
+    def turn_tokens(self, turn: Dict) -> int:
+        tokens = turn.get('tokens')
+        if tokens is None:
+            tokens = self.counter.count_message(turn)
+            turn['tokens'] = tokens
+        return tokens
+
+    def build(self, system_prompt: Union[str, PromptPrefix], history: List[Dict], summary: str = '',
+              deadline: Deadline = None, on_usage: Optional[Callable] = None) -> ContextWindow:
+        """Pack history (oldest first, newest user turn last) into the budget
+
+        A precompiled PromptPrefix is used as-is, so its messages and token count are not rebuilt.
+        deadline and on_usage are handed to the summarizer when turns have to be folded.
+        """
+        available = self.token_budget - self.reply_tokens - REPLY_PRIMING_TOKENS
+        available -= self._prefix_tokens(system_prompt)
+        summary_cost = self._summary_message_tokens(summary)
+
+        total = sum(self.turn_tokens(turn) for turn in history)
+        if total + summary_cost <= available:
+            return self._window(system_prompt, history, summary, [])
+
+        # Over budget: keep the newest turns that fit under the low watermark (the latest
+        # turn always stays) and fold the rest into the summary
+        target = int((available - self.summary_tokens - MESSAGE_OVERHEAD_TOKENS) * self.low_watermark)
+        kept = []
+        used = 0
+        for turn in reversed(history):
+            tokens = self.turn_tokens(turn)
+            if kept and used + tokens > target:
+                break
+            kept.append(turn)
+            used += tokens
+        kept.reverse()
+
+        evicted = history[:len(history) - len(kept)]
+        summary = self.fold(summary, evicted, deadline, on_usage)
+        return self._window(system_prompt, kept, summary, evicted)
+
+    def fold(self, summary: str, evicted: List[Dict], deadline: Deadline = None,
+             on_usage: Optional[Callable] = None) -> str:
+        """Merge evicted turns into the rolling summary, capped at summary_tokens"""
+        if not evicted:
+            return summary
+
+        new_summary = None
+        if self.summarizer:
+            try:
+                new_summary = self.summarizer(summary, evicted, deadline=deadline, on_usage=on_usage)
+            except Exception as e:
+                logging.warning(f"Conversation summarizer failed, using extractive summary: {e}")
+
+        if not new_summary:
+            snippets = [f"{turn['role']}: {' '.join(turn.get('content', '').split())[:120]}"
+                        for turn in evicted if turn.get('role') == 'user']
+            new_summary = ' | '.join(part for part in [summary] + snippets if part)
+
+        return self._truncate(new_summary.strip(), self.summary_tokens)
+
+    def _truncate(self, text: str, max_tokens: int) -> str:
+        # Keep the most recent part of the summary
+        return self.counter.truncate_tail(text, max_tokens)
+
+    def _summary_message(self, summary: str) -> Dict:
+        return {"role": "system", "content": f"Summary of the earlier conversation: {summary}"}
+
+    def _summary_message_tokens(self, summary: str) -> int:
+        return self.counter.count_message(self._summary_message(summary)) if summary else 0
+
+    def _prefix_tokens(self, system_prompt: Union[str, PromptPrefix]) -> int:
+        if isinstance(system_prompt, PromptPrefix):
+            return system_prompt.tokens(self.model)
+        return self.counter.count_static(system_prompt) + MESSAGE_OVERHEAD_TOKENS
+
+    def _window(self, system_prompt: Union[str, PromptPrefix], turns: List[Dict], summary: str,
+                evicted: List[Dict]) -> ContextWindow:
+        if isinstance(system_prompt, PromptPrefix):
+            messages = list(system_prompt.messages)
+        else:
+            messages = [{"role": "system", "content": system_prompt}]
+        if summary:
+            messages.append(self._summary_message(summary))
+        messages.extend({"role": turn['role'], "content": turn['content']} for turn in turns)
+
+        prompt_tokens = (self._prefix_tokens(system_prompt)
+                         + self._summary_message_tokens(summary)
+                         + sum(self.turn_tokens(turn) for turn in turns) + REPLY_PRIMING_TOKENS)
+        return ContextWindow(messages=messages, turns=turns, summary=summary,
+                             prompt_tokens=prompt_tokens, evicted=evicted)
+
+def make_openai_summarizer(get_client: Callable, model: str = 'gpt-4o', max_tokens: int = 200, scheduler=None,
+                           tier: str = 'free', max_seconds: float = None):
+    """Summarizer that asks the model to merge evicted turns into the running summary
+
+    It runs inside a chat request, so the call gets at most half of what is left of the
+    request's deadline (and never more than max_seconds), leaving the rest for the reply.
+    Transient errors are retried within that budget and token usage goes to on_usage.
+    Running out of time or a queue timeout raises, which makes fold() fall back to the
+    extractive summary.
+    """
+    max_seconds = max_seconds or float(os.environ.get('CONTEXT_SUMMARY_TIMEOUT', '15'))
+
+    def summarize(summary: str, turns: List[Dict], deadline: Deadline = None,
+                  on_usage: Optional[Callable] = None) -> Optional[str]:
+        client = get_client()
+        if not client:
+            return None
+        budget = max_seconds if deadline is None else min(max_seconds, deadline.remaining() / 2)
+        if budget <= 0:
+            raise DeadlineExceeded("No time left in the request to summarize")
+        call_deadline = Deadline(budget)
+
+        transcript = "\n".join(f"{turn['role']}: {turn['content']}" for turn in turns)
+        prompt = f"""Update the running summary of a conversation between a user and an AI companion.
+Keep key topics, feelings, names and anything the user asked to remember. Reply with the summary only.
+
+Current summary:
+{summary or '(none)'}
+
+Earlier messages to fold in:
+{transcript}"""
+        messages = [{"role": "system", "content": prompt}]
+        estimated = get_estimator(model).estimate_request(messages, max_tokens)
+        slot = scheduler.acquire(tier, estimated, max_wait=min(scheduler.max_wait, call_deadline.remaining())) if scheduler else None
+        try:
+            response = call_with_retries(
+                lambda timeout: client.chat.completions.create(
+                    model=model,
+                    messages=messages,
+                    max_tokens=max_tokens,
+                    temperature=0.3,
+                    timeout=timeout
+                ),
+                call_deadline
+            )
+        finally:
+            if slot:
+                slot.release()
+        if on_usage and response.usage:
+            on_usage(response.usage)
+        return response.choices[0].message.content.strip()
+    return summarize
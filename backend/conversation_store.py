@@ -0,0 +1,162 @@
+# Server-Side Conversation Store
+#
+# Active chat state (recent turns + rolling summary) lives here, keyed by the id kept in
+# session["conversation_id"], so the session cookie stays a few bytes and every gunicorn
+# worker sees the same conversation.
+import os
+import json
+import uuid
+import sqlite3
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+class ConversationStore:
+    """SQLite-backed conversation state shared across workers"""
+
+    def __init__(self, db_path: str = None, retention_days: int = None):
+        self.db_path = db_path or os.environ.get('CONVERSATIONS_DB', 'soulbridge_conversations.db')
+        self.retention_days = retention_days or int(os.environ.get('CONVERSATION_RETENTION_DAYS', '30'))
+        self._writes = 0
+        self.init_database()
+
+    def get_connection(self):
+        """Get database connection"""
+        return sqlite3.connect(self.db_path, timeout=10)
+
+    def init_database(self):
+        """Initialize the conversations table"""
+        conn = self.get_connection()
+        # WAL lets readers in other workers proceed while a turn is being written
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS conversations (
+                conversation_id TEXT PRIMARY KEY,
+                turns TEXT NOT NULL,
+                summary TEXT NOT NULL DEFAULT '',
+                updated_at TIMESTAMP NOT NULL
+            )
+        ''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_conversations_updated ON conversations (updated_at)')
+        conn.commit()
+        conn.close()
+
+    @staticmethod
+    def new_id() -> str:
+        return uuid.uuid4().hex
+
+    def load(self, conversation_id: str) -> Tuple[List[Dict], str]:
+        """Return (turns, summary); an unknown id is an empty conversation"""
+        conn = self.get_connection()
+        try:
+            row = conn.execute('SELECT turns, summary FROM conversations WHERE conversation_id = ?',
+                               (conversation_id,)).fetchone()
+        finally:
+            conn.close()
+        if not row:
+            return [], ''
+        return json.loads(row[0]), row[1]
+
+    def update(self, conversation_id: str, add: List[Dict] = (), evicted: List[Dict] = (),
+               summary: Optional[str] = None) -> int:
+        """Atomically append turns and drop turns folded into the summary
+
+        Works on the stored history rather than the caller's copy, so turns written by a
+        concurrent request on the same conversation are kept. Turns carrying a request_id
+        already stored for the same role are skipped (a retried request never records its
+        reply twice), as is a user turn repeating the last stored user turn. Evicted turns
+        are removed where they are still stored; summary, if given, replaces the stored
+        summary. Returns the number of turns added.
+        """
+        conn = self.get_connection()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            row = conn.execute('SELECT turns, summary FROM conversations WHERE conversation_id = ?',
+                               (conversation_id,)).fetchone()
+            existing, stored_summary = (json.loads(row[0]), row[1]) if row else ([], '')
+
+            for turn in evicted:
+                key = self._turn_key(turn)
+                index = next((i for i, stored in enumerate(existing) if self._turn_key(stored) == key), None)
+                if index is not None:
+                    del existing[index]
+
+            seen = {(turn['role'], turn['request_id']) for turn in existing if turn.get('request_id')}
+            added = []
+            for turn in add:
+                if turn.get('request_id') and (turn['role'], turn['request_id']) in seen:
+                    continue
+                if (turn['role'] == 'user' and existing and existing[-1]['role'] == 'user'
+                        and existing[-1]['content'] == turn['content']):
+                    continue
+                existing.append(turn)
+                added.append(turn)
+
+            if not added and not evicted and summary is None:
+                conn.rollback()
+                return 0
+            conn.execute(
+                'INSERT OR REPLACE INTO conversations (conversation_id, turns, summary, updated_at) VALUES (?, ?, ?, ?)',
+                (conversation_id, json.dumps(existing, ensure_ascii=False),
+                 stored_summary if summary is None else summary, self._now())
+            )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+        self._after_write()
+        return len(added)
+
+    def append(self, conversation_id: str, turns: List[Dict]) -> bool:
+        """Atomically add turns, e.g. a reply that finished streaming after the request
+
+        Returns False if nothing was added (see update for what is skipped).
+        """
+        return self.update(conversation_id, add=turns) > 0
+
+    @staticmethod
+    def _turn_key(turn: Dict) -> tuple:
+        return (turn.get('role'), turn.get('content'), turn.get('request_id'))
+
+    def delete(self, conversation_id: str):
+        conn = self.get_connection()
+        try:
+            conn.execute('DELETE FROM conversations WHERE conversation_id = ?', (conversation_id,))
+            conn.commit()
+        finally:
+            conn.close()
+
+    def list_idle(self, idle_minutes: int, limit: int = 1000) -> List[str]:
+        """Ids of conversations untouched for at least idle_minutes (but not yet expired), most recent first"""
+        cutoff = (datetime.utcnow() - timedelta(minutes=idle_minutes)).isoformat() + "Z"
+        conn = self.get_connection()
+        try:
+            rows = conn.execute(
+                'SELECT conversation_id FROM conversations WHERE updated_at < ? ORDER BY updated_at DESC LIMIT ?',
+                (cutoff, limit)
+            ).fetchall()
+            return [row[0] for row in rows]
+        finally:
+            conn.close()
+
+    def purge_expired(self) -> int:
+        """Drop conversations idle for longer than the retention period"""
+        cutoff = (datetime.utcnow() - timedelta(days=self.retention_days)).isoformat() + "Z"
+        conn = self.get_connection()
+        try:
+            cursor = conn.execute('DELETE FROM conversations WHERE updated_at < ?', (cutoff,))
+            conn.commit()
+            return cursor.rowcount
+        finally:
+            conn.close()
+
+    def _after_write(self):
+        # Cheap periodic cleanup instead of a separate scheduler
+        self._writes += 1
+        if self._writes % 500 == 0:
+            self.purge_expired()
+
+    @staticmethod
+    def _now() -> str:
+        return datetime.utcnow().isoformat() + "Z"
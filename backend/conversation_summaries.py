@@ -0,0 +1,256 @@
+"""
+Cached, incremental conversation summaries
+
+Summaries are stored per conversation together with a content hash of the message window
+they describe. Asking again for an unchanged window is a single SQLite lookup; when new
+messages arrive only those are folded into the previous summary. An offline batch job
+pre-summarizes idle conversations so the endpoint rarely has to wait on the model.
+
+Usage:
+    python conversation_summaries.py [--idle-minutes 30] [--limit 1000] [--concurrency 4]
+"""
+
+import os
+import sys
+import json
+import sqlite3
+import hashlib
+import logging
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+
+from llm_client import Deadline, call_with_retries
+from single_flight import llm_single_flight
+from token_estimator import get_estimator
+
+# Messages considered for a summary (the newest ones)
+SUMMARY_WINDOW = 10
+
+def turn_digest(turn: Dict) -> str:
+    content = ' '.join(str(turn.get('content', '')).split())
+    return hashlib.blake2b(f"{turn.get('role', 'user')}\0{content}".encode('utf-8'), digest_size=12).hexdigest()
+
+def window_hash(digests: List[str]) -> str:
+    return hashlib.blake2b('\n'.join(digests).encode('utf-8'), digest_size=16).hexdigest()
+
+def summary_messages(previous_summary: str, turns: List[Dict]) -> List[Dict]:
+    """Prompt for a fresh summary, or for extending the previous one with newer messages"""
+    transcript = "\n".join(f"{turn.get('role', 'user')}: {turn.get('content', '')}" for turn in turns)
+    if previous_summary:
+        prompt = f"""Here is a summary of a conversation between a user and an AI companion so far:
+
+{previous_summary}
+
+Newer messages:
+{transcript}
+
+Update the summary to include the newer messages. Keep it to 2-3 sentences that capture key topics, emotions, and important moments."""
+    else:
+        prompt = f"""Provide a concise summary of this conversation between a user and an AI companion. Focus on key topics, emotions, and important moments:
+
+{transcript}
+
+Create a 2-3 sentence summary that captures the essence of the conversation."""
+    return [{"role": "system", "content": prompt}]
+
+def make_openai_summary_fn(get_client: Callable, model: str = 'gpt-4o', max_tokens: int = 200,
+                           scheduler=None, tier: str = 'free',
+                           before_call: Optional[Callable[[int], None]] = None,
+                           on_usage: Optional[Callable] = None) -> Callable[[str, List[Dict]], str]:
+    """summarize(previous_summary, new_turns) backed by chat completions
+
+    before_call gets the estimated token count (e.g. for a quota check) and may raise.
+    """
+    def summarize(previous_summary: str, turns: List[Dict]) -> str:
+        client = get_client()
+        if not client:
+            raise RuntimeError("OpenAI client not configured")
+        messages = summary_messages(previous_summary, turns)
+        estimated_tokens = get_estimator(model).estimate_request(messages, max_tokens)
+        if before_call:
+            before_call(estimated_tokens)
+
+        deadline = Deadline()
+        slot = scheduler.acquire(tier, estimated_tokens, max_wait=min(scheduler.max_wait, deadline.remaining())) if scheduler else None
+        try:
+            response = call_with_retries(
+                lambda timeout: client.chat.completions.create(
+                    model=model,
+                    messages=messages,
+                    max_tokens=max_tokens,
+                    temperature=0.3,
+                    timeout=timeout
+                ),
+                deadline
+            )
+        finally:
+            if slot:
+                slot.release()
+        if on_usage and response.usage:
+            on_usage(response.usage)
+        return response.choices[0].message.content.strip()
+    return summarize
+
+class ConversationSummaries:
+    """SQLite store of the latest summary per conversation, keyed by window content hash"""
+
+    def __init__(self, db_path: str = None, window: int = SUMMARY_WINDOW, single_flight=None):
+        self.db_path = db_path or os.environ.get('SUMMARIES_DB', 'soulbridge_summaries.db')
+        self.window = window
+        self.single_flight = single_flight or llm_single_flight
+        self.stats = {'cached': 0, 'incremental': 0, 'full': 0}
+        self._lock = threading.Lock()
+        self.init_database()
+
+    def get_connection(self):
+        """Get database connection"""
+        return sqlite3.connect(self.db_path, timeout=10)
+
+    def init_database(self):
+        """Initialize the summaries table"""
+        conn = self.get_connection()
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS conversation_summaries (
+                scope TEXT PRIMARY KEY,
+                window_hash TEXT NOT NULL,
+                last_turn TEXT NOT NULL,
+                summary TEXT NOT NULL,
+                updated_at TIMESTAMP NOT NULL
+            )
+        ''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_summaries_window ON conversation_summaries (window_hash)')
+        conn.commit()
+        conn.close()
+
+    def _load(self, scope: str) -> Optional[Tuple[str, str, str]]:
+        conn = self.get_connection()
+        try:
+            return conn.execute('SELECT window_hash, last_turn, summary FROM conversation_summaries WHERE scope = ?',
+                                (scope,)).fetchone()
+        finally:
+            conn.close()
+
+    def _load_by_window(self, digest: str) -> Optional[str]:
+        conn = self.get_connection()
+        try:
+            row = conn.execute('SELECT summary FROM conversation_summaries WHERE window_hash = ? LIMIT 1',
+                               (digest,)).fetchone()
+            return row[0] if row else None
+        finally:
+            conn.close()
+
+    def _save(self, scope: str, digest: str, last_turn: str, summary: str):
+        conn = self.get_connection()
+        try:
+            conn.execute(
+                'INSERT OR REPLACE INTO conversation_summaries (scope, window_hash, last_turn, summary, updated_at) VALUES (?, ?, ?, ?, ?)',
+                (scope, digest, last_turn, summary, datetime.utcnow().isoformat() + "Z")
+            )
+            conn.commit()
+        finally:
+            conn.close()
+
+    def summarize(self, scope: str, turns: List[Dict],
+                  summarize_fn: Callable[[str, List[Dict]], str]) -> Tuple[str, str]:
+        """Return (summary, source) where source is cached, incremental or full"""
+        turns = [turn for turn in turns if turn.get('content')][-self.window:]
+        if not turns:
+            return '', 'cached'
+        digests = [turn_digest(turn) for turn in turns]
+        digest = window_hash(digests)
+
+        row = self._load(scope)
+        if row and row[0] == digest:
+            self._count('cached')
+            return row[2], 'cached'
+
+        # The same window may already be summarized under another scope (e.g. by the batch job)
+        summary = self._load_by_window(digest)
+        if summary is not None:
+            self._save(scope, digest, digests[-1], summary)
+            self._count('cached')
+            return summary, 'cached'
+
+        # Extend the previous summary with only the turns after the last one it covered
+        previous, new_turns = '', turns
+        if row and row[1] in digests:
+            last_index = len(digests) - 1 - digests[::-1].index(row[1])
+            previous, new_turns = row[2], turns[last_index + 1:]
+            if not new_turns:
+                # Only older turns left the window; the stored summary still covers the newest
+                self._save(scope, digest, digests[-1], previous)
+                self._count('cached')
+                return previous, 'cached'
+
+        key = window_hash([digest, hashlib.blake2b(previous.encode('utf-8'), digest_size=8).hexdigest()])
+        summary, _ = self.single_flight.do(key, lambda: summarize_fn(previous, new_turns))
+        self._save(scope, digest, digests[-1], summary)
+        source = 'incremental' if previous else 'full'
+        self._count(source)
+        return summary, source
+
+    def _count(self, source: str):
+        with self._lock:
+            self.stats[source] += 1
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            stats = dict(self.stats)
+        total = sum(stats.values())
+        return dict(stats, hit_rate=round(stats['cached'] / total, 3) if total else 0.0)
+
+def summarize_idle(conversation_store, summaries: ConversationSummaries,
+                   summarize_fn: Callable[[str, List[Dict]], str], idle_minutes: int = 30,
+                   limit: int = 1000, concurrency: int = 4) -> Dict:
+    """Pre-summarize conversations idle for idle_minutes, at most `concurrency` model calls at a time"""
+    conversation_ids = conversation_store.list_idle(idle_minutes, limit)
+    counts = {'conversations': len(conversation_ids), 'cached': 0, 'incremental': 0, 'full': 0,
+              'skipped': 0, 'failed': 0}
+
+    def summarize_one(conversation_id: str) -> str:
+        turns, _ = conversation_store.load(conversation_id)
+        if len(turns) < 2:
+            return 'skipped'
+        try:
+            return summaries.summarize(conversation_id, turns, summarize_fn)[1]
+        except Exception as e:
+            logging.warning(f"Batch summary failed for {conversation_id}: {e}")
+            return 'failed'
+
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool:
+        for outcome in pool.map(summarize_one, conversation_ids):
+            counts[outcome] += 1
+    return counts
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Pre-summarize idle conversations")
+    parser.add_argument('--idle-minutes', type=int, default=30)
+    parser.add_argument('--limit', type=int, default=1000)
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--model', default='gpt-4o')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    from conversation_store import ConversationStore
+    from llm_client import get_openai_client
+    from usage_ledger import usage_ledger
+
+    summarize_fn = make_openai_summary_fn(
+        get_openai_client,
+        model=args.model,
+        on_usage=lambda usage: usage_ledger.record('system:batch-summaries', 'conversation_summary', args.model,
+                                                   usage.prompt_tokens, usage.completion_tokens)
+    )
+    counts = summarize_idle(ConversationStore(), ConversationSummaries(), summarize_fn,
+                            idle_minutes=args.idle_minutes, limit=args.limit, concurrency=args.concurrency)
+    usage_ledger.flush()
+    print(json.dumps(counts, indent=2))
+    return 0 if not counts['failed'] else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -13,6 +13,8 @@ class EmailService:
         self.smtp_port = int(os.environ.get('SMTP_PORT', '587'))
         self.smtp_username = os.environ.get('SMTP_USERNAME')
         self.smtp_password = os.environ.get('SMTP_PASSWORD')
+        # Local stub servers (stub_servers.py) speak plain SMTP
+        self.smtp_starttls = os.environ.get('SMTP_STARTTLS', 'true').lower() not in ('0', 'false', 'no')
         self.from_email = os.environ.get('FROM_EMAIL', self.smtp_username)
         self.from_name = os.environ.get('FROM_NAME', 'SoulBridge AI')
         
@@ -45,7 +47,8 @@ class EmailService:
             
             # Send email
             with smtplib.SMTP(self.smtp_server, self.smtp_port) as server:
-                server.starttls()
+                if self.smtp_starttls:
+                    server.starttls()
                 server.login(self.smtp_username, self.smtp_password)
                 server.send_message(msg)
             
@@ -0,0 +1,474 @@
+"""
+Retroactive content filter rescan of stored conversations
+
+Streams users' chatHistory and session_logs out of the JSON data file in chunks, classifies
+them with a compiled filter rule set across worker processes and writes a compact findings
+index. Jobs checkpoint after every chunk and can be resumed.
+
+Usage:
+    python filter_rescan.py start [--version N]   # create and run a job
+    python filter_rescan.py run JOB_ID            # run or resume an existing job
+    python filter_rescan.py list
+"""
+
+import os
+import sys
+import json
+import uuid
+import pickle
+import sqlite3
+import logging
+import argparse
+import subprocess
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from filter_rules import CompiledRuleSet, FilterRuleStore
+
+# Top-level arrays of the data file that hold conversation text
+RESCAN_SOURCES = ('users', 'session_logs')
+
+class JsonArrayStreamReader:
+    """Yield elements of top-level arrays in a JSON object file one at a time"""
+
+    def __init__(self, path: str, chunk_size: int = 1 << 16):
+        self.path = path
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+
+    def iter_items(self, keys) -> Iterator[Tuple[str, int, object]]:
+        """Yield (key, index, item) for every element of the requested arrays, in file order"""
+        with open(self.path, 'r', encoding='utf-8') as f:
+            self._file = f
+            self._buffer = ''
+            self._pos = 0
+            self._eof = False
+
+            self._expect('{')
+            if self._peek() == '}':
+                return
+            while True:
+                key = self._decode()
+                self._expect(':')
+                if self._peek() == '[':
+                    self._pos += 1
+                    index = 0
+                    if self._peek() == ']':
+                        self._pos += 1
+                    else:
+                        while True:
+                            item = self._decode()
+                            if key in keys:
+                                yield key, index, item
+                            index += 1
+                            if self._next_delimiter(',]') == ']':
+                                break
+                else:
+                    # Scalars and small objects such as metadata are skipped whole
+                    self._decode()
+
+                if self._next_delimiter(',}') == '}':
+                    return
+
+    def _fill(self) -> bool:
+        if self._eof:
+            return False
+        if self._pos > self.chunk_size:
+            self._buffer = self._buffer[self._pos:]
+            self._pos = 0
+        data = self._file.read(max(self.chunk_size, len(self._buffer)))
+        if not data:
+            self._eof = True
+            return False
+        self._buffer += data
+        return True
+
+    def _skip_whitespace(self):
+        while True:
+            while self._pos < len(self._buffer) and self._buffer[self._pos] in ' \t\r\n':
+                self._pos += 1
+            if self._pos < len(self._buffer) or not self._fill():
+                return
+
+    def _peek(self) -> str:
+        self._skip_whitespace()
+        if self._pos >= len(self._buffer):
+            raise ValueError("Unexpected end of JSON data")
+        return self._buffer[self._pos]
+
+    def _expect(self, char: str):
+        if self._peek() != char:
+            raise ValueError(f"Expected {char!r} at offset {self._pos}")
+        self._pos += 1
+
+    def _next_delimiter(self, allowed: str) -> str:
+        char = self._peek()
+        if char not in allowed:
+            raise ValueError(f"Expected one of {allowed!r} at offset {self._pos}")
+        self._pos += 1
+        return char
+
+    def _decode(self):
+        self._skip_whitespace()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self._buffer, self._pos)
+                # A number or literal ending exactly at the buffer edge may be truncated
+                if end < len(self._buffer) or self._eof:
+                    self._pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self._eof:
+                    raise
+            self._fill()
+
+def item_key(key: str, item: Dict) -> Optional[str]:
+    """Stable id of a top-level item (survives inserts, deletes and trimming elsewhere in the file)"""
+    item_id = item.get('userID') if key == 'users' else item.get('id')
+    return f"{key}:{item_id}" if item_id else None
+
+def iter_conversation_records(data_file: str, after_key: str = None,
+                              on_restart=None) -> Iterator[Tuple[Optional[str], List[Dict]]]:
+    """Yield (item key, records) per top-level item after the item keyed after_key
+
+    Records carry the text to classify. If the after_key item is gone from the file, on_restart
+    is called and every item is yielded again.
+    """
+    if after_key is not None:
+        resumed = False
+        for key, records in _iter_item_records(data_file):
+            if resumed:
+                yield key, records
+            elif key == after_key:
+                resumed = True
+        if resumed:
+            return
+        logging.warning(f"Rescan checkpoint {after_key} no longer in {data_file}; starting over")
+        if on_restart:
+            on_restart()
+    yield from _iter_item_records(data_file)
+
+def _iter_item_records(data_file: str) -> Iterator[Tuple[Optional[str], List[Dict]]]:
+    reader = JsonArrayStreamReader(data_file)
+    for key, _, item in reader.iter_items(RESCAN_SOURCES):
+        if not isinstance(item, dict):
+            continue
+
+        records = []
+        if key == 'users':
+            for message in item.get('chatHistory', []):
+                for field, source in (('userMessage', 'user'), ('aiResponse', 'ai_response')):
+                    if message.get(field):
+                        records.append({
+                            'source': 'chatHistory',
+                            'record_id': message.get('messageID', ''),
+                            'user_id': item.get('userID'),
+                            'field': source,
+                            'timestamp': message.get('timestamp'),
+                            'text': message[field]
+                        })
+        else:
+            for field, source in (('userMessage', 'user'), ('aiResponse', 'ai_response')):
+                if item.get(field):
+                    records.append({
+                        'source': 'session_logs',
+                        'record_id': str(item.get('id', '')),
+                        'user_id': item.get('userEmail'),
+                        'field': source,
+                        'timestamp': item.get('timestamp'),
+                        'text': item[field]
+                    })
+        yield item_key(key, item), records
+
+# Worker process state: the compiled rule set is unpickled once per process
+_worker_rules: Optional[CompiledRuleSet] = None
+
+def _init_worker(artifact: bytes):
+    global _worker_rules
+    _worker_rules = pickle.loads(artifact)
+
+def _classify_chunk(records: List[Dict]) -> List[Dict]:
+    findings = []
+    for record in records:
+        match = _worker_rules.match(' '.join(record['text'].lower().split()))
+        if match:
+            finding = {key: value for key, value in record.items() if key != 'text'}
+            finding['category'], finding['rule'] = match
+            findings.append(finding)
+    return findings
+
+class FilterRescanStore:
+    """Rescan jobs, checkpoints and findings index (stored beside the filter rule sets)"""
+
+    def __init__(self, db_path: str = None):
+        self.db_path = db_path or os.environ.get('FILTER_RULES_DB', 'soulbridge_filters.db')
+        self.init_database()
+
+    def get_connection(self):
+        """Get database connection"""
+        return sqlite3.connect(self.db_path, timeout=10)
+
+    def init_database(self):
+        """Initialize the rescan tables"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS filter_rescan_jobs (
+                job_id TEXT PRIMARY KEY,
+                rules_version INTEGER NOT NULL,
+                data_file TEXT NOT NULL,
+                status TEXT NOT NULL,
+                checkpoint INTEGER DEFAULT 0,
+                checkpoint_key TEXT,
+                scanned INTEGER DEFAULT 0,
+                findings INTEGER DEFAULT 0,
+                error TEXT,
+                created_at TIMESTAMP NOT NULL,
+                updated_at TIMESTAMP NOT NULL
+            )
+        ''')
+
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS filter_rescan_findings (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                job_id TEXT NOT NULL,
+                source TEXT NOT NULL,
+                record_id TEXT NOT NULL,
+                user_id TEXT,
+                field TEXT NOT NULL,
+                category TEXT NOT NULL,
+                rule TEXT NOT NULL,
+                message_timestamp TEXT,
+                UNIQUE (job_id, source, record_id, field)
+            )
+        ''')
+
+        # Jobs created before resume anchors were stable item ids
+        columns = [row[1] for row in cursor.execute('PRAGMA table_info(filter_rescan_jobs)')]
+        if 'checkpoint_key' not in columns:
+            cursor.execute('ALTER TABLE filter_rescan_jobs ADD COLUMN checkpoint_key TEXT')
+
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_rescan_findings_job ON filter_rescan_findings (job_id, category, id)')
+
+        conn.commit()
+        conn.close()
+
+    def create_job(self, rules_version: int, data_file: str) -> Dict:
+        job_id = f"rescan_{uuid.uuid4().hex[:8]}"
+        now = datetime.utcnow().isoformat() + "Z"
+        conn = self.get_connection()
+        try:
+            conn.execute(
+                'INSERT INTO filter_rescan_jobs (job_id, rules_version, data_file, status, created_at, updated_at) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (job_id, rules_version, os.path.abspath(data_file), 'pending', now, now)
+            )
+            conn.commit()
+        finally:
+            conn.close()
+        return self.get_job(job_id)
+
+    def get_job(self, job_id: str) -> Optional[Dict]:
+        conn = self.get_connection()
+        conn.row_factory = sqlite3.Row
+        try:
+            row = conn.execute('SELECT * FROM filter_rescan_jobs WHERE job_id = ?', (job_id,)).fetchone()
+        finally:
+            conn.close()
+        return dict(row) if row else None
+
+    def list_jobs(self, limit: int = 20) -> List[Dict]:
+        conn = self.get_connection()
+        conn.row_factory = sqlite3.Row
+        try:
+            rows = conn.execute('SELECT * FROM filter_rescan_jobs ORDER BY created_at DESC LIMIT ?', (limit,)).fetchall()
+        finally:
+            conn.close()
+        return [dict(row) for row in rows]
+
+    def update_status(self, job_id: str, status: str, error: str = None, only_if: str = None) -> bool:
+        """Set a job's status; with only_if, only while it still has that status (a cancel wins)"""
+        query = 'UPDATE filter_rescan_jobs SET status = ?, error = ?, updated_at = ? WHERE job_id = ?'
+        params = [status, error, datetime.utcnow().isoformat() + "Z", job_id]
+        if only_if:
+            query += ' AND status = ?'
+            params.append(only_if)
+        conn = self.get_connection()
+        try:
+            updated = conn.execute(query, params).rowcount
+            conn.commit()
+        finally:
+            conn.close()
+        return updated > 0
+
+    def reset_progress(self, job_id: str):
+        """Start a job's counters over (its findings are kept; rescanned records are deduplicated)"""
+        conn = self.get_connection()
+        try:
+            conn.execute('UPDATE filter_rescan_jobs SET checkpoint = 0, checkpoint_key = NULL, scanned = 0, '
+                         'updated_at = ? WHERE job_id = ?', (datetime.utcnow().isoformat() + "Z", job_id))
+            conn.commit()
+        finally:
+            conn.close()
+
+    def save_chunk(self, job_id: str, checkpoint_key: str, items: int, scanned: int, findings: List[Dict]):
+        """Write a chunk's findings and advance the checkpoint atomically
+
+        checkpoint_key is the id of the chunk's last item; checkpoint counts items done.
+        """
+        conn = self.get_connection()
+        try:
+            cursor = conn.executemany(
+                'INSERT OR IGNORE INTO filter_rescan_findings '
+                '(job_id, source, record_id, user_id, field, category, rule, message_timestamp) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                [(job_id, f['source'], f['record_id'], f['user_id'], f['field'], f['category'], f['rule'],
+                  f['timestamp']) for f in findings]
+            )
+            conn.execute(
+                'UPDATE filter_rescan_jobs SET checkpoint = checkpoint + ?, checkpoint_key = COALESCE(?, checkpoint_key), '
+                'scanned = scanned + ?, findings = findings + ?, updated_at = ? WHERE job_id = ?',
+                (items, checkpoint_key, scanned, max(cursor.rowcount, 0), datetime.utcnow().isoformat() + "Z", job_id)
+            )
+            conn.commit()
+        finally:
+            conn.close()
+
+    def get_findings(self, job_id: str, after_id: int = 0, limit: int = 100, category: str = None) -> List[Dict]:
+        """Keyset-paginated findings for the admin dashboard"""
+        query = ('SELECT id, source, record_id, user_id, field, category, rule, message_timestamp '
+                 'FROM filter_rescan_findings WHERE job_id = ? AND id > ?')
+        params = [job_id, after_id]
+        if category:
+            query += ' AND category = ?'
+            params.append(category)
+        query += ' ORDER BY id LIMIT ?'
+        params.append(limit)
+
+        conn = self.get_connection()
+        conn.row_factory = sqlite3.Row
+        try:
+            rows = conn.execute(query, params).fetchall()
+        finally:
+            conn.close()
+        return [dict(row) for row in rows]
+
+def run_job(job_id: str, workers: int = None, chunk_records: int = 500) -> Dict:
+    """Run or resume a rescan job from its last checkpoint"""
+    store = FilterRescanStore()
+    job = store.get_job(job_id)
+    if not job:
+        raise ValueError(f"Rescan job {job_id} not found")
+    if job['status'] == 'completed':
+        return job
+
+    compiled = FilterRuleStore().load_compiled(job['rules_version'])
+    if compiled is None:
+        store.update_status(job_id, 'failed', f"Rule set version {job['rules_version']} not found")
+        return store.get_job(job_id)
+
+    store.update_status(job_id, 'running')
+    workers = workers or max(1, (os.cpu_count() or 2) - 1)
+    artifact = pickle.dumps(compiled, protocol=pickle.HIGHEST_PROTOCOL)
+
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(artifact,)) as pool:
+            in_flight = deque()  # (future, last item key, items, records scanned)
+            chunk, chunk_key, chunk_items = [], None, 0
+
+            def drain(max_in_flight: int):
+                while len(in_flight) > max_in_flight:
+                    future, key, items, scanned = in_flight.popleft()
+                    store.save_chunk(job_id, key, items, scanned, future.result())
+
+            # Resume after the last saved item by id, so records deleted or trimmed since the
+            # last run (session_logs is capped) don't shift the resume point
+            if job['checkpoint'] and not job['checkpoint_key']:
+                # Saved by a positional checkpoint; nothing stable to resume after
+                store.reset_progress(job_id)
+            records_iter = iter_conversation_records(job['data_file'], job['checkpoint_key'],
+                                                     on_restart=lambda: store.reset_progress(job_id))
+            for key, records in records_iter:
+                chunk.extend(records)
+                chunk_key = key or chunk_key
+                chunk_items += 1
+                if len(chunk) >= chunk_records:
+                    in_flight.append((pool.submit(_classify_chunk, chunk), chunk_key, chunk_items, len(chunk)))
+                    chunk, chunk_key, chunk_items = [], None, 0
+                    # Bounded in-flight work keeps memory flat on large data files
+                    drain(workers * 2)
+                    if store.get_job(job_id)['status'] == 'cancelled':
+                        drain(0)
+                        return store.get_job(job_id)
+
+            if chunk_items:
+                in_flight.append((pool.submit(_classify_chunk, chunk), chunk_key, chunk_items, len(chunk)))
+            drain(0)
+
+        # A cancel that arrived after the last check stays cancelled
+        store.update_status(job_id, 'completed', only_if='running')
+    except Exception as e:
+        logging.error(f"Filter rescan {job_id} failed: {e}")
+        store.update_status(job_id, 'failed', str(e), only_if='running')
+
+    return store.get_job(job_id)
+
+def start_background_job(data_file: str, rules_version: int = None) -> Dict:
+    """Create a job and run it in a separate process so request workers stay free"""
+    if rules_version is None:
+        rules_version = FilterRuleStore().get_active_version()
+        if rules_version is None:
+            raise ValueError("No published filter rule set to rescan with")
+
+    job = FilterRescanStore().create_job(rules_version, data_file)
+    subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), 'run', job['job_id']],
+        cwd=os.getcwd(),
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        start_new_session=True
+    )
+    return job
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Rescan stored conversations with the content filter")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    start_parser = subparsers.add_parser('start', help="Create and run a rescan job")
+    start_parser.add_argument('--version', type=int, help="Rule set version (default: active)")
+    start_parser.add_argument('--data-file', default='soulbridge_data.json')
+    start_parser.add_argument('--workers', type=int)
+
+    run_parser = subparsers.add_parser('run', help="Run or resume a rescan job")
+    run_parser.add_argument('job_id')
+    run_parser.add_argument('--workers', type=int)
+
+    subparsers.add_parser('list', help="List recent rescan jobs")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    if args.command == 'list':
+        for job in FilterRescanStore().list_jobs():
+            print(json.dumps(job))
+        return 0
+
+    if args.command == 'start':
+        version = args.version if args.version is not None else FilterRuleStore().get_active_version()
+        if version is None:
+            print("❌ No published filter rule set to rescan with")
+            return 1
+        job_id = FilterRescanStore().create_job(version, args.data_file)['job_id']
+    else:
+        job_id = args.job_id
+
+    job = run_job(job_id, workers=args.workers)
+    print(json.dumps(job, indent=2))
+    return 0 if job['status'] == 'completed' else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,295 @@
+# Versioned Content Filter Rule Sets
+import os
+import re
+import json
+import pickle
+import sqlite3
+import logging
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+class KeywordAutomaton:
+    """Aho-Corasick automaton matching many lowercase keywords in one pass"""
+
+    def __init__(self, keywords: List[str]):
+        self.keywords = keywords
+        self.goto: List[Dict[str, int]] = [{}]
+        self.fail: List[int] = [0]
+        self.output: List[List[int]] = [[]]
+        self._build()
+
+    def _build(self):
+        # Trie of all keywords
+        for index, keyword in enumerate(self.keywords):
+            state = 0
+            for char in keyword:
+                next_state = self.goto[state].get(char)
+                if next_state is None:
+                    next_state = len(self.goto)
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.output.append([])
+                    self.goto[state][char] = next_state
+                state = next_state
+            self.output[state].append(index)
+
+        # Breadth-first failure links
+        queue = list(self.goto[0].values())
+        while queue:
+            next_queue = []
+            for state in queue:
+                for char, child in self.goto[state].items():
+                    fallback = self.fail[state]
+                    while fallback and char not in self.goto[fallback]:
+                        fallback = self.fail[fallback]
+                    self.fail[child] = self.goto[fallback].get(char, 0)
+                    self.output[child] = self.output[child] + self.output[self.fail[child]]
+                    next_queue.append(child)
+            queue = next_queue
+
+    def find_all(self, text: str) -> List[int]:
+        """Return indexes of every keyword occurring in text"""
+        goto, fail, output = self.goto, self.fail, self.output
+        found = []
+        state = 0
+        for char in text:
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if output[state]:
+                found.extend(output[state])
+        return found
+
+class CompiledRuleSet:
+    """Immutable compiled form of a rule set (automaton plus patterns)"""
+
+    def __init__(self, version: int, categories: Dict[str, List[str]], patterns: List[str],
+                 pattern_category: str = 'inappropriate'):
+        self.version = version
+        self.categories = {category: list(words) for category, words in categories.items()}
+        self.patterns = list(patterns)
+        self.pattern_category = pattern_category
+
+        # Each keyword keeps the highest-priority (category order, list order) rank it appears at,
+        # so one automaton pass gives the same verdict as scanning categories in order
+        ranks: Dict[str, Tuple[int, int, str]] = {}
+        for category_rank, (category, words) in enumerate(self.categories.items()):
+            for word_rank, word in enumerate(words):
+                word = word.lower()
+                if not word:
+                    continue
+                rank = (category_rank, word_rank, category)
+                if word not in ranks or rank < ranks[word]:
+                    ranks[word] = rank
+
+        self.keywords = list(ranks.keys())
+        self.keyword_ranks = [ranks[word] for word in self.keywords]
+        self.automaton = KeywordAutomaton(self.keywords)
+        self.pattern_regex = re.compile('|'.join(f'(?:{p})' for p in self.patterns)) if self.patterns else None
+
+    def match(self, message_lower: str) -> Optional[Tuple[str, str]]:
+        """Return (category, rule) for the highest-priority hit, or None if clean"""
+        hits = self.automaton.find_all(message_lower)
+        if hits:
+            best = min(hits, key=lambda index: self.keyword_ranks[index])
+            return self.keyword_ranks[best][2], self.keywords[best]
+
+        if self.pattern_regex is not None:
+            found = self.pattern_regex.search(message_lower)
+            if found:
+                return self.pattern_category, f"pattern:{found.group(0)}"
+
+        return None
+
+class FilterRuleStore:
+    """SQLite-backed history of published rule sets shared by every worker"""
+
+    def __init__(self, db_path: str = None):
+        self.db_path = db_path or os.environ.get('FILTER_RULES_DB', 'soulbridge_filters.db')
+        self.init_database()
+
+    def get_connection(self):
+        """Get database connection"""
+        return sqlite3.connect(self.db_path, timeout=10)
+
+    def init_database(self):
+        """Initialize the rule set tables"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS filter_rule_sets (
+                version INTEGER PRIMARY KEY AUTOINCREMENT,
+                categories TEXT NOT NULL,
+                patterns TEXT NOT NULL,
+                artifact BLOB,
+                created_by TEXT,
+                note TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS filter_rule_state (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                active_version INTEGER NOT NULL,
+                updated_at TIMESTAMP NOT NULL
+            )
+        ''')
+
+        conn.commit()
+        conn.close()
+
+    def get_active_version(self) -> Optional[int]:
+        """Cheap lookup of the currently active version"""
+        conn = self.get_connection()
+        try:
+            row = conn.execute('SELECT active_version FROM filter_rule_state WHERE id = 1').fetchone()
+            return row[0] if row else None
+        finally:
+            conn.close()
+
+    def load_compiled(self, version: int) -> Optional[CompiledRuleSet]:
+        """Load the compiled artifact of a version without recompiling it"""
+        conn = self.get_connection()
+        try:
+            row = conn.execute('SELECT artifact FROM filter_rule_sets WHERE version = ?', (version,)).fetchone()
+        finally:
+            conn.close()
+
+        if not row or row[0] is None:
+            return None
+        return pickle.loads(row[0])
+
+    def get_rule_set(self, version: int) -> Optional[Dict]:
+        """Get the source rules of a version"""
+        conn = self.get_connection()
+        try:
+            row = conn.execute(
+                'SELECT version, categories, patterns, created_by, note, created_at FROM filter_rule_sets WHERE version = ?',
+                (version,)
+            ).fetchone()
+        finally:
+            conn.close()
+
+        if not row:
+            return None
+        return {
+            'version': row[0],
+            'categories': json.loads(row[1]),
+            'patterns': json.loads(row[2]),
+            'created_by': row[3],
+            'note': row[4],
+            'created_at': row[5]
+        }
+
+    def publish(self, categories: Dict[str, List[str]], patterns: List[str],
+                created_by: str = 'system', note: str = '') -> CompiledRuleSet:
+        """Compile a new rule set once, store it and make it the active version"""
+        return self._publish(lambda active: (categories, patterns), created_by, note)
+
+    def publish_change(self, category: str, add: List[str] = (), remove: List[str] = (),
+                       defaults: Tuple[Dict[str, List[str]], List[str]] = None,
+                       created_by: str = 'system', note: str = '') -> Optional[CompiledRuleSet]:
+        """Publish the active rule set with words added to or removed from one category
+
+        The change is applied to the active version as read inside the publish transaction,
+        so concurrent edits made through different workers all land. defaults (categories,
+        patterns) stand in while nothing has been published yet. Returns None when removing
+        from a category that doesn't exist.
+        """
+        def apply(active):
+            categories, patterns = active or defaults
+            categories = {name: list(words) for name, words in categories.items()}
+            if category not in categories:
+                if not add:
+                    return None
+                categories[category] = []
+            words = categories[category]
+            words.extend(add)
+            for word in remove:
+                if word in words:
+                    words.remove(word)
+            return categories, patterns
+
+        return self._publish(apply, created_by, note)
+
+    def _publish(self, build, created_by: str, note: str) -> Optional[CompiledRuleSet]:
+        """Publish build(active (categories, patterns) or None); None from build publishes nothing"""
+        conn = self.get_connection()
+        try:
+            # Serialize concurrent publishers so versions stay strictly ordered and each
+            # change is built on the version published before it
+            conn.execute('BEGIN IMMEDIATE')
+            row = conn.execute(
+                'SELECT s.categories, s.patterns FROM filter_rule_state st '
+                'JOIN filter_rule_sets s ON s.version = st.active_version WHERE st.id = 1'
+            ).fetchone()
+            rules = build((json.loads(row[0]), json.loads(row[1])) if row else None)
+            if rules is None:
+                conn.rollback()
+                return None
+            categories, patterns = rules
+
+            cursor = conn.execute(
+                'INSERT INTO filter_rule_sets (categories, patterns, created_by, note) VALUES (?, ?, ?, ?)',
+                (json.dumps(categories), json.dumps(patterns), created_by, note)
+            )
+            version = cursor.lastrowid
+
+            compiled = CompiledRuleSet(version, categories, patterns)
+            conn.execute(
+                'UPDATE filter_rule_sets SET artifact = ? WHERE version = ?',
+                (pickle.dumps(compiled, protocol=pickle.HIGHEST_PROTOCOL), version)
+            )
+            self._set_active(conn, version)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+        logging.info(f"Published filter rule set version {version} by {created_by}")
+        return compiled
+
+    def activate(self, version: int) -> bool:
+        """Make an existing version active again (rollback)"""
+        conn = self.get_connection()
+        try:
+            exists = conn.execute('SELECT 1 FROM filter_rule_sets WHERE version = ?', (version,)).fetchone()
+            if not exists:
+                return False
+            self._set_active(conn, version)
+            conn.commit()
+        finally:
+            conn.close()
+
+        logging.info(f"Activated filter rule set version {version}")
+        return True
+
+    def list_versions(self, limit: int = 20) -> List[Dict]:
+        """List recent versions, newest first"""
+        active_version = self.get_active_version()
+        conn = self.get_connection()
+        try:
+            rows = conn.execute(
+                'SELECT version, created_by, note, created_at FROM filter_rule_sets ORDER BY version DESC LIMIT ?',
+                (limit,)
+            ).fetchall()
+        finally:
+            conn.close()
+
+        return [{
+            'version': row[0],
+            'created_by': row[1],
+            'note': row[2],
+            'created_at': row[3],
+            'active': row[0] == active_version
+        } for row in rows]
+
+    def _set_active(self, conn, version: int):
+        conn.execute(
+            'INSERT OR REPLACE INTO filter_rule_state (id, active_version, updated_at) VALUES (1, ?, ?)',
+            (version, datetime.utcnow().isoformat() + "Z")
+        )
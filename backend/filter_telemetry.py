@@ -0,0 +1,221 @@
+# Content Filter Telemetry and Crisis Alert Channel
+import os
+import time
+import queue
+import random
+import atexit
+import sqlite3
+import logging
+import threading
+from collections import deque
+from datetime import datetime
+from typing import Dict, List, Optional
+
+event_logger = logging.getLogger('soulbridge.filter')
+
+class CrisisAlertStore:
+    """Durable SQLite record of every crisis detection"""
+
+    def __init__(self, db_path: str = None):
+        self.db_path = db_path or os.environ.get('CRISIS_ALERTS_DB', 'soulbridge_alerts.db')
+        self.init_database()
+
+    def get_connection(self):
+        """Get database connection"""
+        return sqlite3.connect(self.db_path, timeout=10)
+
+    def init_database(self):
+        """Initialize the crisis alerts table"""
+        conn = self.get_connection()
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS crisis_alerts (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                detected_at TIMESTAMP NOT NULL,
+                rule TEXT NOT NULL,
+                companion TEXT,
+                user_id TEXT,
+                source TEXT,
+                excerpt TEXT,
+                acknowledged INTEGER DEFAULT 0
+            )
+        ''')
+        conn.commit()
+        conn.close()
+
+    def save_alert(self, alert: Dict):
+        conn = self.get_connection()
+        try:
+            conn.execute(
+                'INSERT INTO crisis_alerts (detected_at, rule, companion, user_id, source, excerpt) VALUES (?, ?, ?, ?, ?, ?)',
+                (alert['detected_at'], alert['rule'], alert.get('companion'), alert.get('user_id'),
+                 alert.get('source'), alert.get('excerpt'))
+            )
+            conn.commit()
+        finally:
+            conn.close()
+
+    def get_recent_alerts(self, limit: int = 50) -> List[Dict]:
+        conn = self.get_connection()
+        try:
+            rows = conn.execute(
+                'SELECT id, detected_at, rule, companion, user_id, source, excerpt, acknowledged '
+                'FROM crisis_alerts ORDER BY id DESC LIMIT ?', (limit,)
+            ).fetchall()
+        finally:
+            conn.close()
+
+        return [{
+            'id': row[0],
+            'detected_at': row[1],
+            'rule': row[2],
+            'companion': row[3],
+            'user_id': row[4],
+            'source': row[5],
+            'excerpt': row[6],
+            'acknowledged': bool(row[7])
+        } for row in rows]
+
+class FilterTelemetry:
+    """In-memory filter counters plus a sampled, queue-backed hit event stream"""
+
+    def __init__(self, sample_rate: float = None, max_pending_events: int = 1000, recent_events: int = 200):
+        self.sample_rate = sample_rate if sample_rate is not None else float(os.environ.get('FILTER_EVENT_SAMPLE_RATE', '0.1'))
+        self.max_pending_events = max_pending_events
+        self.started_at = time.time()
+
+        self._lock = threading.Lock()
+        self.checks = {}         # source -> messages checked
+        self.category_hits = {}  # category -> hits
+        self.rule_hits = {}      # "category:rule" -> hits
+        self.dropped_events = 0
+        self._minute_buckets = deque(maxlen=60)  # (minute, {category: hits})
+
+        # Background writer: sampled events may be dropped, crisis alerts never are
+        self._queue = queue.Queue()
+        self._pending_events = 0
+        self.recent_events = deque(maxlen=recent_events)
+        self.alert_store = None
+        self._worker = None
+
+    def record(self, category: Optional[str], rule: Optional[str], source: str = 'user',
+               companion: str = None, user_id: str = None, message: str = None):
+        """Count one filter check; hits are sampled into the event stream"""
+        minute = int(time.time() // 60)
+        with self._lock:
+            self.checks[source] = self.checks.get(source, 0) + 1
+            if category is None:
+                return
+
+            self.category_hits[category] = self.category_hits.get(category, 0) + 1
+            rule_key = f"{category}:{rule}"
+            self.rule_hits[rule_key] = self.rule_hits.get(rule_key, 0) + 1
+
+            if not self._minute_buckets or self._minute_buckets[-1][0] != minute:
+                self._minute_buckets.append((minute, {}))
+            bucket = self._minute_buckets[-1][1]
+            bucket[category] = bucket.get(category, 0) + 1
+
+        event = {
+            'timestamp': datetime.utcnow().isoformat() + "Z",
+            'category': category,
+            'rule': rule,
+            'source': source,
+            'companion': companion
+        }
+
+        if category == 'crisis_intervention':
+            event['user_id'] = user_id
+            event['excerpt'] = (message or '')[:200]
+            self._enqueue('alert', event)
+        elif random.random() < self.sample_rate:
+            with self._lock:
+                if self._pending_events >= self.max_pending_events:
+                    self.dropped_events += 1
+                    return
+                self._pending_events += 1
+            self._enqueue('event', event)
+
+    def _enqueue(self, kind: str, item: Dict):
+        self._ensure_worker()
+        self._queue.put((kind, item))
+
+    def _ensure_worker(self):
+        if self._worker is None or not self._worker.is_alive():
+            with self._lock:
+                if self._worker is None or not self._worker.is_alive():
+                    self._worker = threading.Thread(target=self._run, name='filter-telemetry', daemon=True)
+                    self._worker.start()
+
+    def _run(self):
+        while True:
+            kind, item = self._queue.get()
+            try:
+                self._handle(kind, item)
+            finally:
+                self._queue.task_done()
+
+    def _handle(self, kind: str, item: Dict):
+        if kind == 'alert':
+            try:
+                if self.alert_store is None:
+                    self.alert_store = CrisisAlertStore()
+                item['detected_at'] = item['timestamp']
+                self.alert_store.save_alert(item)
+            except Exception as e:
+                event_logger.error(f"Failed to persist crisis alert: {e}")
+            event_logger.critical(f"CRISIS INTERVENTION TRIGGERED: {item['rule']} ({item['source']})")
+        else:
+            with self._lock:
+                self._pending_events -= 1
+            event_logger.info(f"Content filter triggered: {item['category']} - rule: {item['rule']} ({item['source']})")
+        self.recent_events.append(item)
+
+    def flush(self, timeout: float = 5.0):
+        """Wait for queued alerts and events to be written"""
+        if self._worker is None:
+            return
+        deadline = time.time() + timeout
+        while self._queue.unfinished_tasks and time.time() < deadline:
+            time.sleep(0.01)
+
+    def get_stats(self, window_minutes: int = 5) -> Dict:
+        """Counters and per-minute hit rates for the admin dashboard"""
+        current_minute = int(time.time() // 60)
+        with self._lock:
+            window_hits = {}
+            hour_hits = {}
+            for minute, counts in self._minute_buckets:
+                for category, hits in counts.items():
+                    if current_minute - minute < window_minutes:
+                        window_hits[category] = window_hits.get(category, 0) + hits
+                    if current_minute - minute < 60:
+                        hour_hits[category] = hour_hits.get(category, 0) + hits
+
+            top_rules = sorted(self.rule_hits.items(), key=lambda item: item[1], reverse=True)[:20]
+            total_checks = sum(self.checks.values())
+            total_hits = sum(self.category_hits.values())
+
+            return {
+                'uptime_seconds': round(time.time() - self.started_at, 1),
+                'checks': dict(self.checks),
+                'total_checks': total_checks,
+                'total_hits': total_hits,
+                'hit_rate': round(total_hits / total_checks, 4) if total_checks else 0.0,
+                'category_hits': dict(self.category_hits),
+                'hits_per_minute': {category: round(hits / window_minutes, 2) for category, hits in window_hits.items()},
+                'hits_last_hour': hour_hits,
+                'rate_window_minutes': window_minutes,
+                'top_rules': [{'rule': rule, 'hits': hits} for rule, hits in top_rules],
+                'sample_rate': self.sample_rate,
+                'dropped_events': self.dropped_events,
+                'recent_events': list(self.recent_events)[-50:]
+            }
+
+    def get_crisis_alerts(self, limit: int = 50) -> List[Dict]:
+        if self.alert_store is None:
+            self.alert_store = CrisisAlertStore()
+        return self.alert_store.get_recent_alerts(limit)
+
+# Global instance
+filter_telemetry = FilterTelemetry()
+atexit.register(filter_telemetry.flush)
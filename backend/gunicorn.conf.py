@@ -0,0 +1,31 @@
+# Gunicorn configuration for SoulBridge AI
+#
+# Chat, summary and model-manager routes spend almost all of their time waiting on OpenAI.
+# Cooperative (gevent) workers let one process hold hundreds of in-flight completions
+# instead of pinning a whole worker per chat. Without gevent installed we fall back to
+# threaded workers, which still keep health checks and static pages off the chat queue.
+import os
+
+from llm_scheduler import web_concurrency
+
+def _default_worker_class():
+    try:
+        import gevent  # noqa: F401
+        return 'gevent'
+    except ImportError:
+        return 'gthread'
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8080')}"
+workers = web_concurrency()
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', _default_worker_class())
+
+# gevent: concurrent connections per worker; gthread: threads per worker
+worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', '500'))
+threads = int(os.environ.get('GUNICORN_THREADS', '32'))
+
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', '120'))
+graceful_timeout = 30
+keepalive = 5
+
+# Each worker must import (and monkey patch) the app itself
+preload_app = False
@@ -0,0 +1,214 @@
+# Shared LLM Client Layer
+#
+# One pooled, keep-alive OpenAI client per process, used by the chat routes, conversation
+# summaries and AIModelManager so consecutive turns reuse the same TLS connection.
+import os
+import time
+import random
+import logging
+import threading
+from email.utils import parsedate_to_datetime
+from typing import Any, Callable, Optional
+
+import httpx
+from openai import (OpenAI, APIConnectionError, APIStatusError, APITimeoutError,
+                    AuthenticationError, RateLimitError)
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+def _http2_available() -> bool:
+    """HTTP/2 needs the optional h2 package (pip install httpx[http2])"""
+    if os.environ.get('OPENAI_HTTP2', 'true').lower() in ('0', 'false', 'no'):
+        return False
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+def get_timeout() -> httpx.Timeout:
+    """Connect/read/write/pool timeouts, in seconds"""
+    return httpx.Timeout(
+        connect=_env_float('OPENAI_CONNECT_TIMEOUT', 5.0),
+        read=_env_float('OPENAI_READ_TIMEOUT', 60.0),
+        write=_env_float('OPENAI_WRITE_TIMEOUT', 10.0),
+        pool=_env_float('OPENAI_POOL_TIMEOUT', 5.0)
+    )
+
+def get_limits() -> httpx.Limits:
+    """Connection pool size and how long idle keep-alive connections are kept"""
+    return httpx.Limits(
+        max_connections=_env_int('OPENAI_MAX_CONNECTIONS', 100),
+        max_keepalive_connections=_env_int('OPENAI_MAX_KEEPALIVE', 20),
+        keepalive_expiry=_env_float('OPENAI_KEEPALIVE_EXPIRY', 60.0)
+    )
+
+class LLMClientPool:
+    """Lazily built OpenAI client with a pooled keep-alive transport"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._client = None
+        self._api_key = None
+
+    def _client_kwargs(self, api_key: str) -> dict:
+        kwargs = {
+            'api_key': api_key,
+            'timeout': get_timeout(),
+            # Retries are done by call_with_retries so they can respect the request deadline
+            'max_retries': _env_int('OPENAI_MAX_RETRIES', 0)
+        }
+        base_url = os.environ.get('OPENAI_BASE_URL')
+        if base_url:
+            kwargs['base_url'] = base_url
+        return kwargs
+
+    def get_client(self) -> Optional[OpenAI]:
+        """Shared sync client, or None when OPENAI_API_KEY is not set"""
+        api_key = os.environ.get('OPENAI_API_KEY')
+        if not api_key:
+            return None
+
+        with self._lock:
+            if self._client is None or api_key != self._api_key:
+                self._close_clients()
+                http2 = _http2_available()
+                self._client = OpenAI(
+                    http_client=httpx.Client(limits=get_limits(), timeout=get_timeout(), http2=http2),
+                    **self._client_kwargs(api_key)
+                )
+                self._api_key = api_key
+                logging.info(f"OpenAI client initialized (pooled, http2={'on' if http2 else 'off'})")
+            return self._client
+
+    def reset(self) -> Optional[OpenAI]:
+        """Drop pooled connections and rebuild from the current environment"""
+        with self._lock:
+            self._close_clients()
+        return self.get_client()
+
+    def _close_clients(self):
+        if self._client is not None:
+            try:
+                self._client.close()
+            except Exception as e:
+                logging.warning(f"Error closing OpenAI client: {e}")
+        self._client = None
+        self._api_key = None
+
+# Global instance
+llm_clients = LLMClientPool()
+
+def get_openai_client() -> Optional[OpenAI]:
+    return llm_clients.get_client()
+
+# -------------------------------------------------
+# Deadlines and retries
+# -------------------------------------------------
+class Deadline:
+    """End-to-end time budget for one user request, passed from the route down to the client"""
+
+    def __init__(self, seconds: float = None):
+        self.seconds = seconds or _env_float('LLM_REQUEST_DEADLINE', 60.0)
+        self.expires_at = time.monotonic() + self.seconds
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+class DeadlineExceeded(Exception):
+    """The request ran out of time before the LLM answered"""
+
+    user_message = "⚠️ That took longer than expected. Please try again in a moment."
+
+    def __init__(self, message: str = "LLM request deadline exceeded", last_error: Exception = None):
+        super().__init__(message)
+        self.last_error = last_error
+
+def is_retryable(error: Exception) -> bool:
+    """429s (except exhausted quota), 5xx, timeouts and dropped connections are worth retrying"""
+    if isinstance(error, RateLimitError):
+        return getattr(error, 'code', None) != 'insufficient_quota'
+    if isinstance(error, (APITimeoutError, APIConnectionError)):
+        return True
+    if isinstance(error, APIStatusError):
+        return error.status_code >= 500 or error.status_code == 409
+    return False
+
+def retry_after_seconds(error: Exception) -> Optional[float]:
+    """Server-requested wait from Retry-After / retry-after-ms, if any"""
+    response = getattr(error, 'response', None)
+    if response is None:
+        return None
+    headers = response.headers
+    try:
+        if headers.get('retry-after-ms'):
+            return float(headers['retry-after-ms']) / 1000
+        value = headers.get('retry-after')
+        if not value:
+            return None
+        try:
+            return float(value)
+        except ValueError:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+def call_with_retries(fn: Callable[[float], Any], deadline: Deadline = None, max_attempts: int = None,
+                      base_delay: float = None, max_delay: float = None) -> Any:
+    """Call fn(timeout) with exponential backoff and full jitter, never past the deadline
+
+    fn receives the seconds left and should pass them to the OpenAI call as its timeout.
+    """
+    deadline = deadline or Deadline()
+    max_attempts = max_attempts or _env_int('LLM_MAX_ATTEMPTS', 3)
+    base_delay = base_delay or _env_float('LLM_RETRY_BASE_DELAY', 0.5)
+    max_delay = max_delay or _env_float('LLM_RETRY_MAX_DELAY', 8.0)
+
+    attempt = 0
+    while True:
+        remaining = deadline.remaining()
+        if remaining <= 0:
+            raise DeadlineExceeded()
+        attempt += 1
+        try:
+            return fn(remaining)
+        except Exception as e:
+            if not is_retryable(e) or attempt >= max_attempts:
+                if isinstance(e, APITimeoutError) and deadline.expired():
+                    raise DeadlineExceeded(last_error=e) from e
+                raise
+
+            delay = random.uniform(0, min(max_delay, base_delay * 2 ** (attempt - 1)))
+            requested = retry_after_seconds(e)
+            if requested is not None:
+                delay = max(delay, requested)
+            if delay >= deadline.remaining():
+                # Waiting would blow the deadline; surface the real error instead
+                raise
+            logging.warning(f"LLM call failed ({type(e).__name__}), retry {attempt}/{max_attempts - 1} in {delay:.2f}s")
+            time.sleep(delay)
+
+def user_error_message(error: Exception) -> str:
+    """User-facing message for a failed LLM call, by exception type"""
+    if isinstance(error, DeadlineExceeded):
+        return error.user_message
+    if isinstance(error, RateLimitError):
+        if getattr(error, 'code', None) == 'insufficient_quota':
+            return "⚠️ OpenAI API quota exceeded. Please check your billing settings at platform.openai.com"
+        return "⚠️ Too many requests. Please wait a moment and try again."
+    if isinstance(error, AuthenticationError):
+        return "⚠️ API key issue. Please check your OpenAI API key configuration."
+    return "⚠️ I'm having trouble connecting right now. Please try again later."
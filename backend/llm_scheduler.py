@@ -0,0 +1,257 @@
+# Tier-Aware Scheduler for Upstream LLM Calls
+#
+# Every OpenAI call waits here for a slot. A global concurrency cap plus request- and
+# token-per-minute buckets keep us under the provider's limits, and weighted-fair queues
+# make sure a burst of free-tier traffic can't starve paying users.
+import os
+import time
+import logging
+import threading
+from collections import deque
+from typing import Dict, Iterator, List, Optional
+
+from token_estimator import get_estimator
+
+SUBSCRIPTION_TIERS = {
+    'free': 'free',
+    'plus': 'premium',
+    'premium': 'premium',
+    'galaxy': 'galaxy'
+}
+
+# gunicorn.conf.py uses the same default, so each worker's share of the limits matches
+# the number of workers actually started
+DEFAULT_WEB_CONCURRENCY = 4
+
+QUEUE_TIMEOUT_MESSAGE = "So many people are chatting right now that I couldn't get to you in time. Please try again in a moment. 💙"
+
+class SchedulerTimeout(Exception):
+    """A request waited longer than its queue deadline"""
+
+    def __init__(self, tier: str, waited: float):
+        super().__init__(f"LLM queue deadline exceeded for {tier} tier after {waited:.1f}s")
+        self.tier = tier
+        self.waited = waited
+        self.user_message = QUEUE_TIMEOUT_MESSAGE
+
+def web_concurrency() -> int:
+    """Number of gunicorn workers sharing the account's limits"""
+    return max(1, int(os.environ.get('WEB_CONCURRENCY', DEFAULT_WEB_CONCURRENCY)))
+
+def subscription_tier(subscription_status: Optional[str]) -> str:
+    """Map a user's subscriptionStatus to a model tier"""
+    return SUBSCRIPTION_TIERS.get(subscription_status or 'free', 'free')
+
+def estimate_request_tokens(messages: List[Dict], max_tokens: int, model: str = 'gpt-4o') -> int:
+    """Prompt + completion size for budgeting, counted locally for the model's tokenizer"""
+    return get_estimator(model).estimate_request(messages, max_tokens)
+
+class _TokenBucket:
+    def __init__(self, per_minute: float):
+        self.capacity = per_minute
+        self.rate = per_minute / 60.0
+        self.level = per_minute
+        self.updated = time.monotonic()
+
+    def refill(self, now: float):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def seconds_until(self, amount: float) -> float:
+        missing = amount - self.level
+        return missing / self.rate if missing > 0 else 0.0
+
+class _Waiter:
+    __slots__ = ('tier', 'tokens', 'finish_tag', 'granted', 'event')
+
+    def __init__(self, tier: str, tokens: int, finish_tag: float):
+        self.tier = tier
+        self.tokens = tokens
+        self.finish_tag = finish_tag
+        self.granted = False
+        self.event = threading.Event()
+
+class LLMSlot:
+    """A granted scheduler slot; release it (or use it as a context manager) when the call ends"""
+
+    def __init__(self, scheduler: 'LLMScheduler', tier: str, tokens: int, waited: float):
+        self.scheduler = scheduler
+        self.tier = tier
+        self.tokens = tokens
+        self.waited = waited
+        self._released = False
+
+    def release(self, tokens_used: int = None):
+        if not self._released:
+            self._released = True
+            self.scheduler._release(self, tokens_used)
+
+    def __del__(self):
+        # Safety net for streamed responses whose generator never ran to completion. GC can run
+        # this on a thread that already holds the scheduler lock, so it must not wait for it.
+        if not self._released:
+            self._released = True
+            logging.warning(f"LLM scheduler slot ({self.tier} tier) was garbage collected without being released")
+            self.scheduler._release_later()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+        return False
+
+class LLMScheduler:
+    """Weighted-fair queueing by tier with concurrency, RPM and TPM limits
+
+    Limits are the account's limits; each gunicorn worker enforces its share of them.
+    """
+
+    def __init__(self, tier_weights: Dict[str, float] = None, max_concurrency: int = None,
+                 requests_per_minute: int = None, tokens_per_minute: int = None,
+                 max_wait: float = None, workers: int = None):
+        workers = workers or web_concurrency()
+        self.tier_weights = tier_weights or {'free': 1.0, 'premium': 4.0, 'galaxy': 8.0}
+        self.max_concurrency = max(1, (max_concurrency or int(os.environ.get('LLM_MAX_CONCURRENCY', '64'))) // workers)
+        rpm = (requests_per_minute or int(os.environ.get('LLM_REQUESTS_PER_MINUTE', '500'))) / workers
+        tpm = (tokens_per_minute or int(os.environ.get('LLM_TOKENS_PER_MINUTE', '300000'))) / workers
+        self.max_wait = max_wait or float(os.environ.get('LLM_QUEUE_MAX_WAIT', '20'))
+
+        self._lock = threading.Lock()
+        self._requests = _TokenBucket(rpm)
+        self._tokens = _TokenBucket(tpm)
+        self._queues: Dict[str, deque] = {}
+        self._last_tag: Dict[str, float] = {}
+        self._virtual_time = 0.0
+        self.in_flight = 0
+        # Slots leaked to the garbage collector, returned at the next dispatch
+        self._leaked = deque()
+
+        self.granted = {}
+        self.timeouts = {}
+        self.total_wait = {}
+
+    def acquire(self, tier: str = 'free', estimated_tokens: int = 1000, max_wait: float = None) -> LLMSlot:
+        """Block until this tier's turn comes and the budgets allow it, or raise SchedulerTimeout"""
+        if tier not in self.tier_weights:
+            tier = 'free'
+        # A single request bigger than the whole bucket would otherwise never run
+        tokens = min(estimated_tokens, self._tokens.capacity)
+        started = time.monotonic()
+        deadline = started + (max_wait if max_wait is not None else self.max_wait)
+
+        with self._lock:
+            # Weighted-fair finish tag: heavier tiers advance their tag more slowly
+            start_tag = max(self._virtual_time, self._last_tag.get(tier, 0.0))
+            waiter = _Waiter(tier, tokens, start_tag + 1.0 / self.tier_weights[tier])
+            self._last_tag[tier] = waiter.finish_tag
+            self._queues.setdefault(tier, deque()).append(waiter)
+            retry_in = self._dispatch()
+
+        while not waiter.granted:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                with self._lock:
+                    if not waiter.granted:
+                        self._queues[tier].remove(waiter)
+                        self.timeouts[tier] = self.timeouts.get(tier, 0) + 1
+                        self._dispatch()
+                        raise SchedulerTimeout(tier, time.monotonic() - started)
+                break
+            # Woken when granted; poll so budget refills are noticed even with nothing in flight
+            waiter.event.wait(min(remaining, retry_in or 0.25))
+            if not waiter.granted:
+                with self._lock:
+                    retry_in = self._dispatch()
+
+        waited = time.monotonic() - started
+        with self._lock:
+            self.total_wait[tier] = self.total_wait.get(tier, 0.0) + waited
+        return LLMSlot(self, tier, tokens, waited)
+
+    def _dispatch(self) -> Optional[float]:
+        """Grant waiting requests in finish-tag order; returns seconds until budgets refill, if blocked"""
+        while self._leaked:
+            self._leaked.popleft()
+            self.in_flight -= 1
+
+        now = time.monotonic()
+        self._requests.refill(now)
+        self._tokens.refill(now)
+
+        while self.in_flight < self.max_concurrency:
+            heads = [queue[0] for queue in self._queues.values() if queue]
+            if not heads:
+                return None
+            waiter = min(heads, key=lambda item: item.finish_tag)
+
+            wait_for = max(self._requests.seconds_until(1), self._tokens.seconds_until(waiter.tokens))
+            if wait_for > 0:
+                return max(wait_for, 0.01)
+
+            self._queues[waiter.tier].popleft()
+            self._requests.level -= 1
+            self._tokens.level -= waiter.tokens
+            self.in_flight += 1
+            self._virtual_time = waiter.finish_tag
+            self.granted[waiter.tier] = self.granted.get(waiter.tier, 0) + 1
+            waiter.granted = True
+            waiter.event.set()
+        return None
+
+    def _release(self, slot: LLMSlot, tokens_used: Optional[int]):
+        with self._lock:
+            self.in_flight -= 1
+            if tokens_used is not None:
+                # Give back (or charge) the difference between the estimate and actual usage
+                self._tokens.level = min(self._tokens.capacity, self._tokens.level + slot.tokens - tokens_used)
+            self._dispatch()
+
+    def _release_later(self):
+        """Release a slot without blocking: now if the lock is free, else at the next dispatch"""
+        self._leaked.append(None)
+        if self._lock.acquire(blocking=False):
+            try:
+                self._dispatch()
+            finally:
+                self._lock.release()
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            self._requests.refill(time.monotonic())
+            self._tokens.refill(time.monotonic())
+            return {
+                'in_flight': self.in_flight,
+                'max_concurrency': self.max_concurrency,
+                'queued': {tier: len(queue) for tier, queue in self._queues.items()},
+                'tier_weights': self.tier_weights,
+                'requests_available': int(self._requests.level),
+                'tokens_available': int(self._tokens.level),
+                'granted': dict(self.granted),
+                'queue_timeouts': dict(self.timeouts),
+                'avg_wait_ms': {tier: round(self.total_wait.get(tier, 0.0) / count * 1000, 1)
+                                for tier, count in self.granted.items() if count},
+                'max_wait_seconds': self.max_wait
+            }
+
+def _tier_weights(tiers: List[str]) -> Dict[str, float]:
+    """Weights for the model tiers, cheapest first; LLM_TIER_WEIGHTS="free:1,premium:4,galaxy:8" overrides"""
+    weights = {tier: 1.0 if index == 0 else 4.0 * 2 ** (index - 1) for index, tier in enumerate(tiers)}
+    for item in os.environ.get('LLM_TIER_WEIGHTS', '').split(','):
+        if ':' in item:
+            tier, weight = item.split(':', 1)
+            try:
+                weights[tier.strip()] = float(weight)
+            except ValueError:
+                pass
+    return weights
+
+def release_when_done(deltas: Iterator[str], slot: LLMSlot) -> Iterator[str]:
+    """Hold a slot for as long as a streamed completion is being read"""
+    try:
+        yield from deltas
+    finally:
+        slot.release()
+
+def create_scheduler(tiers: List[str]) -> LLMScheduler:
+    return LLMScheduler(tier_weights=_tier_weights(tiers))
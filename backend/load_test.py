@@ -0,0 +1,496 @@
+"""
+End-to-end load test for the Flask app
+
+Starts the OpenAI/Stripe/SMTP stubs, synthesizes a soulbridge_data.json of the requested size
+in a scratch directory, launches the app against both, and drives a weighted mix of user and
+admin traffic at increasing concurrency. Reports throughput, p50/p95/p99 latency and error rate
+per route, and exits non-zero when a result regresses against benchmark_data/load_baseline.json.
+
+Admin scenarios log in with LOAD_TEST_ADMIN_EMAIL / LOAD_TEST_ADMIN_PASSWORD and are skipped
+when those are not set.
+
+Usage:
+    python load_test.py                                   # 1k users at concurrency 1, 8, 32
+    python load_test.py --users 1000,10000,100000         # repeat for each dataset size
+    python load_test.py --server gunicorn --duration 60   # run the app under gunicorn.conf.py
+    python load_test.py --target http://127.0.0.1:8080   # load an already running app
+    python load_test.py --update-baseline                 # record the current results as the new baseline
+    python load_test.py --json                            # machine-readable output
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import socket
+import shutil
+import logging
+import argparse
+import tempfile
+import threading
+import subprocess
+import http.client
+from urllib.parse import quote, urlsplit
+from typing import Callable, Dict, List, Optional, Tuple
+
+from stub_servers import StubConfig, StubServers
+from synthetic_data import write_dataset, TOPICS, USER_MESSAGES
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+BENCHMARK_DIR = os.path.join(BACKEND_DIR, 'benchmark_data')
+BASELINE_FILE = os.path.join(BENCHMARK_DIR, 'load_baseline.json')
+
+class Client:
+    """Keep-alive HTTP client holding its own cookies, like one browser tab"""
+
+    def __init__(self, base_url: str, timeout: float = 60):
+        parts = urlsplit(base_url)
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.timeout = timeout
+        self.cookies: Dict[str, str] = {}
+        self.headers: Dict[str, str] = {}
+        self._connection = None
+
+    def request(self, method: str, path: str, payload: Dict = None) -> Tuple[int, bytes]:
+        headers = dict(self.headers)
+        body = None
+        if payload is not None:
+            body = json.dumps(payload).encode('utf-8')
+            headers['Content-Type'] = 'application/json'
+        if self.cookies:
+            headers['Cookie'] = '; '.join(f"{name}={value}" for name, value in self.cookies.items())
+
+        for attempt in range(2):
+            if self._connection is None:
+                self._connection = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+                self._connection.connect()
+                # Small request bodies would otherwise wait on delayed ACKs
+                self._connection.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            try:
+                self._connection.request(method, path, body=body, headers=headers)
+                response = self._connection.getresponse()
+                data = response.read()
+                break
+            except (http.client.HTTPException, OSError):
+                # The server may close an idle keep-alive connection; retry once on a fresh one
+                self.close()
+                if attempt:
+                    raise
+        for header, value in response.getheaders():
+            if header.lower() == 'set-cookie':
+                name, _, rest = value.partition('=')
+                self.cookies[name.strip()] = rest.split(';', 1)[0]
+        if response.getheader('Connection', '').lower() == 'close':
+            self.close()
+        return response.status, data
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+def _json(data: bytes) -> Dict:
+    try:
+        return json.loads(data)
+    except ValueError:
+        return {}
+
+# Scenarios: each makes one request and returns (route, ok)
+
+def chat(client: Client, context: Dict, rng: random.Random) -> Tuple[str, bool]:
+    status, data = client.request('POST', '/send_message', {'message': rng.choice(USER_MESSAGES)})
+    return 'POST /send_message', status == 200 and _json(data).get('success', False)
+
+def chat_stream(client: Client, context: Dict, rng: random.Random) -> Tuple[str, bool]:
+    status, data = client.request('POST', '/send_message', {'message': rng.choice(USER_MESSAGES), 'stream': 'ndjson'})
+    return 'POST /send_message (stream)', status == 200 and b'"done"' in data
+
+def api_chat(client: Client, context: Dict, rng: random.Random) -> Tuple[str, bool]:
+    payload = {'message': rng.choice(USER_MESSAGES), 'character': rng.choice(['Blayzo', 'Blayzica'])}
+    status, data = client.request('POST', '/api/chat', payload)
+    return 'POST /api/chat', status == 200 and _json(data).get('success', False)
+
+def kb_search(client: Client, context: Dict, rng: random.Random) -> Tuple[str, bool]:
+    status, data = client.request('GET', f"/api/knowledge-base/articles/search?query={quote(rng.choice(TOPICS))}")
+    return 'GET /api/knowledge-base/articles/search', status == 200
+
+def kb_view(client: Client, context: Dict, rng: random.Random) -> Tuple[str, bool]:
+    article_id = rng.choice(context['article_ids']) if context['article_ids'] else 'missing'
+    status, data = client.request('POST', f"/api/knowledge-base/articles/{article_id}/view")
+    return 'POST /api/knowledge-base/articles/<id>/view', status == 200
+
+def ticket_create(client: Client, context: Dict, rng: random.Random) -> Tuple[str, bool]:
+    topic = rng.choice(TOPICS)
+    payload = {
+        'userEmail': f"user{rng.randrange(max(1, context['users']))}@example.com",
+        'subject': f"Load test: question about {topic}",
+        'description': f"I need help with my {topic}.",
+        'category': 'general'
+    }
+    status, data = client.request('POST', '/api/support/tickets', payload)
+    return 'POST /api/support/tickets', status in (200, 201)
+
+def admin_tickets(client: Client, context: Dict, rng: random.Random) -> Tuple[str, bool]:
+    status, data = client.request('GET', '/api/support/tickets')
+    return 'GET /api/support/tickets', status == 200
+
+def admin_logs(client: Client, context: Dict, rng: random.Random) -> Tuple[str, bool]:
+    status, data = client.request('GET', '/api/admin/logs')
+    return 'GET /api/admin/logs', status == 200
+
+def analytics(client: Client, context: Dict, rng: random.Random) -> Tuple[str, bool]:
+    view = rng.choice(['dashboard', 'users', 'companions', 'revenue'])
+    status, data = client.request('GET', f"/api/analytics/{view}")
+    return f"GET /api/analytics/{view}", status == 200
+
+# name -> (weight, scenario, needs admin login)
+SCENARIOS: Dict[str, Tuple[int, Callable, bool]] = {
+    'chat': (30, chat, False),
+    'chat_stream': (15, chat_stream, False),
+    'api_chat': (10, api_chat, False),
+    'kb_search': (15, kb_search, False),
+    'kb_view': (10, kb_view, False),
+    'ticket_create': (5, ticket_create, False),
+    'admin_tickets': (5, admin_tickets, True),
+    'admin_logs': (5, admin_logs, True),
+    'analytics': (5, analytics, False)
+}
+
+def admin_login(client: Client) -> bool:
+    """Establish an admin session cookie and a JWT for the admin endpoints"""
+    email = os.environ.get('LOAD_TEST_ADMIN_EMAIL')
+    password = os.environ.get('LOAD_TEST_ADMIN_PASSWORD')
+    if not email or not password:
+        return False
+    credentials = {'email': email, 'password': password}
+    status, _ = client.request('POST', '/api/admin/session-login', credentials)
+    if status != 200:
+        return False
+    status, data = client.request('POST', '/api/admin/login', credentials)
+    token = _json(data).get('token')
+    if status != 200 or not token:
+        return False
+    client.headers['Authorization'] = f"Bearer {token}"
+    return True
+
+def _percentile(sorted_values: List[float], percentile: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(percentile / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+def _summarize(latencies: List[float], errors: int, elapsed: float) -> Dict:
+    values = sorted(latencies)
+    return {
+        'requests': len(values),
+        'throughput_rps': round(len(values) / elapsed, 2) if elapsed else 0.0,
+        'p50_ms': round(_percentile(values, 50), 1),
+        'p95_ms': round(_percentile(values, 95), 1),
+        'p99_ms': round(_percentile(values, 99), 1),
+        'error_rate': round(errors / len(values), 4) if values else 0.0
+    }
+
+def run_level(base_url: str, scenarios: List[str], context: Dict, concurrency: int, duration: float,
+              seed: int) -> Dict:
+    """Run `concurrency` closed-loop workers for `duration` seconds and summarize per route"""
+    weights = [SCENARIOS[name][0] for name in scenarios]
+    samples: Dict[str, List[float]] = {}
+    errors: Dict[str, int] = {}
+    lock = threading.Lock()
+    stop_at = time.monotonic() + duration
+
+    def worker(index: int):
+        rng = random.Random(seed * 1000 + index)
+        client = Client(base_url)
+        if any(SCENARIOS[name][2] for name in scenarios):
+            admin_login(client)
+        local_samples: Dict[str, List[float]] = {}
+        local_errors: Dict[str, int] = {}
+        while time.monotonic() < stop_at:
+            scenario = SCENARIOS[rng.choices(scenarios, weights)[0]][1]
+            started = time.perf_counter()
+            try:
+                route, ok = scenario(client, context, rng)
+            except (http.client.HTTPException, OSError):
+                route, ok = f"{scenario.__name__} (connection)", False
+                client.close()
+            local_samples.setdefault(route, []).append((time.perf_counter() - started) * 1000)
+            if not ok:
+                local_errors[route] = local_errors.get(route, 0) + 1
+        client.close()
+        with lock:
+            for route, values in local_samples.items():
+                samples.setdefault(route, []).extend(values)
+            for route, count in local_errors.items():
+                errors[route] = errors.get(route, 0) + count
+
+    started = time.monotonic()
+    threads = [threading.Thread(target=worker, args=(index,), daemon=True) for index in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - started
+
+    routes = {route: _summarize(values, errors.get(route, 0), elapsed) for route, values in sorted(samples.items())}
+    total = _summarize([value for values in samples.values() for value in values], sum(errors.values()), elapsed)
+    return {'elapsed_s': round(elapsed, 2), 'total': total, 'routes': routes}
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def _wait_ready(base_url: str, process: subprocess.Popen, timeout: float) -> bool:
+    deadline = time.monotonic() + timeout
+    client = Client(base_url, timeout=2)
+    while time.monotonic() < deadline:
+        if process is not None and process.poll() is not None:
+            return False
+        try:
+            if client.request('GET', '/health')[0] == 200:
+                return True
+        except OSError:
+            client.close()
+        time.sleep(0.25)
+    return False
+
+class AppServer:
+    """The app in a subprocess, running from a scratch directory holding its data files"""
+
+    def __init__(self, workdir: str, env: Dict[str, str], server: str = 'flask', workers: int = 1):
+        self.workdir = workdir
+        self.port = _free_port()
+        self.base_url = f"http://127.0.0.1:{self.port}"
+        self.env = {**os.environ, **env, 'PORT': str(self.port), 'WEB_CONCURRENCY': str(workers)}
+        if server == 'gunicorn':
+            self.command = [sys.executable, '-m', 'gunicorn', '-c', os.path.join(BACKEND_DIR, 'gunicorn.conf.py'),
+                            '--pythonpath', BACKEND_DIR, 'app:app']
+        else:
+            self.command = [sys.executable, os.path.join(BACKEND_DIR, 'app.py')]
+        self.log_path = os.path.join(workdir, 'app.log')
+        self.process = None
+
+    def start(self, timeout: float = 300) -> 'AppServer':
+        self._log = open(self.log_path, 'wb')
+        self.process = subprocess.Popen(self.command, cwd=self.workdir, env=self.env,
+                                        stdout=self._log, stderr=subprocess.STDOUT)
+        if not _wait_ready(self.base_url, self.process, timeout):
+            self.stop()
+            with open(self.log_path, 'r', encoding='utf-8', errors='replace') as f:
+                tail = f.read()[-2000:]
+            raise RuntimeError(f"App did not become ready on {self.base_url}:\n{tail}")
+        return self
+
+    def stop(self):
+        if self.process and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+        self._log.close()
+
+def collect_article_ids(base_url: str) -> List[str]:
+    """Published article ids, discovered through search so this also works with --target"""
+    client = Client(base_url)
+    article_ids = set()
+    for topic in TOPICS:
+        status, data = client.request('GET', f"/api/knowledge-base/articles/search?query={quote(topic)}")
+        if status == 200:
+            article_ids.update(article['articleID'] for article in _json(data).get('articles', []))
+    client.close()
+    return sorted(article_ids)
+
+def select_scenarios(names: List[str]) -> List[str]:
+    if not os.environ.get('LOAD_TEST_ADMIN_EMAIL') or not os.environ.get('LOAD_TEST_ADMIN_PASSWORD'):
+        skipped = [name for name in names if SCENARIOS[name][2]]
+        if skipped:
+            logging.warning(f"Skipping {', '.join(skipped)}: LOAD_TEST_ADMIN_EMAIL/LOAD_TEST_ADMIN_PASSWORD not set")
+        names = [name for name in names if not SCENARIOS[name][2]]
+    return names
+
+def run_load_test(user_counts: List[int], levels: List[int], duration: float, scenarios: List[str],
+                  server: str = 'flask', workers: int = 1, target: str = None, chat_mean: float = 8,
+                  llm_latency: str = 'lognormal:300,0.4', token_latency: str = 'fixed:5', seed: int = 42) -> Dict:
+    scenarios = select_scenarios(scenarios)
+    results = {
+        'config': {'duration_s': duration, 'concurrency': levels, 'scenarios': scenarios, 'server': server,
+                   'workers': workers, 'llm_latency': llm_latency, 'token_latency': token_latency,
+                   'chat_mean': chat_mean, 'seed': seed},
+        'runs': {}
+    }
+
+    if target:
+        context = {'users': user_counts[0], 'article_ids': collect_article_ids(target)}
+        run = {'dataset': None, 'levels': {}}
+        for concurrency in levels:
+            run['levels'][str(concurrency)] = run_level(target, scenarios, context, concurrency, duration, seed)
+        results['runs']['target'] = run
+        return results
+
+    stubs = StubServers(StubConfig(latency=llm_latency, token_latency=token_latency, seed=seed),
+                        openai_port=0, stripe_port=0, smtp_port=0).start()
+    # Every load-test session is anonymous and comes from one address, so the default daily
+    # token quotas would end the run early
+    env = {**stubs.env(), 'USAGE_DAILY_TOKENS_FREE': str(10 ** 12),
+           'USAGE_DAILY_TOKENS_PREMIUM': str(10 ** 12), 'USAGE_DAILY_TOKENS_GALAXY': str(10 ** 12),
+           'USAGE_DAILY_TOKENS_ANONYMOUS_IP': str(10 ** 12)}
+    try:
+        for users in user_counts:
+            workdir = tempfile.mkdtemp(prefix=f'soulbridge_load_{users}_')
+            try:
+                counts = write_dataset(os.path.join(workdir, 'soulbridge_data.json'), users=users,
+                                       seed=seed, chat_mean=chat_mean)
+                app = AppServer(workdir, env, server, workers).start()
+                try:
+                    context = {'users': users, 'article_ids': collect_article_ids(app.base_url)}
+                    run = {'dataset': counts, 'levels': {}}
+                    for concurrency in levels:
+                        run['levels'][str(concurrency)] = run_level(app.base_url, scenarios, context,
+                                                                    concurrency, duration, seed)
+                    results['runs'][str(users)] = run
+                finally:
+                    app.stop()
+            finally:
+                shutil.rmtree(workdir, ignore_errors=True)
+    finally:
+        stubs.stop()
+    return results
+
+def find_regressions(results: Dict, baseline: Dict, throughput_tolerance: float,
+                     latency_tolerance: float, error_tolerance: float, min_requests: int = 20) -> List[str]:
+    """Compare every (dataset size, concurrency, route) present in both and describe each regression
+
+    Each level's totals are always compared; a route only when both runs sent it at least
+    min_requests requests, since rare routes get a handful of requests per level.
+    """
+    regressions = []
+    for users, base_run in baseline.get('runs', {}).items():
+        run = results['runs'].get(users)
+        if not run:
+            continue
+        for concurrency, base_level in base_run['levels'].items():
+            level = run['levels'].get(concurrency)
+            if not level:
+                continue
+            routes = [('total', base_level['total'], level['total'])]
+            for route, base in base_level['routes'].items():
+                current = level['routes'].get(route)
+                if base['requests'] < min_requests:
+                    continue
+                if not current:
+                    regressions.append(f"{users} users x{concurrency} {route}: missing from results")
+                elif current['requests'] >= min_requests:
+                    routes.append((route, base, current))
+
+            for route, base, current in routes:
+                label = f"{users} users x{concurrency} {route}"
+                if current['throughput_rps'] < base['throughput_rps'] * (1 - throughput_tolerance):
+                    regressions.append(f"{label} throughput: {current['throughput_rps']} < baseline {base['throughput_rps']} rps")
+                # p95 gates the run; p99 over a short run is too noisy to fail on
+                if current['p95_ms'] > base['p95_ms'] * (1 + latency_tolerance):
+                    regressions.append(f"{label} p95: {current['p95_ms']}ms > baseline {base['p95_ms']}ms")
+                # The total error rate moves with the random route mix; errors are gated per route
+                if route != 'total' and current['error_rate'] > base['error_rate'] + error_tolerance:
+                    regressions.append(f"{label} error rate: {current['error_rate']} > baseline {base['error_rate']}")
+    return regressions
+
+def print_report(results: Dict, regressions: Optional[List[str]]):
+    config = results['config']
+    print("🔍 SoulBridge AI Load Test")
+    print("=" * 100)
+    print(f"Server: {config['server']} ({config['workers']} worker(s)), {config['duration_s']}s per level, "
+          f"LLM stub latency {config['llm_latency']}")
+    print(f"Scenarios: {', '.join(config['scenarios'])}")
+
+    for users, run in results['runs'].items():
+        dataset = run['dataset']
+        if dataset:
+            print(f"\nDataset: {users} users ({dataset['messages']} messages, {dataset['support_tickets']} tickets, "
+                  f"{dataset['knowledge_base']} articles)")
+        else:
+            print("\nTarget: existing server")
+        for concurrency, level in run['levels'].items():
+            total = level['total']
+            print(f"\n  Concurrency {concurrency}: {total['throughput_rps']} rps total, "
+                  f"p95 {total['p95_ms']} ms, errors {total['error_rate']:.1%}")
+            for route, stats in level['routes'].items():
+                print(f"    {route:<48} {stats['throughput_rps']:>8} rps  p50 {stats['p50_ms']:>8}  "
+                      f"p95 {stats['p95_ms']:>8}  p99 {stats['p99_ms']:>8} ms  err {stats['error_rate']:>6.1%}  "
+                      f"(n={stats['requests']})")
+
+    if regressions is None:
+        print("\n⚠️  No baseline found - run with --update-baseline to record one")
+    elif regressions:
+        print("\n❌ Regressions:")
+        for regression in regressions:
+            print(f"  {regression}")
+    else:
+        print("\n✅ No regressions against baseline")
+
+def _int_list(value: str) -> List[int]:
+    return [int(item) for item in value.split(',') if item.strip()]
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Load test the SoulBridge AI app against stub upstreams")
+    parser.add_argument('--users', type=_int_list, default=[1000], help="Dataset sizes, e.g. 1000,10000,100000")
+    parser.add_argument('--concurrency', type=_int_list, default=[1, 8, 32], help="Concurrency levels to step through")
+    parser.add_argument('--duration', type=float, default=30, help="Seconds per concurrency level")
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help="Comma-separated scenario names")
+    parser.add_argument('--server', choices=['flask', 'gunicorn'], default='flask')
+    parser.add_argument('--workers', type=int, default=1, help="Gunicorn worker processes")
+    parser.add_argument('--target', help="Load an already running app instead of starting one")
+    parser.add_argument('--chat-mean', type=float, default=8, help="Average stored chat messages per user")
+    parser.add_argument('--llm-latency', default='lognormal:300,0.4', help="Stub completion latency")
+    parser.add_argument('--token-latency', default='fixed:5', help="Stub delay between streamed tokens")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--update-baseline', action='store_true', help="Store these results as the new baseline")
+    parser.add_argument('--json', action='store_true', help="Print results as JSON")
+    parser.add_argument('--throughput-tolerance', type=float, default=0.3,
+                        help="Allowed relative throughput drop before failing")
+    parser.add_argument('--latency-tolerance', type=float, default=0.5,
+                        help="Allowed relative p95 latency increase before failing")
+    parser.add_argument('--error-tolerance', type=float, default=0.01,
+                        help="Allowed absolute error-rate increase before failing")
+    parser.add_argument('--min-requests', type=int, default=20,
+                        help="Routes with fewer requests per level are only checked through the totals")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    scenarios = [name.strip() for name in args.scenarios.split(',') if name.strip()]
+    unknown = [name for name in scenarios if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(unknown)} (choose from {', '.join(SCENARIOS)})")
+
+    results = run_load_test(args.users, args.concurrency, args.duration, scenarios, args.server, args.workers,
+                            args.target, args.chat_mean, args.llm_latency, args.token_latency, args.seed)
+
+    if args.update_baseline:
+        # Merge so that sizes measured in separate runs accumulate in one baseline
+        baseline = {'config': results['config'], 'runs': {}}
+        if os.path.exists(BASELINE_FILE):
+            with open(BASELINE_FILE, 'r', encoding='utf-8') as f:
+                baseline['runs'] = json.load(f).get('runs', {})
+        baseline['runs'].update(results['runs'])
+        with open(BASELINE_FILE, 'w', encoding='utf-8') as f:
+            json.dump(baseline, f, indent=2)
+
+    regressions = None
+    if os.path.exists(BASELINE_FILE):
+        with open(BASELINE_FILE, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = find_regressions(results, baseline, args.throughput_tolerance,
+                                       args.latency_tolerance, args.error_tolerance, args.min_requests)
+
+    if args.json:
+        print(json.dumps({'results': results, 'regressions': regressions}, indent=2))
+    else:
+        print_report(results, regressions)
+
+    return 1 if regressions else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,192 @@
+# Live Model Health Tracking and Circuit Breakers
+#
+# Every model call reports its latency and outcome here. AIModelManager uses the result to
+# steer traffic away from slow or failing models and to probe them back into service.
+import os
+import time
+import threading
+from collections import deque
+from typing import Dict, List, Optional
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+class ModelHealth:
+    """Rolling health of one model"""
+
+    def __init__(self, model_key: str, sample_size: int = 200):
+        self.model_key = model_key
+        self.state = CLOSED
+        self.ewma_latency = None   # seconds
+        self.error_rate = 0.0      # EWMA of failures (incl. 429s)
+        self.rate_limit_rate = 0.0 # EWMA of 429s only
+        self.requests = 0
+        self.failures = 0
+        self.rate_limited = 0
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.open_count = 0
+        self.probe_started_at = None
+        self.last_observed_at = 0.0
+        self.latencies = deque(maxlen=sample_size)
+
+    def percentile(self, pct: float) -> Optional[float]:
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+class ModelHealthTracker:
+    """EWMA latency / error / 429 tracking with a circuit breaker per model
+
+    closed    -> normal traffic
+    open      -> no traffic until the cooldown has passed
+    half_open -> a single probe request; success closes the breaker, failure re-opens it
+
+    A closed model that is only slow gets no traffic either, so it is probed the same way:
+    one request per cooldown, whose latency replaces the stale average.
+    """
+
+    def __init__(self, alpha: float = None, error_threshold: float = None, rate_limit_threshold: float = None,
+                 latency_threshold: float = None, consecutive_failure_limit: int = None,
+                 cooldown_seconds: float = None, min_requests: int = 5):
+        self.alpha = alpha or float(os.environ.get('MODEL_HEALTH_ALPHA', '0.2'))
+        self.error_threshold = error_threshold or float(os.environ.get('MODEL_ERROR_THRESHOLD', '0.5'))
+        self.rate_limit_threshold = rate_limit_threshold or float(os.environ.get('MODEL_RATE_LIMIT_THRESHOLD', '0.3'))
+        # A model whose EWMA latency is above this is "degraded": used only when nothing healthier is allowed
+        self.latency_threshold = latency_threshold or float(os.environ.get('MODEL_LATENCY_THRESHOLD', '15'))
+        self.consecutive_failure_limit = consecutive_failure_limit or int(os.environ.get('MODEL_CONSECUTIVE_FAILURES', '5'))
+        self.cooldown_seconds = cooldown_seconds or float(os.environ.get('MODEL_BREAKER_COOLDOWN', '30'))
+        self.min_requests = min_requests
+        self._models: Dict[str, ModelHealth] = {}
+        self._lock = threading.Lock()
+
+    def _get(self, model_key: str) -> ModelHealth:
+        health = self._models.get(model_key)
+        if health is None:
+            health = self._models[model_key] = ModelHealth(model_key)
+        return health
+
+    def allow_request(self, model_key: str) -> bool:
+        """May a request go to this model now? Claims the half-open probe slot if so"""
+        now = time.monotonic()
+        with self._lock:
+            health = self._get(model_key)
+            if health.state == CLOSED:
+                return True
+            if health.state == OPEN:
+                if now - health.opened_at < self.cooldown_seconds:
+                    return False
+                health.state = HALF_OPEN
+                health.probe_started_at = now
+                return True
+            # Half-open: one probe at a time; a probe that never reported back is retried
+            if health.probe_started_at is None or now - health.probe_started_at > self.cooldown_seconds:
+                health.probe_started_at = now
+                return True
+            return False
+
+    def allow_probe(self, model_key: str) -> bool:
+        """Is a probe due for this degraded model? Claims the probe slot if so"""
+        with self._lock:
+            health = self._get(model_key)
+            if health.state == CLOSED:
+                return self._claim_latency_probe(health, time.monotonic())
+        return self.allow_request(model_key)
+
+    def _claim_latency_probe(self, health: ModelHealth, now: float) -> bool:
+        if health.ewma_latency is None or health.ewma_latency <= self.latency_threshold:
+            return False
+        if now - health.last_observed_at < self.cooldown_seconds:
+            return False
+        # One probe at a time; a probe that never reported back is retried
+        if self._probe_in_flight(health) and now - health.probe_started_at <= self.cooldown_seconds:
+            return False
+        health.probe_started_at = now
+        return True
+
+    @staticmethod
+    def _probe_in_flight(health: ModelHealth) -> bool:
+        return health.probe_started_at is not None and health.probe_started_at > health.last_observed_at
+
+    def is_degraded(self, model_key: str) -> bool:
+        with self._lock:
+            health = self._get(model_key)
+            return health.state != CLOSED or (
+                health.ewma_latency is not None and health.ewma_latency > self.latency_threshold)
+
+    def record_success(self, model_key: str, latency: float):
+        with self._lock:
+            health = self._get(model_key)
+            latency_probe = health.state == CLOSED and self._probe_in_flight(health)
+            self._observe(health, latency, failed=False, rate_limited=False)
+            health.consecutive_failures = 0
+            if latency_probe:
+                # The old average describes a slowdown that may be long over
+                health.ewma_latency = latency
+            if health.state != CLOSED:
+                health.state = CLOSED
+                health.probe_started_at = None
+                # Start from a clean slate so one old error doesn't trip it again
+                health.error_rate = 0.0
+                health.rate_limit_rate = 0.0
+
+    def record_failure(self, model_key: str, latency: float, rate_limited: bool = False):
+        with self._lock:
+            health = self._get(model_key)
+            self._observe(health, latency, failed=True, rate_limited=rate_limited)
+            health.consecutive_failures += 1
+
+            if health.state == HALF_OPEN:
+                self._open(health)
+            elif health.state == CLOSED and (
+                    health.consecutive_failures >= self.consecutive_failure_limit or
+                    (health.requests >= self.min_requests and (
+                        health.error_rate >= self.error_threshold or
+                        health.rate_limit_rate >= self.rate_limit_threshold))):
+                self._open(health)
+
+    def _observe(self, health: ModelHealth, latency: float, failed: bool, rate_limited: bool):
+        alpha = self.alpha
+        health.requests += 1
+        health.last_observed_at = time.monotonic()
+        health.latencies.append(latency)
+        health.ewma_latency = latency if health.ewma_latency is None else (
+            alpha * latency + (1 - alpha) * health.ewma_latency)
+        health.error_rate = alpha * (1.0 if failed else 0.0) + (1 - alpha) * health.error_rate
+        health.rate_limit_rate = alpha * (1.0 if rate_limited else 0.0) + (1 - alpha) * health.rate_limit_rate
+        if failed:
+            health.failures += 1
+        if rate_limited:
+            health.rate_limited += 1
+
+    def _open(self, health: ModelHealth):
+        health.state = OPEN
+        health.opened_at = time.monotonic()
+        health.probe_started_at = None
+        health.open_count += 1
+
+    def get_latency_percentile(self, model_key: str, pct: float) -> Optional[float]:
+        with self._lock:
+            return self._get(model_key).percentile(pct)
+
+    def get_stats(self, model_keys: List[str] = None) -> Dict:
+        with self._lock:
+            keys = model_keys or list(self._models.keys())
+            stats = {}
+            for key in keys:
+                health = self._get(key)
+                stats[key] = {
+                    'state': health.state,
+                    'requests': health.requests,
+                    'failures': health.failures,
+                    'rate_limited': health.rate_limited,
+                    'error_rate': round(health.error_rate, 4),
+                    'rate_limit_rate': round(health.rate_limit_rate, 4),
+                    'ewma_latency_ms': round(health.ewma_latency * 1000, 1) if health.ewma_latency is not None else None,
+                    'p50_latency_ms': round(health.percentile(50) * 1000, 1) if health.latencies else None,
+                    'p99_latency_ms': round(health.percentile(99) * 1000, 1) if health.latencies else None,
+                    'times_opened': health.open_count
+                }
+            return stats
@@ -4,10 +4,13 @@ Database models for SoulBridge AI user data management
 
 import json
 import os
+import tempfile
 from datetime import datetime
 from typing import Dict, List, Optional, Union
 import uuid
 
+from companion_memory import CompanionMemory
+
 class DatabaseManager:
     def __init__(self, db_file: str = "soulbridge_data.json"):
         self.db_file = db_file
@@ -40,8 +43,29 @@ class DatabaseManager:
         """Save data to JSON file"""
         self.data["metadata"]["lastUpdated"] = datetime.utcnow().isoformat() + "Z"
         
-        with open(self.db_file, 'w', encoding='utf-8') as f:
-            json.dump(self.data, f, indent=2, ensure_ascii=False)
+        # Write a sibling temp file and swap it in, so readers (filter_rescan, backups)
+        # never see a truncated or half-written file
+        directory = os.path.dirname(os.path.abspath(self.db_file))
+        fd, temp_path = tempfile.mkstemp(prefix=".soulbridge_", suffix=".json.tmp", dir=directory)
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                self._dump(f)
+            if os.path.exists(self.db_file):
+                os.chmod(temp_path, os.stat(self.db_file).st_mode & 0o777)
+            else:
+                os.chmod(temp_path, 0o644)
+            os.replace(temp_path, self.db_file)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+    
+    def _dump(self, f):
+        json.dump(self.data, f, indent=2, ensure_ascii=False)
+    
+    def save_data(self):
+        """Public save used by app routes that write session and admin logs"""
+        self._save_data()
 
 class User:
     def __init__(self, db_manager: DatabaseManager):
@@ -152,9 +176,11 @@ class User:
 class ChatHistory:
     def __init__(self, db_manager: DatabaseManager):
         self.db = db_manager
+        # Long-term memory index over each user's history, built on first retrieval
+        self.memory = CompanionMemory(loader=lambda user_id: self.get_chat_history(user_id, limit=0))
     
-    def add_message(self, user_id: str, user_message: str, ai_response: str) -> Dict:
-        """Add a new chat message"""
+    def add_message(self, user_id: str, user_message: str, ai_response: str, save: bool = True) -> Dict:
+        """Add a new chat message; save=False leaves persisting to the caller's next save"""
         message_id = f"msg{uuid.uuid4().hex[:8]}"
         timestamp = datetime.utcnow().isoformat() + "Z"
         
@@ -169,7 +195,9 @@ class ChatHistory:
         for user in self.db.data["users"]:
             if user["userID"] == user_id:
                 user["chatHistory"].append(new_message)
-                self.db._save_data()
+                if save:
+                    self.db._save_data()
+                self.memory.add(user_id, new_message)
                 return new_message
         
         raise ValueError("User not found")
@@ -195,6 +223,7 @@ class ChatHistory:
             if user["userID"] == user_id:
                 user["chatHistory"] = []
                 self.db._save_data()
+                self.memory.clear(user_id)
                 return True
         return False
     
@@ -206,6 +235,7 @@ class ChatHistory:
                     if message["messageID"] == message_id:
                         del user["chatHistory"][i]
                         self.db._save_data()
+                        self.memory.remove(user_id, message_id)
                         return True
         return False
 
@@ -657,8 +687,9 @@ class DiagnosticTools:
 class SoulBridgeDB:
     """Main database interface for SoulBridge AI"""
     
-    def __init__(self, db_file: str = "soulbridge_data.json"):
-        self.db_manager = DatabaseManager(db_file)
+    def __init__(self, db_file: str = "soulbridge_data.json", db_manager: DatabaseManager = None):
+        # An alternative storage backend can be passed in as a DatabaseManager subclass
+        self.db_manager = db_manager or DatabaseManager(db_file)
         self.users = User(self.db_manager)
         self.chat_history = ChatHistory(self.db_manager)
         self.settings = UserSettings(self.db_manager)
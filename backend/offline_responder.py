@@ -0,0 +1,133 @@
+# Offline Degraded-Mode Responder
+#
+# When no OpenAI client is configured or the upstream is down, chat is answered from a
+# local per-companion corpus (curated replies plus published knowledge-base articles)
+# using BM25 lexical retrieval. Replies cost nothing, take well under a millisecond,
+# still go through the content filter and are flagged as degraded.
+import os
+import json
+import time
+import logging
+import threading
+from typing import Callable, Dict, List
+
+from ai_content_filter import content_filter
+from companion_memory import BM25Index
+
+DEGRADED_NOTICE = "(Offline mode: my replies are simpler than usual until I'm fully reconnected.)"
+
+class OfflineResponder:
+    """Lexical retrieval over curated replies and knowledge-base articles"""
+
+    def __init__(self, corpus_path: str = None, kb_loader: Callable[[], List[Dict]] = None,
+                 min_score: float = None, kb_min_score: float = None, kb_refresh_seconds: float = 300):
+        self.corpus_path = corpus_path or os.environ.get(
+            'OFFLINE_CORPUS', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'offline_corpus.json')
+        )
+        self.kb_loader = kb_loader
+        self.min_score = min_score or float(os.environ.get('OFFLINE_MIN_SCORE', '1.0'))
+        self.kb_min_score = kb_min_score or float(os.environ.get('OFFLINE_KB_MIN_SCORE', '2.0'))
+        self.kb_refresh_seconds = kb_refresh_seconds
+        self.enabled = os.environ.get('OFFLINE_MODE_ENABLED', 'true').lower() not in ('0', 'false', 'no')
+
+        self._lock = threading.Lock()
+        self._kb_index = BM25Index()
+        self._kb_signature = None
+        self._kb_checked = 0.0
+        self.served = {}
+        self._load_corpus()
+
+    def _load_corpus(self):
+        """Index every example prompt of every curated entry"""
+        self.entries: Dict[str, Dict] = {}
+        self.fallback: Dict[str, str] = {'default': "I'm having trouble connecting right now, but I'm still here with you. 💙"}
+        self._index = BM25Index()
+        try:
+            with open(self.corpus_path, 'r', encoding='utf-8') as f:
+                corpus = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            logging.error(f"Offline corpus unavailable ({self.corpus_path}): {e}")
+            return
+
+        self.fallback.update(corpus.get('fallback', {}))
+        for entry in corpus.get('entries', []):
+            self.entries[entry['id']] = entry
+            for index, prompt in enumerate(entry.get('prompts', [])):
+                self._index.add(f"{entry['id']}:{index}", prompt, entry['id'])
+
+    def set_kb_loader(self, kb_loader: Callable[[], List[Dict]]):
+        with self._lock:
+            self.kb_loader = kb_loader
+            self._kb_signature = None
+            self._kb_checked = 0.0
+
+    def _refresh_kb(self):
+        """Rebuild the article index when the published articles have changed"""
+        now = time.monotonic()
+        if not self.kb_loader or now - self._kb_checked < self.kb_refresh_seconds:
+            return
+        self._kb_checked = now
+        try:
+            articles = [article for article in self.kb_loader() if article.get('status') == 'published']
+        except Exception as e:
+            logging.warning(f"Offline responder could not load knowledge base: {e}")
+            return
+        signature = (len(articles), max((article.get('updatedAt', '') for article in articles), default=''))
+        if signature == self._kb_signature:
+            return
+        index = BM25Index()
+        for article in articles:
+            text = ' '.join([article.get('title', '')] * 2 + article.get('tags', []) + [article.get('content', '')])
+            index.add(article['articleID'], text, article)
+        self._kb_index = index
+        self._kb_signature = signature
+
+    def respond(self, user_message: str, companion_name: str = 'Blayzo', user_id: str = None) -> Dict:
+        """Degraded reply in the same shape as AIModelManager responses"""
+        is_safe, refusal_message = content_filter.check_content(user_message, companion_name, user_id)
+        if not is_safe:
+            return self._reply(refusal_message, 'content_filter', notice=False)
+
+        hits = self._index.search(user_message, 1)
+        if hits and hits[0][0] >= self.min_score:
+            entry = self.entries[self._index.documents[hits[0][1]]]
+            replies = entry.get('replies', {})
+            return self._reply(replies.get(companion_name) or replies.get('default', ''), f"corpus:{entry['id']}")
+
+        with self._lock:
+            self._refresh_kb()
+            kb_index = self._kb_index
+        hits = kb_index.search(user_message, 1)
+        if hits and hits[0][0] >= self.kb_min_score:
+            article = kb_index.documents[hits[0][1]]
+            content = ' '.join(article.get('content', '').split())
+            if len(content) > 400:
+                content = content[:400].rsplit(' ', 1)[0] + '…'
+            return self._reply(f"This might help — \"{article.get('title', '')}\": {content}", f"kb:{article['articleID']}")
+
+        return self._reply(self.fallback.get(companion_name) or self.fallback['default'], 'fallback', notice=False)
+
+    def _reply(self, text: str, source: str, notice: bool = True) -> Dict:
+        with self._lock:
+            self.served[source.split(':')[0]] = self.served.get(source.split(':')[0], 0) + 1
+        return {
+            'success': True,
+            'response': f"{text}\n\n{DEGRADED_NOTICE}" if notice else text,
+            'degraded': True,
+            'model_used': 'offline',
+            'source': source,
+            'tokens_used': 0,
+            'cost': 0
+        }
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'corpus_entries': len(self.entries),
+                'kb_articles_indexed': len(self._kb_index.documents),
+                'served': dict(self.served)
+            }
+
+# Global instance
+offline_responder = OfflineResponder()
@@ -0,0 +1,115 @@
+# Precompiled Prompt Prefixes
+#
+# The system part of every prompt (companion persona + optional response style) is built
+# once per companion/style into an immutable prefix with its serialized bytes and token
+# counts. Each turn only appends its own messages, and the prefix bytes are identical from
+# request to request so the provider's prompt cache keeps hitting.
+import json
+import hashlib
+import threading
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from token_estimator import MESSAGE_OVERHEAD_TOKENS, REPLY_PRIMING_TOKENS, get_estimator, model_family
+
+# Response styles referral companions can switch to (see /api/set-response-style)
+RESPONSE_STYLES = {
+    'mystical': 'Mysterious and enigmatic responses with deeper insights',
+    'celestial': 'Ethereal and wise responses with cosmic perspective',
+    'energetic': 'Enthusiastic and grateful responses with referral power',
+    'philosophical': 'Deep and thoughtful responses exploring life\'s mysteries',
+    'poetic': 'Artistic and metaphorical responses with beautiful language',
+    'analytical': 'Logical and detailed responses with thorough explanations'
+}
+
+@dataclass(frozen=True)
+class PromptPrefix:
+    """Immutable system prefix; treat the message dicts as read-only"""
+    companion: str
+    style: Optional[str]
+    messages: Tuple[Dict, ...]
+    serialized: bytes
+    digest: str
+    token_counts: Dict[str, int] = field(default_factory=dict, compare=False)
+
+    @property
+    def system_prompt(self) -> str:
+        return self.messages[0]['content']
+
+    def tokens(self, model: str = 'gpt-4o') -> int:
+        """Prefix size for the model's tokenizer, including per-message overhead"""
+        count = self.token_counts.get(model_family(model))
+        if count is None:
+            estimator = get_estimator(model)
+            count = sum(estimator.count_static(message['content']) + MESSAGE_OVERHEAD_TOKENS
+                        for message in self.messages)
+            self.token_counts[model_family(model)] = count
+        return count
+
+    def messages_with(self, *turns: Dict) -> List[Dict]:
+        """The full message list: the shared prefix followed by this request's turns"""
+        return [*self.messages, *turns]
+
+    def prompt_tokens(self, model: str, turns: Iterable[Dict]) -> int:
+        estimator = get_estimator(model)
+        return self.tokens(model) + sum(estimator.count_message(turn) for turn in turns) + REPLY_PRIMING_TOKENS
+
+def _style_instruction(style: str) -> str:
+    return f"Response style: {style}. {RESPONSE_STYLES[style]}."
+
+class PromptBuilder:
+    """Builds and caches prompt prefixes per companion and response style
+
+    Tiers only change which model answers, so they share prefix bytes; token counts are
+    kept per tokenizer family on the prefix.
+    """
+
+    def __init__(self, prompts: Dict[str, str], default_companion: str, styles: Dict[str, str] = None):
+        self.prompts = prompts
+        self.default_companion = default_companion
+        self.styles = styles if styles is not None else RESPONSE_STYLES
+        self._prefixes: Dict[Tuple[str, Optional[str]], PromptPrefix] = {}
+        self._lock = threading.Lock()
+
+    def prefix(self, companion: str, style: Optional[str] = None) -> PromptPrefix:
+        if companion not in self.prompts:
+            companion = self.default_companion
+        if style not in self.styles:
+            style = None
+        key = (companion, style)
+        prefix = self._prefixes.get(key)
+        if prefix is None:
+            with self._lock:
+                prefix = self._prefixes.get(key)
+                if prefix is None:
+                    prefix = self._prefixes[key] = self._compile(companion, style)
+        return prefix
+
+    def _compile(self, companion: str, style: Optional[str]) -> PromptPrefix:
+        # Persona first and style after it, so every style of a companion shares the longest cached prefix
+        messages = [{"role": "system", "content": self.prompts[companion]}]
+        if style:
+            messages.append({"role": "system", "content": _style_instruction(style)})
+        serialized = json.dumps(messages, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        return PromptPrefix(
+            companion=companion,
+            style=style,
+            messages=tuple(messages),
+            serialized=serialized,
+            digest=hashlib.blake2b(serialized, digest_size=16).hexdigest()
+        )
+
+    def precompile(self, models: Iterable[str] = ('gpt-4o',)):
+        """Build every companion/style prefix and count its tokens up front"""
+        models = list(models)
+        for companion in self.prompts:
+            for style in [None] + list(self.styles):
+                prefix = self.prefix(companion, style)
+                for model in models:
+                    prefix.tokens(model)
+
+    def get_stats(self) -> Dict:
+        return {
+            'prefixes': len(self._prefixes),
+            'prefix_bytes': sum(len(prefix.serialized) for prefix in self._prefixes.values())
+        }
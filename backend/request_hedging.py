@@ -0,0 +1,183 @@
+# Hedged Requests for Tail Latency
+#
+# If the first token of a premium completion hasn't arrived within a high percentile of
+# recent time-to-first-token, a second request is fired and whichever answers first wins.
+import os
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Callable, Dict, Optional, Tuple
+
+class RequestHedger:
+    """Fires budget-capped backup requests and tracks how often they win
+
+    call(model_key, first_token, cancel) must set first_token when output starts and stop
+    early (returning {'success': False, 'cancelled': True}, with the tokens used so far)
+    once cancel is set.
+
+    A hedge is an extra upstream call, so it must also get past acquire_slot(model_key)
+    (e.g. the LLM scheduler; None means no capacity). The slot is held until the losing
+    attempt has stopped and is released with that attempt's tokens, which are also handed
+    to on_extra(model_key, response_data) for billing.
+    """
+
+    def __init__(self, percentile: float = None, min_delay: float = None, default_delay: float = None,
+                 budget_ratio: float = None, budget_burst: float = None, max_workers: int = None,
+                 min_samples: int = 20):
+        self.percentile = percentile or float(os.environ.get('HEDGE_PERCENTILE', '90'))
+        self.min_delay = min_delay or float(os.environ.get('HEDGE_MIN_DELAY', '1.0'))
+        # Used until a model has enough first-token samples for a percentile
+        self.default_delay = default_delay or float(os.environ.get('HEDGE_DEFAULT_DELAY', '6.0'))
+        # Each eligible request earns budget_ratio hedges (capped at budget_burst), so hedges
+        # stay at most ~budget_ratio of premium traffic even during an incident
+        self.budget_ratio = budget_ratio or float(os.environ.get('HEDGE_BUDGET_RATIO', '0.1'))
+        self.budget_burst = budget_burst or float(os.environ.get('HEDGE_BUDGET_BURST', '5'))
+        self.min_samples = min_samples
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers or int(os.environ.get('HEDGE_MAX_WORKERS', '64')),
+            thread_name_prefix='hedge'
+        )
+
+        self._lock = threading.Lock()
+        self._budget = self.budget_burst
+        self._first_token_samples: Dict[str, deque] = {}
+        self.eligible = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.budget_denied = 0
+        self.slot_denied = 0
+        self.hedge_tokens = 0
+
+    def hedge_delay(self, model_key: str) -> float:
+        """Seconds to wait for a first token before hedging"""
+        with self._lock:
+            samples = self._first_token_samples.get(model_key)
+            if not samples or len(samples) < self.min_samples:
+                return self.default_delay
+            ordered = sorted(samples)
+        index = min(len(ordered) - 1, int(len(ordered) * self.percentile / 100))
+        return max(self.min_delay, ordered[index])
+
+    def _record_result(self, model_key: str, response_data: Dict):
+        first_token_latency = response_data.get('first_token_latency')
+        if first_token_latency is None and response_data.get('cancelled'):
+            # Cancelled before its first token: it took at least this long. Leaving these
+            # out would keep only the fast attempts and bias the hedge delay low.
+            first_token_latency = response_data.get('latency')
+        if first_token_latency is None:
+            return
+        with self._lock:
+            samples = self._first_token_samples.get(model_key)
+            if samples is None:
+                samples = self._first_token_samples[model_key] = deque(maxlen=500)
+            samples.append(first_token_latency)
+
+    def _take_budget(self) -> bool:
+        with self._lock:
+            if self._budget >= 1:
+                self._budget -= 1
+                return True
+            self.budget_denied += 1
+            return False
+
+    def run(self, call: Callable[[str, threading.Event, threading.Event], Dict], primary_key: str,
+            pick_hedge_key: Callable[[], Optional[str]], acquire_slot: Callable[[str], Optional[object]] = None,
+            on_extra: Callable[[str, Dict], None] = None) -> Tuple[Dict, str]:
+        """Run call for primary_key, hedging if it is slow to start; returns (response_data, model_key)"""
+        with self._lock:
+            self.eligible += 1
+            self._budget = min(self.budget_burst, self._budget + self.budget_ratio)
+
+        primary_first_token, primary_cancel = threading.Event(), threading.Event()
+        primary = self._executor.submit(call, primary_key, primary_first_token, primary_cancel)
+
+        primary_first_token.wait(self.hedge_delay(primary_key))
+        if primary_first_token.is_set() or primary.done():
+            return self._finish(primary.result(), primary_key)
+
+        hedge_key = pick_hedge_key()
+        if not hedge_key:
+            return self._finish(primary.result(), primary_key)
+        # Capacity first: budget spent on a hedge that can't be sent would starve later ones
+        slot = acquire_slot(hedge_key) if acquire_slot else None
+        if acquire_slot and slot is None:
+            with self._lock:
+                self.slot_denied += 1
+            return self._finish(primary.result(), primary_key)
+        if not self._take_budget():
+            if slot is not None:
+                slot.release(0)
+            return self._finish(primary.result(), primary_key)
+
+        logging.info(f"Hedging {primary_key} with {hedge_key}: no first token yet")
+        hedge_cancel = threading.Event()
+        hedge = self._executor.submit(call, hedge_key, threading.Event(), hedge_cancel)
+        with self._lock:
+            self.hedged += 1
+
+        attempts = {primary: (primary_key, primary_cancel), hedge: (hedge_key, hedge_cancel)}
+        pending = set(attempts)
+        winner = None
+        while pending and winner is None:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if winner is None and future.result().get('success'):
+                    winner = future
+
+        # Cancel the loser; it stops at its next chunk
+        for future, (_, cancel) in attempts.items():
+            if future is not winner:
+                cancel.set()
+
+        # Whatever the other attempt consumed before stopping is the price of the hedge
+        extra = hedge if winner is None or winner is primary else primary
+        extra.add_done_callback(lambda future: self._settle_extra(future, attempts[future][0], slot, on_extra))
+
+        if winner is None:
+            return self._finish(primary.result(), primary_key)
+
+        model_key = attempts[winner][0]
+        if winner is hedge:
+            with self._lock:
+                self.hedge_wins += 1
+        return self._finish(winner.result(), model_key)
+
+    def _settle_extra(self, future, model_key: str, slot, on_extra: Optional[Callable[[str, Dict], None]]):
+        try:
+            response_data = future.result()
+        except Exception:
+            response_data = {}
+        tokens = response_data.get('tokens_used', 0)
+        try:
+            self._record_result(model_key, response_data)
+            with self._lock:
+                self.hedge_tokens += tokens
+            if on_extra:
+                on_extra(model_key, response_data)
+        except Exception as e:
+            logging.warning(f"Hedge accounting failed: {e}")
+        finally:
+            if slot is not None:
+                slot.release(tokens)
+
+    def _finish(self, response_data: Dict, model_key: str) -> Tuple[Dict, str]:
+        self._record_result(model_key, response_data)
+        return response_data, model_key
+
+    def get_stats(self) -> Dict:
+        delays = {key: round(self.hedge_delay(key), 3) for key in list(self._first_token_samples)}
+        with self._lock:
+            return {
+                'eligible_requests': self.eligible,
+                'hedged': self.hedged,
+                'hedge_rate': round(self.hedged / self.eligible, 4) if self.eligible else 0.0,
+                'hedge_wins': self.hedge_wins,
+                'hedge_win_rate': round(self.hedge_wins / self.hedged, 4) if self.hedged else 0.0,
+                'budget_denied': self.budget_denied,
+                'slot_denied': self.slot_denied,
+                'budget_available': round(self._budget, 2),
+                'extra_tokens_spent': self.hedge_tokens,
+                'percentile': self.percentile,
+                'hedge_delays': delays
+            }
@@ -0,0 +1,106 @@
+# Response Cache for Stateless Chat Turns
+#
+# /api/chat replies depend only on the character prompt, the model, the user message and the
+# generation parameters, so common openers ("hi", "how are you?") can be answered from memory.
+import os
+import time
+import random
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+class ResponseCache:
+    """TTL + LRU cache of chat replies holding up to K variants per prompt
+
+    With variants > 1 a prompt keeps being sent to the model, with decreasing probability,
+    until K different replies are stored; after that one of them is picked at random.
+    """
+
+    def __init__(self, max_size: int = None, ttl_seconds: float = None, variants: int = None,
+                 max_message_chars: int = None):
+        self.max_size = max_size or int(os.environ.get('RESPONSE_CACHE_SIZE', '5000'))
+        self.ttl_seconds = ttl_seconds or float(os.environ.get('RESPONSE_CACHE_TTL', '3600'))
+        self.variants = max(1, variants or int(os.environ.get('RESPONSE_CACHE_VARIANTS', '3')))
+        # Long messages practically never repeat; don't spend memory on them
+        self.max_message_chars = max_message_chars or int(os.environ.get('RESPONSE_CACHE_MAX_MESSAGE_CHARS', '200'))
+        self.enabled = os.environ.get('RESPONSE_CACHE_ENABLED', 'true').lower() not in ('0', 'false', 'no')
+
+        self._entries = OrderedDict()  # key -> ([replies], expires_at)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.skipped = 0
+        self.tokens_saved = 0
+
+    @staticmethod
+    def normalize(message: str) -> str:
+        """Case, whitespace and trailing punctuation don't change the reply"""
+        return ' '.join(message.lower().split()).rstrip('.!?~ ')
+
+    def make_key(self, character: str, model: str, message: str, system_prompt: str = '', **params) -> Optional[Tuple]:
+        """Cache key, or None when this message shouldn't be cached"""
+        if not self.enabled or len(message) > self.max_message_chars:
+            self.skipped += 1
+            return None
+        digest = hashlib.blake2b(digest_size=16)
+        # The prompt text is part of the key so editing a character invalidates its replies
+        for part in (system_prompt, self.normalize(message)):
+            digest.update(part.encode('utf-8'))
+            digest.update(b'\0')
+        return character, model, tuple(sorted(params.items())), digest.digest()
+
+    def get(self, key) -> Optional[str]:
+        if key is None:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                replies, expires_at, tokens = entry
+                if expires_at <= time.monotonic():
+                    del self._entries[key]
+                elif len(replies) >= self.variants or random.random() < len(replies) / self.variants:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    self.tokens_saved += tokens
+                    return random.choice(replies)
+            self.misses += 1
+            return None
+
+    def put(self, key, reply: str, tokens_used: int = 0):
+        if key is None or not reply:
+            return
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] > time.monotonic():
+                replies, expires_at, tokens = entry
+                if reply not in replies and len(replies) < self.variants:
+                    replies.append(reply)
+                tokens = tokens or tokens_used
+            else:
+                replies, expires_at, tokens = [reply], time.monotonic() + self.ttl_seconds, tokens_used
+            self._entries[key] = (replies, expires_at, tokens)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'enabled': self.enabled,
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'ttl_seconds': self.ttl_seconds,
+                'variants': self.variants,
+                'stored_replies': sum(len(entry[0]) for entry in self._entries.values()),
+                'hits': self.hits,
+                'misses': self.misses,
+                'skipped': self.skipped,
+                'hit_rate': round(self.hits / total, 4) if total else 0.0,
+                'tokens_saved': self.tokens_saved
+            }
@@ -0,0 +1,96 @@
+# In-Flight Request Coalescing
+#
+# Double-clicks, client retries and reconnects often send the same prompt several times
+# within a second. Concurrent calls with the same key share one upstream request.
+import os
+import json
+import hashlib
+import logging
+import threading
+from typing import Any, Callable, Dict, Tuple
+
+from llm_client import Deadline, DeadlineExceeded
+
+def prompt_key(**request_params) -> str:
+    """Stable key for a fully assembled LLM request (model, messages, generation params)"""
+    payload = json.dumps(request_params, sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+    return hashlib.blake2b(payload.encode('utf-8'), digest_size=16).hexdigest()
+
+class _Call:
+    __slots__ = ('done', 'result', 'error', 'waiters')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+class SingleFlight:
+    """Thread-safe single-flight group
+
+    The first caller for a key runs the function; callers arriving while it is in flight
+    wait (at most max_wait seconds, and never past their own deadline) and receive the same
+    result or exception. A follower that times out with time left makes its own call rather
+    than waiting indefinitely; one whose deadline has run out raises DeadlineExceeded.
+    """
+
+    def __init__(self, max_wait: float = None):
+        self.max_wait = max_wait or float(os.environ.get('SINGLE_FLIGHT_MAX_WAIT', '60'))
+        self._calls: Dict[str, _Call] = {}
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.coalesced = 0
+        self.timeouts = 0
+
+    def do(self, key: str, fn: Callable[[], Any], deadline: Deadline = None) -> Tuple[Any, bool]:
+        """Return (result, shared); shared is True when another caller made the request"""
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None:
+                call = _Call()
+                self._calls[key] = call
+                self.leaders += 1
+                leader = True
+            else:
+                call.waiters += 1
+                leader = False
+
+        if leader:
+            try:
+                call.result = fn()
+            except Exception as e:
+                call.error = e
+                raise
+            finally:
+                with self._lock:
+                    self._calls.pop(key, None)
+                call.done.set()
+            return call.result, False
+
+        max_wait = min(self.max_wait, deadline.remaining()) if deadline else self.max_wait
+        if not call.done.wait(max_wait):
+            with self._lock:
+                self.timeouts += 1
+            if deadline and deadline.expired():
+                raise DeadlineExceeded("Deadline exceeded waiting for an identical in-flight request")
+            logging.warning(f"Single-flight wait exceeded {max_wait:.1f}s; making a separate call")
+            return fn(), False
+
+        with self._lock:
+            self.coalesced += 1
+        if call.error is not None:
+            raise call.error
+        return call.result, True
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            return {
+                'in_flight': len(self._calls),
+                'leaders': self.leaders,
+                'coalesced': self.coalesced,
+                'timeouts': self.timeouts,
+                'max_wait_seconds': self.max_wait
+            }
+
+# Global instance
+llm_single_flight = SingleFlight()
@@ -57,6 +57,26 @@ document.addEventListener("DOMContentLoaded", () => {
     } catch {}
   };
 
+  // Read a Server-Sent Events stream from a fetch response, one event at a time
+  async function readEvents(res, onEvent) {
+    const reader = res.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = "";
+    for (;;) {
+      const { value, done } = await reader.read();
+      if (done) break;
+      buffer += decoder.decode(value, { stream: true });
+      let split;
+      while ((split = buffer.indexOf("\n\n")) !== -1) {
+        const raw = buffer.slice(0, split);
+        buffer = buffer.slice(split + 2);
+        const event = (raw.match(/^event: (.*)$/m) || [])[1] || "message";
+        const data = (raw.match(/^data: (.*)$/m) || [])[1];
+        if (data) onEvent(event, JSON.parse(data));
+      }
+    }
+  }
+
   // Main send
   async function send(msg) {
     if (!msg.trim()) return;
@@ -64,17 +84,49 @@ document.addEventListener("DOMContentLoaded", () => {
     input.value = "";
     showTyping();
 
+    // Lets the server recognise a resend of this exact message
+    const requestId = window.crypto && crypto.randomUUID
+      ? crypto.randomUUID()
+      : `${Date.now()}-${Math.random().toString(36).slice(2)}`;
+
     try {
       const res = await fetch("/send_message", {
         method: "POST",
         headers: { "Content-Type": "application/json" },
-        body: JSON.stringify({ message: msg }),
+        body: JSON.stringify({ message: msg, stream: "sse", request_id: requestId }),
+      });
+
+      if (!res.ok || !res.body || !(res.headers.get("Content-Type") || "").startsWith("text/event-stream")) {
+        const data = await res.json();
+        hideTyping();
+        const reply = data.success ? data.response : `⚠️ ${data.error}`;
+        bubble("ai", nl2br(reply));
+        speak(reply);
+        return;
+      }
+
+      // Show the reply as it is generated
+      let text = "";
+      let replyText = null;
+      await readEvents(res, (event, data) => {
+        if (event === "delta") {
+          if (!replyText) {
+            hideTyping();
+            bubble("ai", '<span class="stream-text"></span>');
+            replyText = chatBox.lastElementChild.querySelector(".stream-text");
+          }
+          text += data.delta;
+          replyText.innerHTML = nl2br(text);
+          scroll();
+        } else if (event === "done") {
+          hideTyping();
+          if (!replyText) bubble("ai", nl2br(data.response));
+          speak(data.response);
+        } else if (event === "error") {
+          hideTyping();
+          bubble("ai", data.error);
+        }
       });
-      const data = await res.json();
-      hideTyping();
-      const reply = data.success ? data.response : `⚠️ ${data.error}`;
-      bubble("ai", nl2br(reply));
-      speak(reply);
     } catch (err) {
       hideTyping();
       bubble("ai", "⚠️ Network error, please try again.");
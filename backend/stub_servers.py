@@ -0,0 +1,560 @@
+"""
+Local stand-ins for OpenAI, Stripe and SMTP
+
+Speak enough of each wire format for the app's hot paths (chat completions with and without
+streaming, checkout sessions and signed webhooks, SMTP submission) so load and failure tests
+run without live services. Latency distributions, 5xx/429 injection and request recording
+are configurable, and random choices are seeded so runs are repeatable.
+
+Point the app at the stubs with:
+    OPENAI_BASE_URL=http://127.0.0.1:8601/v1 OPENAI_API_KEY=sk-stub
+    STRIPE_API_BASE=http://127.0.0.1:8602 STRIPE_SECRET_KEY=sk_test_stub
+    SMTP_SERVER=127.0.0.1 SMTP_PORT=8625 SMTP_STARTTLS=false SMTP_USERNAME=stub SMTP_PASSWORD=stub
+
+Usage:
+    python stub_servers.py [--latency lognormal:400,0.5] [--token-latency fixed:15]
+                           [--error-rate 0.01] [--rate-limit-rate 0.02] [--record stub_requests.jsonl]
+
+Each HTTP stub also serves GET /__stub/requests, POST /__stub/config and POST /__stub/reset.
+"""
+
+import os
+import sys
+import hmac
+import json
+import time
+import uuid
+import random
+import hashlib
+import logging
+import argparse
+import threading
+import socketserver
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+from urllib.parse import parse_qsl, urlparse
+
+from token_estimator import get_estimator
+
+REPLY_WORDS = ("I hear you and I'm here with you. It sounds like today has asked a lot of you, "
+               "so let's take it one gentle step at a time. What feels most important right now?").split()
+
+class LatencyProfile:
+    """Latency distribution parsed from a spec (all values in milliseconds)
+
+    fixed:200 | uniform:100-500 | normal:300,50 | lognormal:300,0.5 (median, sigma) | exp:200 (mean)
+    """
+
+    def __init__(self, spec: str = 'fixed:0'):
+        self.spec = spec
+        kind, _, args = spec.partition(':')
+        self.kind = kind.strip().lower()
+        values = [float(value) for value in args.replace('-', ',').split(',') if value.strip()] or [0.0]
+        if self.kind not in ('fixed', 'uniform', 'normal', 'lognormal', 'exp'):
+            raise ValueError(f"Unknown latency distribution: {spec}")
+        self.values = values
+
+    def sample(self, rng: random.Random) -> float:
+        """Seconds to wait"""
+        values = self.values
+        if self.kind == 'fixed':
+            ms = values[0]
+        elif self.kind == 'uniform':
+            ms = rng.uniform(values[0], values[-1])
+        elif self.kind == 'normal':
+            ms = rng.gauss(values[0], values[1] if len(values) > 1 else values[0] * 0.1)
+        elif self.kind == 'lognormal':
+            ms = values[0] * rng.lognormvariate(0, values[1] if len(values) > 1 else 0.5)
+        else:
+            ms = rng.expovariate(1 / values[0]) if values[0] > 0 else 0.0
+        return max(0.0, ms) / 1000
+
+class StubConfig:
+    """Behaviour shared by the stubs; adjustable at runtime through /__stub/config"""
+
+    def __init__(self, latency: str = 'fixed:0', token_latency: str = 'fixed:0', error_rate: float = 0.0,
+                 rate_limit_rate: float = 0.0, retry_after: float = 1.0, reply_tokens: int = 60,
+                 seed: int = 42, record_path: str = None, max_recorded: int = 10000):
+        self.latency = LatencyProfile(latency)
+        self.token_latency = LatencyProfile(token_latency)
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.reply_tokens = reply_tokens
+        self.seed = seed
+        self.record_path = record_path
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.requests = deque(maxlen=max_recorded)
+
+    def update(self, changes: Dict):
+        with self._lock:
+            for key, value in changes.items():
+                if key in ('latency', 'token_latency'):
+                    setattr(self, key, LatencyProfile(value))
+                elif key in ('error_rate', 'rate_limit_rate', 'retry_after'):
+                    setattr(self, key, float(value))
+                elif key == 'reply_tokens':
+                    self.reply_tokens = int(value)
+                elif key == 'seed':
+                    self.seed = int(value)
+                    self._rng = random.Random(self.seed)
+
+    def sample_latency(self, profile: str = 'latency') -> float:
+        with self._lock:
+            return getattr(self, profile).sample(self._rng)
+
+    def pick_fault(self) -> Optional[str]:
+        """None, 'rate_limit' or 'error'"""
+        with self._lock:
+            roll = self._rng.random()
+        if roll < self.rate_limit_rate:
+            return 'rate_limit'
+        if roll < self.rate_limit_rate + self.error_rate:
+            return 'error'
+        return None
+
+    def record(self, entry: Dict):
+        entry['recorded_at'] = time.time()
+        with self._lock:
+            self.requests.append(entry)
+            if self.record_path:
+                with open(self.record_path, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+
+    def reset(self):
+        with self._lock:
+            self.requests.clear()
+            self._rng = random.Random(self.seed)
+
+    def to_dict(self) -> Dict:
+        return {
+            'latency': self.latency.spec,
+            'token_latency': self.token_latency.spec,
+            'error_rate': self.error_rate,
+            'rate_limit_rate': self.rate_limit_rate,
+            'retry_after': self.retry_after,
+            'reply_tokens': self.reply_tokens,
+            'seed': self.seed,
+            'recorded': len(self.requests)
+        }
+
+class _StubHandler(BaseHTTPRequestHandler):
+    """JSON plumbing, control endpoints and recording shared by the HTTP stubs"""
+    protocol_version = 'HTTP/1.1'
+    service = 'stub'
+
+    @property
+    def config(self) -> StubConfig:
+        return self.server.config
+
+    def log_message(self, format, *args):
+        logging.debug(f"{self.service} stub: {format % args}")
+
+    def _read_body(self) -> bytes:
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length) if length else b''
+
+    def _send_json(self, status: int, payload: Dict, headers: Dict = None):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _record(self, status: int, started: float, **details):
+        self.config.record(dict(details, service=self.service, method=self.command,
+                                path=urlparse(self.path).path, status=status,
+                                latency_ms=round((time.monotonic() - started) * 1000, 2)))
+
+    def _control(self, body: bytes) -> bool:
+        """Handle /__stub/* requests; returns True if this was one"""
+        path = urlparse(self.path).path
+        if not path.startswith('/__stub/'):
+            return False
+        if path == '/__stub/requests':
+            self._send_json(200, {'requests': list(self.config.requests)})
+        elif path == '/__stub/config':
+            if self.command == 'POST':
+                self.config.update(json.loads(body or b'{}'))
+            self._send_json(200, self.config.to_dict())
+        elif path == '/__stub/reset':
+            self.config.reset()
+            self._send_json(200, self.config.to_dict())
+        else:
+            self._send_json(404, {'error': 'unknown stub endpoint'})
+        return True
+
+    def do_GET(self):
+        self._handle(b'')
+
+    def do_POST(self):
+        self._handle(self._read_body())
+
+    def do_DELETE(self):
+        self._handle(self._read_body())
+
+    def _handle(self, body: bytes):
+        if self._control(body):
+            return
+        started = time.monotonic()
+        time.sleep(self.config.sample_latency())
+        fault = self.config.pick_fault()
+        if fault:
+            status = self._send_fault(fault)
+            self._record(status, started, fault=fault)
+            return
+        self.handle_request(body, started)
+
+    def _send_fault(self, fault: str) -> int:
+        raise NotImplementedError
+
+    def handle_request(self, body: bytes, started: float):
+        raise NotImplementedError
+
+class OpenAIStubHandler(_StubHandler):
+    """/v1/chat/completions (plain and SSE streaming) and /v1/models"""
+    service = 'openai'
+
+    def _send_fault(self, fault: str) -> int:
+        if fault == 'rate_limit':
+            self._send_json(429, {'error': {'message': 'Rate limit reached (stub)', 'type': 'requests',
+                                            'param': None, 'code': 'rate_limit_exceeded'}},
+                            {'retry-after': str(self.config.retry_after),
+                             'retry-after-ms': str(int(self.config.retry_after * 1000))})
+            return 429
+        self._send_json(500, {'error': {'message': 'The server had an error (stub)', 'type': 'server_error',
+                                        'param': None, 'code': None}})
+        return 500
+
+    def handle_request(self, body: bytes, started: float):
+        path = urlparse(self.path).path.rstrip('/')
+        if path.endswith('/models'):
+            self._send_json(200, {'object': 'list', 'data': [
+                {'id': model, 'object': 'model', 'created': 0, 'owned_by': 'stub'}
+                for model in ('gpt-4o', 'gpt-4o-mini', 'gpt-4', 'gpt-4-turbo-preview', 'gpt-3.5-turbo')
+            ]})
+            self._record(200, started)
+            return
+        if not path.endswith('/chat/completions') or self.command != 'POST':
+            self._send_json(404, {'error': {'message': f'Unknown path {path}', 'type': 'invalid_request_error'}})
+            self._record(404, started)
+            return
+
+        try:
+            params = json.loads(body or b'{}')
+        except json.JSONDecodeError:
+            self._send_json(400, {'error': {'message': 'Invalid JSON body', 'type': 'invalid_request_error'}})
+            self._record(400, started)
+            return
+
+        model = params.get('model', 'gpt-4o')
+        messages = params.get('messages', [])
+        count = max(1, min(params.get('max_tokens') or self.config.reply_tokens, self.config.reply_tokens))
+        words = [REPLY_WORDS[index % len(REPLY_WORDS)] for index in range(count)]
+        usage = {'prompt_tokens': get_estimator(model).count_messages(messages), 'completion_tokens': count}
+        usage['total_tokens'] = usage['prompt_tokens'] + usage['completion_tokens']
+        completion_id = f"chatcmpl-stub{uuid.uuid4().hex[:20]}"
+        details = {'model': model, 'stream': bool(params.get('stream')), 'messages': len(messages), **usage}
+
+        if params.get('stream'):
+            self._stream(completion_id, model, words, usage,
+                         bool((params.get('stream_options') or {}).get('include_usage')))
+        else:
+            self._send_json(200, {
+                'id': completion_id,
+                'object': 'chat.completion',
+                'created': int(time.time()),
+                'model': model,
+                'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': ' '.join(words)},
+                             'logprobs': None, 'finish_reason': 'stop'}],
+                'usage': usage
+            })
+        self._record(200, started, **details)
+
+    def _stream(self, completion_id: str, model: str, words: List[str], usage: Dict, include_usage: bool):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+
+        def chunk(delta: Dict, finish_reason=None, chunk_usage=None, choices=True):
+            payload = {'id': completion_id, 'object': 'chat.completion.chunk', 'created': int(time.time()),
+                       'model': model,
+                       'choices': [{'index': 0, 'delta': delta, 'logprobs': None,
+                                    'finish_reason': finish_reason}] if choices else []}
+            if include_usage:
+                payload['usage'] = chunk_usage
+            self.wfile.write(f"data: {json.dumps(payload)}\n\n".encode('utf-8'))
+            self.wfile.flush()
+
+        try:
+            chunk({'role': 'assistant', 'content': ''})
+            for index, word in enumerate(words):
+                time.sleep(self.config.sample_latency('token_latency'))
+                chunk({'content': word if index == 0 else ' ' + word})
+            chunk({}, finish_reason='stop')
+            if include_usage:
+                chunk({}, chunk_usage=usage, choices=False)
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            # Client abandoned the stream (e.g. a losing hedge)
+            pass
+
+def _parse_form(body: bytes) -> Dict:
+    """Stripe-style form encoding; metadata[key]=value becomes a nested dict"""
+    params: Dict = {}
+    for key, value in parse_qsl(body.decode('utf-8'), keep_blank_values=True):
+        if '[' in key:
+            name, _, rest = key.partition('[')
+            if name == 'metadata':
+                params.setdefault('metadata', {})[rest.rstrip(']')] = value
+                continue
+        params[key] = value
+    return params
+
+def sign_webhook(payload: bytes, secret: str, timestamp: int = None) -> str:
+    """Stripe-Signature header value for payload, as stripe.Webhook.construct_event expects"""
+    timestamp = timestamp or int(time.time())
+    signature = hmac.new(secret.encode('utf-8'), f"{timestamp}.".encode('utf-8') + payload, hashlib.sha256).hexdigest()
+    return f"t={timestamp},v1={signature}"
+
+def checkout_completed_event(session_id: str, metadata: Dict) -> Dict:
+    """A checkout.session.completed event body for posting to /api/stripe-webhook"""
+    return {
+        'id': f"evt_stub{uuid.uuid4().hex[:16]}",
+        'object': 'event',
+        'api_version': '2023-10-16',
+        'created': int(time.time()),
+        'type': 'checkout.session.completed',
+        'livemode': False,
+        'data': {'object': {'id': session_id, 'object': 'checkout.session', 'mode': 'subscription',
+                            'payment_status': 'paid', 'status': 'complete', 'metadata': metadata}}
+    }
+
+class StripeStubHandler(_StubHandler):
+    """Checkout sessions plus a generic echo for other API objects"""
+    service = 'stripe'
+
+    def _send_fault(self, fault: str) -> int:
+        if fault == 'rate_limit':
+            self._send_json(429, {'error': {'message': 'Too many requests (stub)', 'type': 'invalid_request_error',
+                                            'code': 'rate_limit'}})
+            return 429
+        self._send_json(500, {'error': {'message': 'An unknown error occurred (stub)', 'type': 'api_error'}})
+        return 500
+
+    def handle_request(self, body: bytes, started: float):
+        path = urlparse(self.path).path.rstrip('/')
+        params = _parse_form(body) if body else {}
+        parts = [part for part in path.split('/') if part]
+        if parts and parts[0] == 'v1':
+            parts = parts[1:]
+        if not parts:
+            self._send_json(404, {'error': {'message': 'Unrecognized request URL', 'type': 'invalid_request_error'}})
+            self._record(404, started)
+            return
+
+        host = self.headers.get('Host', '127.0.0.1')
+        if parts[:2] == ['checkout', 'sessions']:
+            session_id = parts[2] if len(parts) > 2 else f"cs_test_stub{uuid.uuid4().hex[:24]}"
+            payload = {
+                'id': session_id,
+                'object': 'checkout.session',
+                'mode': params.get('mode', 'subscription'),
+                'status': 'open',
+                'payment_status': 'unpaid',
+                'success_url': params.get('success_url'),
+                'cancel_url': params.get('cancel_url'),
+                'metadata': params.get('metadata', {}),
+                'url': f"http://{host}/pay/{session_id}",
+                'livemode': False
+            }
+        else:
+            object_type = parts[0].rstrip('s')
+            payload = dict({key: value for key, value in params.items() if '[' not in key},
+                           id=parts[1] if len(parts) > 1 else f"{object_type[:3]}_stub{uuid.uuid4().hex[:16]}",
+                           object=object_type, livemode=False)
+        self._send_json(200, payload, {'Request-Id': f"req_stub{uuid.uuid4().hex[:14]}"})
+        self._record(200, started, object=payload.get('object'), id=payload.get('id'))
+
+class SMTPStubHandler(socketserver.StreamRequestHandler):
+    """Just enough ESMTP for smtplib: EHLO, AUTH, MAIL, RCPT, DATA, RSET, NOOP, QUIT (no TLS)"""
+
+    def _reply(self, line: str):
+        self.wfile.write((line + '\r\n').encode('utf-8'))
+
+    def handle(self):
+        config: StubConfig = self.server.config
+        self._reply('220 soulbridge-stub ESMTP ready')
+        sender, recipients = None, []
+        while True:
+            raw = self.rfile.readline()
+            if not raw:
+                return
+            command = raw.decode('utf-8', 'replace').strip()
+            verb = command.split(' ', 1)[0].upper()
+            if verb in ('EHLO', 'HELO'):
+                if verb == 'EHLO':
+                    self._reply('250-soulbridge-stub')
+                    self._reply('250-AUTH PLAIN LOGIN')
+                    self._reply('250 8BITMIME')
+                else:
+                    self._reply('250 soulbridge-stub')
+            elif verb == 'AUTH':
+                self._auth(command)
+            elif verb == 'MAIL':
+                sender, recipients = command.split(':', 1)[-1].strip(), []
+                self._reply('250 OK')
+            elif verb == 'RCPT':
+                recipients.append(command.split(':', 1)[-1].strip())
+                self._reply('250 OK')
+            elif verb == 'DATA':
+                self._data(config, sender, recipients)
+                sender, recipients = None, []
+            elif verb in ('RSET', 'NOOP'):
+                self._reply('250 OK')
+            elif verb == 'QUIT':
+                self._reply('221 Bye')
+                return
+            elif verb == 'STARTTLS':
+                self._reply('454 TLS not available on the stub; set SMTP_STARTTLS=false')
+            else:
+                self._reply('502 Command not implemented')
+
+    def _auth(self, command: str):
+        parts = command.split()
+        mechanism = parts[1].upper() if len(parts) > 1 else ''
+        # Any credentials are accepted
+        if mechanism == 'LOGIN':
+            if len(parts) < 3:
+                self._reply('334 VXNlcm5hbWU6')
+                self.rfile.readline()
+            self._reply('334 UGFzc3dvcmQ6')
+            self.rfile.readline()
+        elif mechanism == 'PLAIN' and len(parts) < 3:
+            self._reply('334 ')
+            self.rfile.readline()
+        self._reply('235 Authentication successful')
+
+    def _data(self, config: StubConfig, sender: Optional[str], recipients: List[str]):
+        started = time.monotonic()
+        self._reply('354 End data with <CR><LF>.<CR><LF>')
+        size = 0
+        subject = ''
+        while True:
+            line = self.rfile.readline()
+            if not line or line in (b'.\r\n', b'.\n'):
+                break
+            size += len(line)
+            if not subject and line.lower().startswith(b'subject:'):
+                subject = line[8:].decode('utf-8', 'replace').strip()
+        time.sleep(config.sample_latency())
+        fault = config.pick_fault()
+        if fault == 'rate_limit':
+            self._reply('451 4.7.1 Too many messages, slow down (stub)')
+            status = 451
+        elif fault == 'error':
+            self._reply('554 5.3.0 Transaction failed (stub)')
+            status = 554
+        else:
+            self._reply(f"250 OK queued as stub{uuid.uuid4().hex[:10]}")
+            status = 250
+        config.record({'service': 'smtp', 'method': 'DATA', 'path': '', 'status': status, 'fault': fault,
+                       'from': sender, 'to': recipients, 'subject': subject, 'bytes': size,
+                       'latency_ms': round((time.monotonic() - started) * 1000, 2)})
+
+class _ThreadingSMTPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+class StubServers:
+    """The three stubs running in background threads, sharing one StubConfig"""
+
+    def __init__(self, config: StubConfig = None, host: str = '127.0.0.1', openai_port: int = 8601,
+                 stripe_port: int = 8602, smtp_port: int = 8625):
+        self.config = config or StubConfig()
+        self.host = host
+        self.servers = []
+        for handler, port in ((OpenAIStubHandler, openai_port), (StripeStubHandler, stripe_port)):
+            server = ThreadingHTTPServer((host, port), handler)
+            server.daemon_threads = True
+            server.config = self.config
+            self.servers.append(server)
+        smtp = _ThreadingSMTPServer((host, smtp_port), SMTPStubHandler)
+        smtp.config = self.config
+        self.servers.append(smtp)
+        self._threads = []
+
+    @property
+    def ports(self) -> Dict[str, int]:
+        return dict(zip(('openai', 'stripe', 'smtp'), (server.server_address[1] for server in self.servers)))
+
+    def start(self) -> 'StubServers':
+        for server in self.servers:
+            thread = threading.Thread(target=server.serve_forever, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def stop(self):
+        for server in self.servers:
+            server.shutdown()
+            server.server_close()
+
+    def env(self) -> Dict[str, str]:
+        """Environment that points the app at these stubs"""
+        ports = self.ports
+        return {
+            'OPENAI_API_KEY': 'sk-stub',
+            'OPENAI_BASE_URL': f"http://{self.host}:{ports['openai']}/v1",
+            'STRIPE_SECRET_KEY': 'sk_test_stub',
+            'STRIPE_API_BASE': f"http://{self.host}:{ports['stripe']}",
+            'STRIPE_WEBHOOK_SECRET': 'whsec_stub',
+            'SMTP_SERVER': self.host,
+            'SMTP_PORT': str(ports['smtp']),
+            'SMTP_STARTTLS': 'false',
+            'SMTP_USERNAME': 'stub',
+            'SMTP_PASSWORD': 'stub'
+        }
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Run local OpenAI/Stripe/SMTP stub servers")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--openai-port', type=int, default=8601)
+    parser.add_argument('--stripe-port', type=int, default=8602)
+    parser.add_argument('--smtp-port', type=int, default=8625)
+    parser.add_argument('--latency', default='fixed:0', help="Per-request latency, e.g. lognormal:400,0.5")
+    parser.add_argument('--token-latency', default='fixed:0', help="Delay between streamed tokens")
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--rate-limit-rate', type=float, default=0.0)
+    parser.add_argument('--retry-after', type=float, default=1.0)
+    parser.add_argument('--reply-tokens', type=int, default=60)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--record', help="Append every request to this JSONL file")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    config = StubConfig(latency=args.latency, token_latency=args.token_latency, error_rate=args.error_rate,
+                        rate_limit_rate=args.rate_limit_rate, retry_after=args.retry_after,
+                        reply_tokens=args.reply_tokens, seed=args.seed, record_path=args.record)
+    stubs = StubServers(config, args.host, args.openai_port, args.stripe_port, args.smtp_port).start()
+    print("Stub servers running. Point the app at them with:")
+    for key, value in stubs.env().items():
+        print(f"  {key}={value}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        stubs.stop()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
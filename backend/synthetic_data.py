@@ -0,0 +1,206 @@
+"""
+Synthetic soulbridge_data.json datasets for load tests and benchmarks
+
+Records follow the shapes models.py writes (users with chatHistory, support tickets,
+invoices, knowledge-base articles, session logs). Chat history lengths are heavy-tailed
+like real usage: most users have a handful of messages, a few have hundreds. Output is
+deterministic for a given seed.
+
+Usage:
+    python synthetic_data.py --users 10000 --output soulbridge_data.json
+"""
+
+import sys
+import json
+import uuid
+import random
+import argparse
+from datetime import datetime, timedelta
+from typing import Dict
+
+COMPANIONS = ['Blayzo', 'Blayzica', 'Crimson', 'Violet', 'Blayzion', 'Blayzia']
+COMPANION_COLORS = {'Blayzo': 'cyan', 'Blayzica': 'red', 'Crimson': 'red', 'Violet': 'violet',
+                    'Blayzion': 'galaxy', 'Blayzia': 'galaxy'}
+SUBSCRIPTIONS = [('free', 0.8), ('plus', 0.15), ('galaxy', 0.05)]
+TICKET_CATEGORIES = ['general', 'billing', 'technical', 'bug_report', 'feature_request']
+TICKET_PRIORITIES = [('low', 0.3), ('medium', 0.45), ('high', 0.2), ('urgent', 0.05)]
+TICKET_STATUSES = ['open', 'in_progress', 'pending', 'resolved', 'closed']
+ARTICLE_CATEGORIES = ['getting_started', 'troubleshooting', 'billing', 'features']
+
+USER_MESSAGES = [
+    "I've been feeling really stressed about work lately",
+    "Can we talk about my sister? We had a fight",
+    "I couldn't sleep again last night",
+    "I passed my exam today!",
+    "My dog has been sick and I'm worried about him",
+    "How do I stop overthinking everything?",
+    "I feel lonely since I moved to a new city",
+    "Thanks for listening yesterday, it helped",
+    "I'm nervous about a job interview tomorrow",
+    "What are some ways to relax before bed?",
+    "My friends don't seem to understand me",
+    "I started journaling like you suggested",
+]
+AI_RESPONSES = [
+    "That sounds like a lot to carry. What's weighing on you the most right now?",
+    "I'm really glad you told me. How are you feeling about it now?",
+    "That's wonderful news! You worked hard for this.",
+    "Let's take it one step at a time. What would help you feel a little calmer tonight?",
+    "It makes sense to feel that way. You're not alone in this.",
+]
+TOPICS = ['subscription', 'billing', 'password', 'companion', 'voice', 'chat history', 'refund', 'export',
+          'notifications', 'account', 'referral', 'premium', 'colors', 'privacy', 'mobile app']
+
+def _weighted(rng: random.Random, choices) -> str:
+    roll = rng.random()
+    for value, weight in choices:
+        roll -= weight
+        if roll <= 0:
+            return value
+    return choices[-1][0]
+
+def _timestamp(start: datetime, rng: random.Random, days: int = 365) -> str:
+    return (start + timedelta(seconds=rng.randint(0, days * 86400))).isoformat() + "Z"
+
+def _id(rng: random.Random, prefix: str, length: int = 8) -> str:
+    return f"{prefix}{uuid.UUID(int=rng.getrandbits(128)).hex[:length]}"
+
+def chat_history_length(rng: random.Random, mean: float, cap: int = 500) -> int:
+    """Heavy-tailed message count (lognormal, about `mean` on average)"""
+    if mean <= 0:
+        return 0
+    return min(cap, int(rng.lognormvariate(0, 1.2) * mean / 2.05))
+
+def generate_dataset(users: int = 1000, seed: int = 42, chat_mean: float = 8, tickets_per_user: float = 0.2,
+                     invoices_per_user: float = 0.3, articles: int = 200, session_logs: int = 2000) -> Dict:
+    rng = random.Random(seed)
+    start = datetime(2025, 1, 1)
+    data = {"users": [], "support_tickets": [], "invoices": [], "knowledge_base": [], "chat_sessions": [],
+            "session_logs": []}
+
+    for index in range(users):
+        companion = rng.choice(COMPANIONS)
+        history = []
+        for _ in range(chat_history_length(rng, chat_mean)):
+            history.append({
+                "messageID": _id(rng, 'msg'),
+                "timestamp": _timestamp(start, rng),
+                "userMessage": rng.choice(USER_MESSAGES),
+                "aiResponse": rng.choice(AI_RESPONSES)
+            })
+        history.sort(key=lambda message: message["timestamp"])
+        data["users"].append({
+            "userID": _id(rng, 'uid'),
+            "email": f"user{index}@example.com",
+            "subscriptionStatus": _weighted(rng, SUBSCRIPTIONS),
+            "companion": companion,
+            "chatHistory": history,
+            "settings": {"colorPalette": COMPANION_COLORS[companion], "voiceEnabled": True, "historySaving": True},
+            "createdDate": _timestamp(start, rng)
+        })
+
+    for _ in range(int(users * tickets_per_user)):
+        created = _timestamp(start, rng)
+        topic = rng.choice(TOPICS)
+        data["support_tickets"].append({
+            "ticketID": _id(rng, 'ticket_'),
+            "userEmail": f"user{rng.randrange(max(1, users))}@example.com",
+            "subject": f"Question about {topic}",
+            "description": f"I need help with my {topic}. " * rng.randint(1, 5),
+            "priority": _weighted(rng, TICKET_PRIORITIES),
+            "category": rng.choice(TICKET_CATEGORIES),
+            "status": rng.choice(TICKET_STATUSES),
+            "assignedTo": None,
+            "createdAt": created,
+            "updatedAt": created,
+            "responses": []
+        })
+
+    for _ in range(int(users * invoices_per_user)):
+        plan = rng.choice(['monthly', 'yearly'])
+        amount = 10.0 if plan == 'monthly' else 100.0
+        created = _timestamp(start, rng)
+        status = rng.choice(['paid', 'paid', 'paid', 'pending', 'failed'])
+        data["invoices"].append({
+            "invoiceID": _id(rng, 'inv_'),
+            "userEmail": f"user{rng.randrange(max(1, users))}@example.com",
+            "amount": amount,
+            "planType": plan,
+            "status": status,
+            "stripeInvoiceID": None,
+            "stripeCustomerID": None,
+            "createdAt": created,
+            "paidAt": created if status == 'paid' else None,
+            "dueDate": created,
+            "currency": "usd",
+            "taxAmount": 0.0,
+            "subtotal": amount,
+            "total": amount
+        })
+
+    for index in range(articles):
+        topic = TOPICS[index % len(TOPICS)]
+        created = _timestamp(start, rng)
+        data["knowledge_base"].append({
+            "articleID": _id(rng, 'kb_'),
+            "title": f"How to manage your {topic} ({index})",
+            "content": f"This guide explains {topic} settings step by step. " * rng.randint(3, 30),
+            "category": rng.choice(ARTICLE_CATEGORIES),
+            "authorEmail": "admin@soulbridgeai.com",
+            "tags": rng.sample(TOPICS, 3),
+            "status": "published" if rng.random() < 0.9 else "draft",
+            "views": rng.randint(0, 5000),
+            "helpful_votes": rng.randint(0, 200),
+            "unhelpful_votes": rng.randint(0, 50),
+            "createdAt": created,
+            "updatedAt": created
+        })
+
+    for _ in range(min(session_logs, 2000)):
+        data["session_logs"].append({
+            "id": _id(rng, '', 16),
+            "userEmail": f"user{rng.randrange(max(1, users))}@example.com",
+            "userMessage": rng.choice(USER_MESSAGES),
+            "aiResponse": rng.choice(AI_RESPONSES),
+            "timestamp": _timestamp(start, rng),
+            "type": "chat_session",
+            "companion": rng.choice(COMPANIONS)
+        })
+
+    data["metadata"] = {"version": "1.0", "created": start.isoformat() + "Z",
+                        "lastUpdated": datetime.utcnow().isoformat() + "Z",
+                        "synthetic": {"users": users, "seed": seed, "chat_mean": chat_mean}}
+    return data
+
+def write_dataset(path: str, **options) -> Dict:
+    """Generate a dataset and write it where DatabaseManager will load it; returns record counts"""
+    data = generate_dataset(**options)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+    return dataset_counts(data)
+
+def dataset_counts(data: Dict) -> Dict:
+    return {
+        'users': len(data['users']),
+        'messages': sum(len(user['chatHistory']) for user in data['users']),
+        'support_tickets': len(data['support_tickets']),
+        'invoices': len(data['invoices']),
+        'knowledge_base': len(data['knowledge_base'])
+    }
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Generate a synthetic soulbridge_data.json")
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--chat-mean', type=float, default=8, help="Average chat messages per user")
+    parser.add_argument('--articles', type=int, default=200)
+    parser.add_argument('--output', default='soulbridge_data.json')
+    args = parser.parse_args()
+
+    counts = write_dataset(args.output, users=args.users, seed=args.seed, chat_mean=args.chat_mean,
+                           articles=args.articles)
+    print(json.dumps(counts, indent=2))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,132 @@
+# Local Token Estimation
+#
+# Prompt sizes are needed before a request is sent (context packing, quota checks, cost
+# projection). tiktoken gives exact counts when installed; otherwise a per-family
+# heuristic stays within a few percent for chat text. Static system prompts are counted
+# once and cached.
+import re
+import math
+import threading
+from typing import Dict, Iterable, List, Optional
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+# Chat format overhead per message (role + separators) and per reply priming
+MESSAGE_OVERHEAD_TOKENS = 4
+REPLY_PRIMING_TOKENS = 3
+
+# Model family -> (tiktoken encoding, average characters per token for word pieces)
+MODEL_FAMILIES = {
+    'o200k': ('o200k_base', 4.5),
+    'cl100k': ('cl100k_base', 4.0)
+}
+
+_PIECE_PATTERN = re.compile(r"[A-Za-z]+|\d{1,3}|[^\sA-Za-z\d]")
+
+def model_family(model: str) -> str:
+    """gpt-4o / o-series use o200k; gpt-4 and gpt-3.5 use cl100k"""
+    model = (model or '').lower()
+    if model.startswith(('gpt-4o', 'o1', 'o3', 'o4', 'gpt-4.1', 'gpt-5')):
+        return 'o200k'
+    return 'cl100k'
+
+class TokenEstimator:
+    """Token counts for one model family"""
+
+    def __init__(self, family: str):
+        self.family = family
+        encoding_name, self.chars_per_token = MODEL_FAMILIES[family]
+        self.encoding = None
+        if tiktoken is not None:
+            try:
+                self.encoding = tiktoken.get_encoding(encoding_name)
+            except Exception:
+                self.encoding = None
+        self._static_counts: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def exact(self) -> bool:
+        return self.encoding is not None
+
+    def count(self, text: str) -> int:
+        if not text:
+            return 0
+        if self.encoding is not None:
+            return len(self.encoding.encode(text, disallowed_special=()))
+        return self._estimate(text)
+
+    def _estimate(self, text: str) -> int:
+        tokens = 0
+        for piece in _PIECE_PATTERN.findall(text):
+            if piece.isascii():
+                tokens += math.ceil(len(piece) / self.chars_per_token) if piece.isalpha() else 1
+            else:
+                # Emoji and other non-ASCII symbols usually cost a couple of tokens each
+                tokens += 2 if self.family == 'cl100k' else 1
+        return max(1, tokens)
+
+    def count_static(self, text: str) -> int:
+        """Count for text that never changes (system prompts), computed once"""
+        count = self._static_counts.get(text)
+        if count is None:
+            count = self.count(text)
+            with self._lock:
+                self._static_counts[text] = count
+        return count
+
+    def register_static(self, texts: Iterable[str]):
+        """Pre-count static prompts at startup"""
+        for text in texts:
+            self.count_static(text)
+
+    def count_message(self, message: Dict) -> int:
+        return self.count(message.get('content', '')) + MESSAGE_OVERHEAD_TOKENS
+
+    def count_messages(self, messages: List[Dict]) -> int:
+        """Prompt size of a chat request; system messages use the static cache"""
+        total = REPLY_PRIMING_TOKENS
+        for message in messages:
+            content = message.get('content', '')
+            if message.get('role') == 'system':
+                total += self.count_static(content) + MESSAGE_OVERHEAD_TOKENS
+            else:
+                total += self.count(content) + MESSAGE_OVERHEAD_TOKENS
+        return total
+
+    def estimate_request(self, messages: List[Dict], max_tokens: int) -> int:
+        """Upper bound on the tokens a request can use: prompt + the completion allowance"""
+        return self.count_messages(messages) + max_tokens
+
+    def truncate_tail(self, text: str, max_tokens: int) -> str:
+        """Keep the last max_tokens tokens of text"""
+        if self.count(text) <= max_tokens:
+            return text
+        if self.encoding is not None:
+            tokens = self.encoding.encode(text, disallowed_special=())
+            return self.encoding.decode(tokens[-max_tokens:])
+        return text[-int(max_tokens * self.chars_per_token):]
+
+    def get_stats(self) -> Dict:
+        return {
+            'family': self.family,
+            'exact': self.exact,
+            'static_prompts_cached': len(self._static_counts)
+        }
+
+_estimators: Dict[str, TokenEstimator] = {}
+_estimators_lock = threading.Lock()
+
+def get_estimator(model: Optional[str] = 'gpt-4o') -> TokenEstimator:
+    """Shared estimator for a model's family"""
+    family = model_family(model)
+    estimator = _estimators.get(family)
+    if estimator is None:
+        with _estimators_lock:
+            estimator = _estimators.get(family)
+            if estimator is None:
+                estimator = _estimators[family] = TokenEstimator(family)
+    return estimator
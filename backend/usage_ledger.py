@@ -0,0 +1,281 @@
+# Per-User Token and Cost Ledger with Tier Quotas
+#
+# Every LLM call is counted in memory and flushed to SQLite in batches by a background
+# thread. Daily token quotas per tier are checked before the upstream call.
+import os
+import time
+import atexit
+import sqlite3
+import logging
+import threading
+from datetime import datetime, timedelta
+from typing import Dict, List, Tuple
+
+# USD per 1K tokens: (prompt, completion)
+MODEL_PRICING = {
+    'gpt-4o': (0.0025, 0.01),
+    'gpt-4o-mini': (0.00015, 0.0006),
+    'gpt-4-turbo-preview': (0.01, 0.03),
+    'gpt-4': (0.03, 0.06),
+    'gpt-3.5-turbo': (0.0005, 0.0015)
+}
+
+# Daily token allowance per model tier (see llm_scheduler.subscription_tier)
+DEFAULT_DAILY_TOKEN_QUOTAS = {
+    'free': 20000,
+    'premium': 200000,
+    'galaxy': 1000000,
+    # Shared by every anonymous session from one client address (NAT, cookie-less API clients)
+    'anonymous_ip': 200000
+}
+
+QUOTA_EXCEEDED_MESSAGE = "You've reached today's chat limit for your plan. Upgrade for more time together, or come back tomorrow. 💙"
+
+class QuotaExceeded(Exception):
+    """The user has used up their tier's daily token allowance"""
+
+    def __init__(self, user_id: str, tier: str, used: int, limit: int):
+        super().__init__(f"Daily token quota exceeded for {user_id} ({tier}): {used}/{limit}")
+        self.user_id = user_id
+        self.tier = tier
+        self.used = used
+        self.limit = limit
+        self.user_message = QUOTA_EXCEEDED_MESSAGE
+
+def estimate_cost(model: str, prompt_tokens: int, completion_tokens: int) -> float:
+    prompt_rate, completion_rate = MODEL_PRICING.get(model, MODEL_PRICING['gpt-4o'])
+    return (prompt_tokens / 1000) * prompt_rate + (completion_tokens / 1000) * completion_rate
+
+class UsageLedger:
+    """Atomic in-memory usage counters, batched into a daily SQLite ledger"""
+
+    def __init__(self, db_path: str = None, flush_interval: float = None, quotas: Dict[str, int] = None,
+                 quota_refresh_seconds: float = 30):
+        self.db_path = db_path or os.environ.get('USAGE_DB', 'soulbridge_usage.db')
+        self.flush_interval = flush_interval or float(os.environ.get('USAGE_FLUSH_INTERVAL', '10'))
+        self.quotas = quotas or {
+            tier: int(os.environ.get(f'USAGE_DAILY_TOKENS_{tier.upper()}', default))
+            for tier, default in DEFAULT_DAILY_TOKEN_QUOTAS.items()
+        }
+        self.quota_refresh_seconds = quota_refresh_seconds
+
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        # (day, user_id, companion, model) -> [requests, prompt_tokens, completion_tokens, cost]
+        self._pending: Dict[Tuple[str, str, str, str], List] = {}
+        # (day, user_id) -> [tokens already in the database, tokens counted since, refreshed_at]
+        self._day_totals: Dict[Tuple[str, str], List] = {}
+        self._worker = None
+        self.flushes = 0
+        self.quota_rejections = 0
+        self.init_database()
+
+    def get_connection(self):
+        """Get database connection"""
+        return sqlite3.connect(self.db_path, timeout=10)
+
+    def init_database(self):
+        """Initialize the usage ledger table"""
+        conn = self.get_connection()
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS usage_daily (
+                day TEXT NOT NULL,
+                user_id TEXT NOT NULL,
+                companion TEXT NOT NULL,
+                model TEXT NOT NULL,
+                requests INTEGER NOT NULL DEFAULT 0,
+                prompt_tokens INTEGER NOT NULL DEFAULT 0,
+                completion_tokens INTEGER NOT NULL DEFAULT 0,
+                cost REAL NOT NULL DEFAULT 0,
+                PRIMARY KEY (day, user_id, companion, model)
+            )
+        ''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_usage_user_day ON usage_daily (user_id, day)')
+        conn.commit()
+        conn.close()
+
+    @staticmethod
+    def _today() -> str:
+        return datetime.utcnow().strftime('%Y-%m-%d')
+
+    def record(self, user_id: str, companion: str, model: str, prompt_tokens: int = 0,
+               completion_tokens: int = 0, cost: float = None):
+        """Count one completed LLM call; cheap enough to call on every request"""
+        user_id = user_id or 'anonymous'
+        if cost is None:
+            cost = estimate_cost(model, prompt_tokens, completion_tokens)
+        day = self._today()
+        key = (day, user_id, companion or '-', model)
+        with self._lock:
+            counters = self._pending.get(key)
+            if counters is None:
+                counters = self._pending[key] = [0, 0, 0, 0.0]
+            counters[0] += 1
+            counters[1] += prompt_tokens
+            counters[2] += completion_tokens
+            counters[3] += cost
+            totals = self._day_totals.get((day, user_id))
+            if totals is not None:
+                totals[1] += prompt_tokens + completion_tokens
+        self._ensure_worker()
+
+    def check_quota(self, user_id: str, tier: str, estimated_tokens: int = 0):
+        """Raise QuotaExceeded if this request would take the user past today's allowance"""
+        limit = self.quotas.get(tier, self.quotas.get('free'))
+        if not limit or limit <= 0:
+            return
+        used = self.get_tokens_today(user_id)
+        if used + estimated_tokens > limit:
+            with self._lock:
+                self.quota_rejections += 1
+            raise QuotaExceeded(user_id, tier, used, limit)
+
+    def get_tokens_today(self, user_id: str) -> int:
+        """Tokens used today: the database total (shared by all workers, refreshed periodically) plus local counts"""
+        user_id = user_id or 'anonymous'
+        day = self._today()
+        now = time.monotonic()
+        with self._lock:
+            totals = self._day_totals.get((day, user_id))
+            if totals is not None and now - totals[2] < self.quota_refresh_seconds:
+                return totals[0] + totals[1]
+
+        stored = self._load_day_total(day, user_id)
+        with self._lock:
+            # Local calls not yet flushed still count
+            unflushed = sum(counters[1] + counters[2] for key, counters in self._pending.items()
+                            if key[0] == day and key[1] == user_id)
+            self._day_totals[(day, user_id)] = [stored, unflushed, now]
+            if len(self._day_totals) > 50000:
+                self._day_totals = {key: value for key, value in self._day_totals.items() if key[0] == day}
+            return stored + unflushed
+
+    def _load_day_total(self, day: str, user_id: str) -> int:
+        conn = self.get_connection()
+        try:
+            row = conn.execute(
+                'SELECT COALESCE(SUM(prompt_tokens + completion_tokens), 0) FROM usage_daily WHERE day = ? AND user_id = ?',
+                (day, user_id)
+            ).fetchone()
+            return row[0]
+        finally:
+            conn.close()
+
+    def flush(self):
+        """Write pending counters in one transaction"""
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+            if not pending:
+                return
+
+            rows = [key + tuple(counters) for key, counters in pending.items()]
+            conn = self.get_connection()
+            try:
+                conn.executemany('''
+                    INSERT INTO usage_daily (day, user_id, companion, model, requests, prompt_tokens, completion_tokens, cost)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT (day, user_id, companion, model) DO UPDATE SET
+                        requests = requests + excluded.requests,
+                        prompt_tokens = prompt_tokens + excluded.prompt_tokens,
+                        completion_tokens = completion_tokens + excluded.completion_tokens,
+                        cost = cost + excluded.cost
+                ''', rows)
+                conn.commit()
+            except Exception as e:
+                logging.error(f"Usage ledger flush failed, keeping counters for the next flush: {e}")
+                with self._lock:
+                    for key, counters in pending.items():
+                        current = self._pending.setdefault(key, [0, 0, 0, 0.0])
+                        for index, value in enumerate(counters):
+                            current[index] += value
+                return
+            finally:
+                conn.close()
+
+            with self._lock:
+                self.flushes += 1
+                # Flushed tokens now live in the database share of each day total
+                for (day, user_id, _, _), counters in pending.items():
+                    totals = self._day_totals.get((day, user_id))
+                    if totals is not None:
+                        flushed = counters[1] + counters[2]
+                        totals[0] += flushed
+                        totals[1] -= flushed
+
+    def _ensure_worker(self):
+        if self._worker is None or not self._worker.is_alive():
+            with self._lock:
+                if self._worker is None or not self._worker.is_alive():
+                    self._worker = threading.Thread(target=self._run, name='usage-ledger', daemon=True)
+                    self._worker.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except Exception as e:
+                logging.error(f"Usage ledger flush error: {e}")
+
+    def get_top_spenders(self, days: int = 1, limit: int = 20, order_by: str = 'cost') -> List[Dict]:
+        """Heaviest users over the last N days (including today)"""
+        self.flush()
+        column = 'total_tokens' if order_by == 'tokens' else 'cost'
+        since = (datetime.utcnow() - timedelta(days=max(1, days) - 1)).strftime('%Y-%m-%d')
+        conn = self.get_connection()
+        try:
+            rows = conn.execute(f'''
+                SELECT user_id, SUM(requests), SUM(prompt_tokens), SUM(completion_tokens),
+                       SUM(prompt_tokens + completion_tokens) AS total_tokens, SUM(cost) AS cost
+                FROM usage_daily WHERE day >= ?
+                GROUP BY user_id ORDER BY {column} DESC LIMIT ?
+            ''', (since, limit)).fetchall()
+        finally:
+            conn.close()
+
+        return [{
+            'user_id': row[0],
+            'requests': row[1],
+            'prompt_tokens': row[2],
+            'completion_tokens': row[3],
+            'total_tokens': row[4],
+            'cost': round(row[5], 4)
+        } for row in rows]
+
+    def get_user_usage(self, user_id: str, days: int = 7) -> List[Dict]:
+        """Per-day, per-companion, per-model breakdown for one user"""
+        self.flush()
+        since = (datetime.utcnow() - timedelta(days=max(1, days) - 1)).strftime('%Y-%m-%d')
+        conn = self.get_connection()
+        try:
+            rows = conn.execute('''
+                SELECT day, companion, model, requests, prompt_tokens, completion_tokens, cost
+                FROM usage_daily WHERE user_id = ? AND day >= ? ORDER BY day DESC, cost DESC
+            ''', (user_id, since)).fetchall()
+        finally:
+            conn.close()
+
+        return [{
+            'day': row[0],
+            'companion': row[1],
+            'model': row[2],
+            'requests': row[3],
+            'prompt_tokens': row[4],
+            'completion_tokens': row[5],
+            'cost': round(row[6], 4)
+        } for row in rows]
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            return {
+                'pending_keys': len(self._pending),
+                'flushes': self.flushes,
+                'flush_interval_seconds': self.flush_interval,
+                'quota_rejections': self.quota_rejections,
+                'daily_token_quotas': dict(self.quotas)
+            }
+
+# Global instance
+usage_ledger = UsageLedger()
+atexit.register(usage_ledger.flush)